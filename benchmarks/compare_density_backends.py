@@ -0,0 +1,143 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import cv2
+import numpy as np
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(script_dir, "..", "src"))
+
+from cap.core import compute_ink_density, find_optimal_cuts_dp, DensityBackend
+from cap.io import load_image
+from cap.pipeline import IMAGE_EXTENSIONS, target_height_for_format
+from corpus import synthetic_scroll
+
+
+def load_corpus(corpus_dir, synthetic_count, synthetic_height, synthetic_width):
+
+    if corpus_dir and os.path.isdir(corpus_dir):
+        names = sorted(name for name in os.listdir(corpus_dir) if name.lower().endswith(IMAGE_EXTENSIONS))
+        for name in names:
+            yield name, load_image(os.path.join(corpus_dir, name))
+        return
+
+    for k in range(synthetic_count):
+        yield f"synthetic_{k:02d}", synthetic_scroll(synthetic_height, synthetic_width, seed=k)
+
+def _best_time(fn, repeats):
+
+    best = None
+    result = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def _cut_deltas(reference, other):
+
+    other = np.asarray(other)
+    return [int(np.min(np.abs(other - c))) for c in reference[1:-1]]
+
+def compare_image(name, img, target_height, repeats):
+
+    timings = {}
+    profiles = {}
+    for backend in DensityBackend:
+        timings[backend.value], profiles[backend.value] = _best_time(
+            lambda: compute_ink_density(img, backend=backend), repeats)
+
+    cuts = {backend: [int(c) for c in find_optimal_cuts_dp(profile, target_height)]
+            for backend, profile in profiles.items()}
+    gaussian = cuts[DensityBackend.GAUSSIAN.value]
+    integral = cuts[DensityBackend.INTEGRAL.value]
+    deltas = _cut_deltas(gaussian, integral)
+
+    return {
+        "image": name,
+        "height": int(img.shape[0]),
+        "width": int(img.shape[1]),
+        "seconds": timings,
+        "mpix_per_s": {backend: img.shape[0] * img.shape[1] / 1e6 / max(seconds, 1e-9)
+                       for backend, seconds in timings.items()},
+        "profile_mae": float(np.mean(np.abs(profiles["gaussian"] - profiles["integral"]))),
+        "pages": {backend: len(c) - 1 for backend, c in cuts.items()},
+        "identical_cuts": gaussian == integral,
+        "max_cut_delta": max(deltas) if deltas else 0,
+        "cuts": cuts,
+    }
+
+def format_report(results, target_height, corpus):
+
+    lines = [
+        "# Ink density backends: gaussian vs integral",
+        "",
+        "integral is cap-c's box-mean threshold on OpenCV's grayscale; integral_cap_c also reproduces",
+        "cap-c's grayscale conversion, bit for bit with cap-c, at the cost of a float luma pass.",
+        "",
+        f"Corpus: {corpus}; target page height {target_height} px.",
+        f"Environment: Python {platform.python_version()}, NumPy {np.__version__}, "
+        f"OpenCV {cv2.__version__}, {os.cpu_count()} CPU(s).",
+        "",
+        "| image | size | gaussian s | integral s | speedup | integral_cap_c s | profile MAE | pages g/i "
+        "| identical cuts | max cut delta |",
+        "|---|---|---|---|---|---|---|---|---|---|",
+    ]
+    for r in results:
+        g, i = r["seconds"]["gaussian"], r["seconds"]["integral"]
+        lines.append(f"| {r['image']} | {r['width']}x{r['height']} | {g:.3f} | {i:.3f} | {g / i:.2f}x | "
+                     f"{r['seconds']['integral_cap_c']:.3f} | "
+                     f"{r['profile_mae']:.4f} | {r['pages']['gaussian']}/{r['pages']['integral']} | "
+                     f"{'yes' if r['identical_cuts'] else 'no'} | {r['max_cut_delta']} |")
+
+    total_g = sum(r["seconds"]["gaussian"] for r in results)
+    total_i = sum(r["seconds"]["integral"] for r in results)
+    total_c = sum(r["seconds"]["integral_cap_c"] for r in results)
+    identical = sum(r["identical_cuts"] for r in results)
+    lines += [
+        "",
+        f"Total: gaussian {total_g:.3f}s, integral {total_i:.3f}s ({total_g / max(total_i, 1e-9):.2f}x), "
+        f"integral_cap_c {total_c:.3f}s ({total_g / max(total_c, 1e-9):.2f}x); "
+        f"identical cuts on {identical}/{len(results)} images.",
+    ]
+    return "\n".join(lines) + "\n"
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description="Compare the gaussian and integral ink density backends.")
+    parser.add_argument("corpus", nargs="?", default=os.environ.get("CAP_TEST_DATASET"),
+                        help="Directory of scroll images (default: $CAP_TEST_DATASET, else a synthetic corpus)")
+    parser.add_argument("--dpi", type=int, default=300)
+    parser.add_argument("--format", default="A4")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--synthetic-count", type=int, default=6)
+    parser.add_argument("--synthetic-height", type=int, default=30000)
+    parser.add_argument("--synthetic-width", type=int, default=1240)
+    parser.add_argument("--json", default=None, help="Also write per-image results to this JSON file")
+    parser.add_argument("--report", default=None, help="Write the markdown report here instead of stdout")
+    args = parser.parse_args(argv)
+
+    target_height = target_height_for_format(args.format, args.dpi)
+    corpus = args.corpus if args.corpus and os.path.isdir(args.corpus) else \
+        f"{args.synthetic_count} synthetic scrolls ({args.synthetic_width}x{args.synthetic_height})"
+
+    results = [compare_image(name, img, target_height, args.repeats)
+               for name, img in load_corpus(args.corpus, args.synthetic_count,
+                                            args.synthetic_height, args.synthetic_width)]
+    report = format_report(results, target_height, corpus)
+
+    if args.report:
+        with open(args.report, 'w') as f:
+            f.write(report)
+    else:
+        print(report, end="")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+import os
+import numpy as np
+
+
+KINDS = ("text", "handwriting", "chart")
+PAPER_CHUNK_ROWS = 4096
+MARGIN = 60
+
+def _fill_paper(out, seed):
+
+    # Paper noise is drawn per fixed chunk from its own stream, so a scroll
+    # comes out identical whether it is built in memory or in a memmap.
+    H, W = out.shape[:2]
+    for start in range(0, H, PAPER_CHUNK_ROWS):
+        rows = np.arange(start, min(H, start + PAPER_CHUNK_ROWS))
+        rng = np.random.default_rng([seed, start])
+        paper = (240 + 6 * np.sin(rows / 1500.0 + seed)).astype(np.uint8)[:, None, None]
+        out[start:start + len(rows)] = paper + rng.integers(0, 3, (len(rows), W, 1), dtype=np.uint8)
+
+def _text_line(out, rng, y, line_h):
+
+    W = out.shape[1]
+    x = MARGIN
+    while x < W - 100:
+        word = min(int(rng.integers(20, 120)), W - MARGIN - x)
+        glyphs = rng.random((line_h, word)) < 0.35
+        out[y:y + line_h, x:x + word][glyphs] = rng.integers(10, 70)
+        x += word + int(rng.integers(10, 24))
+
+def _handwriting_line(out, rng, y, line_h):
+
+    # A wobbling pen trace along the baseline, with loops that reach above and
+    # below the line box so neighbouring lines nearly touch.
+    H, W = out.shape[:2]
+    color = rng.integers(20, 90, 3).astype(np.uint8)
+    thickness = int(rng.integers(2, 4))
+    x = MARGIN + int(rng.integers(0, 40))
+    while x < W - 100:
+        word = min(int(rng.integers(30, 160)), W - MARGIN - x)
+        xs = np.arange(x, x + word)
+        phase = rng.uniform(0, 2 * np.pi)
+        freq = rng.uniform(0.12, 0.3)
+        trace = y + line_h / 2 + line_h * 0.3 * np.sin(xs * freq + phase)
+        loops = rng.random(word) < 0.03
+        trace[loops] += rng.choice([-1.0, 1.0], loops.sum()) * line_h * rng.uniform(0.5, 0.9, loops.sum())
+        ys = np.clip(np.rint(trace).astype(np.int64), 0, H - thickness)
+        # Join each column to the previous one so the stroke stays continuous.
+        lo = np.minimum(ys, np.concatenate(([ys[0]], ys[:-1])))
+        span = np.maximum(ys, np.concatenate(([ys[0]], ys[:-1]))) - lo + thickness
+        for dy in range(int(span.max())):
+            draw = dy < span
+            out[lo[draw] + dy, xs[draw]] = color
+        x += word + int(rng.integers(12, 30))
+
+def _shaded_block(out, rng, y, block):
+
+    W = out.shape[1]
+    shade = np.linspace(60, 200, block, dtype=np.float64)[:, None, None]
+    out[y:y + block, MARGIN:W - MARGIN] = (shade + rng.integers(0, 40, (block, W - 2 * MARGIN, 3))).astype(np.uint8)
+
+def _chart(out, rng, y, block):
+
+    # Axes, faint gridlines every 40 px, bars and a polyline: the gridlines
+    # are low-ink rows that look like whitespace to a careless cutter.
+    W = out.shape[1]
+    left, right = MARGIN + 40, W - MARGIN
+    bottom = y + block - 30
+    out[y:y + block, MARGIN:W - MARGIN] = 252
+    out[y + 10:bottom:40, left:right] = 200
+    out[y + 10:bottom + 3, left:left + 3] = 30
+    out[bottom:bottom + 3, left:right] = 30
+
+    n_bars = int(rng.integers(4, 12))
+    slot = (right - left) // n_bars
+    for k in range(n_bars):
+        top = int(rng.integers(y + 20, bottom - 10))
+        x0 = left + k * slot + slot // 4
+        out[top:bottom, x0:x0 + slot // 2] = rng.integers(40, 160, 3).astype(np.uint8)
+
+    xs = np.arange(left, right)
+    walk = np.cumsum(rng.normal(0, 3, len(xs)))
+    ys = np.clip(np.rint((y + bottom) / 2 + walk), y + 10, bottom - 2).astype(np.int64)
+    for dy in range(2):
+        out[ys + dy, xs] = (200, 30, 30)
+
+def draw_scroll(out, seed, kind="text"):
+
+    if kind not in KINDS:
+        raise ValueError(f"Unknown scroll kind '{kind}'; expected one of {KINDS}")
+    _fill_paper(out, seed)
+    rng = np.random.default_rng([seed, KINDS.index(kind)])
+    H = out.shape[0]
+    figure_rate = 0.15 if kind == "chart" else 0.08
+
+    y = 40
+    while y < H - 80:
+        if rng.random() < figure_rate:
+            block = min(int(rng.integers(200, 900)), H - 40 - y)
+            if kind == "chart" and block > 80:
+                _chart(out, rng, y, block)
+            else:
+                _shaded_block(out, rng, y, block)
+            y += block + int(rng.integers(30, 90))
+            continue
+
+        if kind == "handwriting":
+            line_h = int(rng.integers(24, 44))
+            _handwriting_line(out, rng, y, line_h)
+            y += line_h + int(rng.integers(2, 12))
+        else:
+            line_h = int(rng.integers(18, 34))
+            _text_line(out, rng, y, line_h)
+            y += line_h + int(rng.integers(6, 16))
+        if rng.random() < 0.1:
+            y += int(rng.integers(30, 80))
+    return out
+
+def synthetic_scroll(height, width, seed, kind="text"):
+
+    return draw_scroll(np.empty((height, width, 3), dtype=np.uint8), seed, kind)
+
+def scroll_name(kind, height, width, seed):
+
+    return f"{kind}_{height}x{width}_s{seed}"
+
+def write_scroll(path, height, width, seed, kind="text"):
+
+    # .npy scrolls are drawn straight into a memmap, so even 500k-row scrolls
+    # never need the whole image in memory; other formats go through PIL.
+    tmp_path = path + ".tmp"
+    if path.endswith(".npy"):
+        out = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.uint8, shape=(height, width, 3))
+        draw_scroll(out, seed, kind)
+        out.flush()
+        del out
+    else:
+        from PIL import Image
+        Image.fromarray(synthetic_scroll(height, width, seed, kind)).save(
+            tmp_path, format=Image.registered_extensions()[os.path.splitext(path)[1].lower()], compress_level=1)
+    os.replace(tmp_path, path)
+    return path
+
+def ensure_scroll(corpus_dir, kind, height, width, seed, ext=".png"):
+
+    os.makedirs(corpus_dir, exist_ok=True)
+    path = os.path.join(corpus_dir, scroll_name(kind, height, width, seed) + ext)
+    if not os.path.exists(path):
+        write_scroll(path, height, width, seed, kind)
+    return path
@@ -0,0 +1,248 @@
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+src_dir = os.path.join(script_dir, "..", "src")
+sys.path.append(src_dir)
+
+from corpus import KINDS, ensure_scroll
+
+SCHEMA_VERSION = 1
+STAGES = ("load", "density", "candidates", "dp", "render", "encode")
+DEFAULT_SIZES = "10000,50000,200000"
+# Stage timings below this are mostly noise and never count as regressions.
+MIN_COMPARABLE_SECONDS = 0.05
+
+def _peak_rss_mb():
+
+    # VmHWM starts afresh at exec; ru_maxrss would include the parent's peak
+    # at fork time, so it is only the fallback where /proc is unavailable.
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is bytes on macOS and kilobytes everywhere else.
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def run_case(path, config):
+
+    # Runs in a fresh interpreter per case (see _run_worker), so peak RSS is
+    # this scroll's alone.
+    import numpy as np
+    from cap.core import compute_ink_density, find_optimal_cuts_dp, DensityBackend
+    from cap.profiling import PipelineStats
+    from cap.io import load_image, iter_page_crops, save_pdf_streaming, save_page_images, RenderMode, _PaddingBuffer
+    from cap.pipeline import target_height_for_format
+
+    target_height = target_height_for_format(config["format"], config["dpi"])
+    render_mode = RenderMode(config["render_mode"])
+    pad_height = target_height if render_mode == RenderMode.FIXED_SIZE_WITH_PADDING else None
+    seconds = {}
+    peak_rss_mb = {"start": _peak_rss_mb()}
+
+    def stage(name, fn):
+        start = time.perf_counter()
+        result = fn()
+        seconds[name] = time.perf_counter() - start
+        peak_rss_mb[name] = _peak_rss_mb()
+        return result
+
+    img = stage("load", lambda: load_image(path, mmap=config["mmap"]))
+    profile = stage("density", lambda: compute_ink_density(img, strip_rows=config["strip_rows"] or None,
+                                                           backend=DensityBackend(config["density_backend"]),
+                                                           workers=config["jobs"]))
+
+    # find_optimal_cuts_dp reports candidate generation and the DP separately.
+    dp_stats = PipelineStats()
+    cuts = [int(c) for c in find_optimal_cuts_dp(profile, target_height, stats=dp_stats)]
+    seconds["candidates"] = dp_stats.timings["candidates"]
+    seconds["dp"] = dp_stats.timings["dp"]
+    peak_rss_mb["candidates"] = peak_rss_mb["dp"] = _peak_rss_mb()
+
+    def render():
+        buffer = _PaddingBuffer()
+        for page in iter_page_crops(img, cuts):
+            page = np.array(page)
+            if pad_height is not None and page.shape[0] < pad_height:
+                buffer.pad(page, pad_height, (255, 255, 255))
+
+    stage("render", render)
+
+    with tempfile.TemporaryDirectory() as out_dir:
+        if config["output_format"] == "pdf":
+            stage("encode", lambda: save_pdf_streaming(iter_page_crops(img, cuts), os.path.join(out_dir, "out.pdf"),
+                                                       dpi=config["dpi"], render_mode=render_mode,
+                                                       target_height_px=target_height, jobs=config["jobs"]))
+        else:
+            stage("encode", lambda: save_page_images(iter_page_crops(img, cuts), out_dir, render_mode=render_mode,
+                                                     target_height_px=target_height, jobs=config["jobs"]))
+        output_bytes = sum(os.path.getsize(os.path.join(out_dir, name)) for name in os.listdir(out_dir))
+
+    return {
+        "height": int(img.shape[0]),
+        "width": int(img.shape[1]),
+        "pages": len(cuts) - 1,
+        "cuts": cuts,
+        "output_bytes": output_bytes,
+        "seconds": seconds,
+        "total_seconds": sum(seconds.values()),
+        "peak_rss_mb": peak_rss_mb,
+        "counters": dp_stats.counters,
+    }
+
+def _run_worker(path, config):
+
+    cmd = [sys.executable, os.path.abspath(__file__), "--worker", path, "--worker-config", json.dumps(config)]
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"benchmark worker failed on {path}:\n{result.stderr}")
+    return json.loads(result.stdout)
+
+def _best_of(runs):
+
+    # Fastest time per stage across repeats; peak RSS is the worst seen.
+    best = dict(runs[0])
+    best["seconds"] = {name: min(run["seconds"][name] for run in runs) for name in STAGES}
+    best["total_seconds"] = sum(best["seconds"].values())
+    best["peak_rss_mb"] = {name: max(run["peak_rss_mb"][name] for run in runs) for name in runs[0]["peak_rss_mb"]}
+    best["repeats"] = len(runs)
+    return best
+
+def environment():
+
+    import numpy as np
+    try:
+        import cv2
+        opencv = cv2.__version__
+    except ImportError:
+        opencv = None
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "opencv": opencv,
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+    }
+
+def case_key(result):
+
+    return f"{result['case']}@{result['width']}x{result['height']}"
+
+def compare(results, baseline, tolerance):
+
+    # Returns (key, metric, old, new) for every stage time or peak RSS that
+    # grew by more than `tolerance` over the baseline run.
+    previous = {case_key(r): r for r in baseline["results"]}
+    regressions = []
+    for result in results:
+        old = previous.get(case_key(result))
+        if old is None:
+            continue
+        for name in STAGES:
+            before, after = old["seconds"].get(name), result["seconds"][name]
+            if before is not None and max(before, after) >= MIN_COMPARABLE_SECONDS and after > before * (1 + tolerance):
+                regressions.append((case_key(result), f"{name} s", before, after))
+        before, after = old["peak_rss_mb"][STAGES[-1]], result["peak_rss_mb"][STAGES[-1]]
+        if after > before * (1 + tolerance):
+            regressions.append((case_key(result), "peak RSS MB", before, after))
+    return regressions
+
+def format_table(results):
+
+    header = ["case", "size", "pages"] + [f"{name} s" for name in STAGES] + ["total s", "peak RSS MB"]
+    lines = [" | ".join(header), " | ".join("---" for _ in header)]
+    for r in results:
+        row = [r["case"], f"{r['width']}x{r['height']}", str(r["pages"])]
+        row += [f"{r['seconds'][name]:.3f}" for name in STAGES]
+        row += [f"{r['total_seconds']:.3f}", f"{r['peak_rss_mb'][STAGES[-1]]:.0f}"]
+        lines.append(" | ".join(row))
+    return "\n".join(lines)
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description="Time each pagination stage on a synthetic long-scroll corpus.")
+    parser.add_argument("inputs", nargs="*", help="Benchmark these images instead of the synthetic corpus")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help=f"Comma-separated scroll heights in rows (default {DEFAULT_SIZES})")
+    parser.add_argument("--kinds", default=",".join(KINDS), help=f"Comma-separated scroll kinds from {', '.join(KINDS)}")
+    parser.add_argument("--width", type=int, default=1240)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--input-format", default="png", choices=["png", "npy", "tif"],
+                        help="File format the synthetic scrolls are written in (npy avoids holding them in memory)")
+    parser.add_argument("--corpus-dir", default=os.environ.get("CAP_BENCH_CORPUS",
+                                                               os.path.join(tempfile.gettempdir(), "cap-bench-corpus")),
+                        help="Where generated scrolls are kept between runs (env: CAP_BENCH_CORPUS)")
+    parser.add_argument("--format", default="A4")
+    parser.add_argument("--dpi", type=int, default=300)
+    parser.add_argument("--density-backend", default="gaussian", choices=["gaussian", "integral", "integral_cap_c"])
+    parser.add_argument("--strip-rows", type=int, default=0)
+    parser.add_argument("--mmap", action="store_true")
+    parser.add_argument("--output-format", default="pdf", choices=["pdf", "images"])
+    parser.add_argument("--render-mode", default="variable_size", choices=["variable_size", "fixed_size_with_padding"])
+    parser.add_argument("--jobs", type=int, default=1)
+    parser.add_argument("--repeats", type=int, default=1, help="Run each case this many times and keep the fastest")
+    parser.add_argument("--json", default=None, help="Write machine-readable results to this file")
+    parser.add_argument("--baseline", default=None, help="Compare against a previous --json file")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Allowed slowdown or RSS growth over the baseline before failing (default 0.2 = 20%%)")
+    parser.add_argument("--worker", default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--worker-config", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        json.dump(run_case(args.worker, json.loads(args.worker_config)), sys.stdout)
+        return 0
+
+    config = dict(format=args.format, dpi=args.dpi, density_backend=args.density_backend,
+                  strip_rows=args.strip_rows, mmap=args.mmap, output_format=args.output_format,
+                  render_mode=args.render_mode, jobs=args.jobs)
+
+    if args.inputs:
+        cases = [(os.path.basename(path), path) for path in args.inputs]
+    else:
+        cases = []
+        for height in (int(size) for size in args.sizes.split(",")):
+            for kind in args.kinds.split(","):
+                print(f"Generating {kind} scroll, {height} rows...", file=sys.stderr)
+                cases.append((kind, ensure_scroll(args.corpus_dir, kind, height, args.width, args.seed,
+                                                  ext="." + args.input_format)))
+
+    results = []
+    for name, path in cases:
+        print(f"Running {name} ({os.path.basename(path)})...", file=sys.stderr)
+        result = _best_of([_run_worker(path, config) for _ in range(args.repeats)])
+        result["case"] = name
+        result["input"] = path
+        results.append(result)
+
+    print(format_table(results))
+
+    report = {"schema_version": SCHEMA_VERSION, "environment": environment(), "config": config,
+              "seed": args.seed, "results": results}
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for key, metric, before, after in regressions:
+            print(f"REGRESSION {key} {metric}: {before:.3f} -> {after:.3f} ({after / max(before, 1e-9):.2f}x)")
+        if regressions:
+            return 1
+        print(f"No regressions beyond {args.tolerance:.0%} against {args.baseline}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,307 @@
+import numpy as np
+from enum import Enum
+from .profiling import timed, count
+
+class DensityBackend(Enum):
+
+    GAUSSIAN = "gaussian"
+    INTEGRAL = "integral"
+    INTEGRAL_CAP_C = "integral_cap_c"
+
+THRESH_BLOCK_SIZE = 11
+THRESH_C = 2
+THRESH_HALO = THRESH_BLOCK_SIZE // 2
+
+NUMPY_STRIP_ROWS = 1024
+# The box-mean backends are memory-bound; strips this small stay in cache
+# and run faster than larger ones.
+INTEGRAL_STRIP_ROWS = 256
+INTEGRAL_BACKENDS = (DensityBackend.INTEGRAL, DensityBackend.INTEGRAL_CAP_C)
+PARALLEL_STRIP_ROWS = 4096
+
+# cv2.getGaussianKernel's default sigma for the block size, and the 16-bit
+# fixed-point weights cv2.cvtColor uses for BGR2GRAY.
+GAUSSIAN_SIGMA = 0.3 * ((THRESH_BLOCK_SIZE - 1) * 0.5 - 1) + 0.8
+GRAY_WEIGHTS_Q16 = (7470, 38470, 19596)
+
+def _cv2():
+
+    try:
+        import cv2
+    except ImportError:
+        return None
+    return cv2
+
+def _opencv_gaussian_row_sums(image, cv2):
+
+    if len(image.shape) == 3:
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    else:
+        gray = image
+    binarized = cv2.adaptiveThreshold(
+        gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+        cv2.THRESH_BINARY_INV, THRESH_BLOCK_SIZE, THRESH_C
+    )
+    return np.sum(binarized, axis=1)
+
+def _bgr_to_gray(image):
+
+    if len(image.shape) == 2:
+        return image
+    b, g, r = GRAY_WEIGHTS_Q16
+    gray = image[..., 0] * np.uint32(b)
+    gray += image[..., 1] * np.uint32(g)
+    gray += image[..., 2] * np.uint32(r)
+    gray += np.uint32(1 << 15)
+    gray >>= np.uint32(16)
+    return gray.astype(np.uint8)
+
+def _gaussian_kernel():
+
+    k = np.exp(-0.5 / GAUSSIAN_SIGMA ** 2 * (np.arange(THRESH_BLOCK_SIZE) - THRESH_HALO) ** 2)
+    return (k * (1.0 / k.sum())).astype(np.float32)
+
+def _fma(acc, values, weight):
+
+    # float32 fused multiply-add: the product of two float32s is exact in
+    # float64, so only the final cast rounds, as the hardware instruction does.
+    t = values.astype(np.float64)
+    t *= float(weight)
+    t += acc
+    acc[...] = t
+
+def _gaussian_blur(gray):
+
+    # Replicates cv2.GaussianBlur on float32 with BORDER_REPLICATE bit for bit
+    # (as built in OpenCV 5.0 for x86-64; other builds may round differently):
+    # a sequential FMA row pass, then a column pass that adds mirrored rows
+    # before weighting them. Columns past the last multiple of 8 come from
+    # OpenCV's scalar tail loop, which multiplies and adds without fusing.
+    k = _gaussian_kernel()
+    halo = THRESH_HALO
+    h, w = gray.shape
+    src = np.pad(gray.astype(np.float32), ((0, 0), (halo, halo)), mode='edge')
+    rows = src[:, 0:w] * k[0]
+    for i in range(1, THRESH_BLOCK_SIZE):
+        _fma(rows, src[:, i:i + w], k[i])
+
+    src = np.pad(rows, ((halo, halo), (0, 0)), mode='edge')
+    blur = src[halo:halo + h] * k[halo]
+    tail = w - w % 8
+    for j in range(1, halo + 1):
+        pair = src[halo - j:halo - j + h] + src[halo + j:halo + j + h]
+        _fma(blur[:, :tail], pair[:, :tail], k[halo - j])
+        blur[:, tail:] += pair[:, tail:] * k[halo - j]
+    return blur
+
+def _numpy_gaussian_row_sums(image):
+
+    gray = _bgr_to_gray(image)
+    if gray.shape[0] == 0 or gray.shape[1] == 0:
+        return np.zeros(gray.shape[0], dtype=np.uint64)
+    mean = np.rint(_gaussian_blur(gray))
+    ink = gray.astype(np.float32) + THRESH_C <= mean
+    return ink.sum(axis=1, dtype=np.uint64) * np.uint64(255)
+
+def _gaussian_row_sums(image):
+
+    cv2 = _cv2()
+    if cv2 is None:
+        return _numpy_gaussian_row_sums(image)
+    return _opencv_gaussian_row_sums(image, cv2)
+
+def _luma(image):
+
+    if len(image.shape) == 2:
+        return image
+    gray = np.multiply(image[..., 0], 0.299)
+    tmp = np.multiply(image[..., 1], 0.587)
+    gray += tmp
+    np.multiply(image[..., 2], 0.114, out=tmp)
+    gray += tmp
+    return gray.astype(np.uint8)
+
+def _box_sum_11(padded, axis):
+
+    # Window sums of 11 along `axis` from sums of 1, 2, 4 and 8 (8 + 2 + 1).
+    # An 11x11 block of uint8 sums to at most 30855, so uint16 never wraps.
+    n = padded.shape[axis] - 2 * THRESH_HALO
+
+    def shift(a, start, length):
+        return a[start:start + length] if axis == 0 else a[:, start:start + length]
+
+    s2 = shift(padded, 0, padded.shape[axis] - 1) + shift(padded, 1, padded.shape[axis] - 1)
+    s4 = shift(s2, 0, s2.shape[axis] - 2) + shift(s2, 2, s2.shape[axis] - 2)
+    s8 = shift(s4, 0, s4.shape[axis] - 4) + shift(s4, 4, s4.shape[axis] - 4)
+    return shift(s8, 0, n) + shift(s2, 8, n) + shift(padded, 10, n)
+
+def _block_areas(h, w, dtype):
+
+    # Pixels of each border-clipped block.
+    halo = THRESH_HALO
+    rows = np.arange(h)
+    cols = np.arange(w)
+    rows_in = np.minimum(rows + halo, h - 1) - np.maximum(rows - halo, 0) + 1
+    cols_in = np.minimum(cols + halo, w - 1) - np.maximum(cols - halo, 0) + 1
+    return rows_in.astype(dtype)[:, None] * cols_in.astype(dtype)
+
+def _opencv_box_row_sums(gray, cv2):
+
+    # Block sums and (gray + C + 1) * area are integers below 2^15, so the
+    # float32 comparison is exact.
+    h, w = gray.shape
+    size = (THRESH_BLOCK_SIZE, THRESH_BLOCK_SIZE)
+    box = cv2.boxFilter(gray, cv2.CV_32F, size, normalize=False, borderType=cv2.BORDER_CONSTANT)
+    lhs = gray.astype(np.float32)
+    lhs += THRESH_C + 1
+    lhs *= _block_areas(h, w, np.float32)
+    ink = cv2.compare(lhs, box, cv2.CMP_LE)
+    return cv2.reduce(ink, 1, cv2.REDUCE_SUM, dtype=cv2.CV_32S).ravel().astype(np.uint32)
+
+def _numpy_box_row_sums(gray):
+
+    h, w = gray.shape
+    halo = THRESH_HALO
+    padded = np.zeros((h + 2 * halo, w), dtype=np.uint16)
+    padded[halo:halo + h] = gray
+    vertical = _box_sum_11(padded, 0)
+    padded = np.zeros((h, w + 2 * halo), dtype=np.uint16)
+    padded[:, halo:halo + w] = vertical
+    box = _box_sum_11(padded, 1)
+
+    ink = (gray.astype(np.uint16) + (THRESH_C + 1)) * _block_areas(h, w, np.uint16) <= box
+    return ink.sum(axis=1, dtype=np.uint32) * np.uint32(255)
+
+def _integral_row_sums(image, cap_c_luma=False):
+
+    # Same rule as compute_ink_density in cap-c/src/core.c: a pixel is ink when
+    # gray < (int)(mean - C) over the border-clipped block. For integer sums
+    # that is exactly (gray + C + 1) * area <= sum, so no floats are needed.
+    # Gray is cap-c's truncated float luma only when asked for: it costs more
+    # than the threshold itself, and the default is the gaussian backend's.
+    cv2 = _cv2()
+    if cap_c_luma:
+        gray = _luma(image)
+    elif cv2 is not None and len(image.shape) == 3:
+        gray = cv2.cvtColor(np.ascontiguousarray(image), cv2.COLOR_BGR2GRAY)
+    else:
+        gray = _bgr_to_gray(image)
+    h, w = gray.shape
+    if h == 0 or w == 0:
+        return np.zeros(h, dtype=np.uint32)
+    if cv2 is None:
+        return _numpy_box_row_sums(gray)
+    return _opencv_box_row_sums(np.ascontiguousarray(gray), cv2)
+
+def _ink_row_sums(image, backend=DensityBackend.GAUSSIAN):
+
+    if backend == DensityBackend.INTEGRAL:
+        return _integral_row_sums(image)
+    if backend == DensityBackend.INTEGRAL_CAP_C:
+        return _integral_row_sums(image, cap_c_luma=True)
+    return _gaussian_row_sums(image)
+
+def _normalize_row_sums(row_sums, width):
+
+    max_val = width * 255.0
+    return row_sums / max_val if max_val > 0 else row_sums
+
+def iter_image_strips(image, strip_rows):
+
+    if strip_rows <= 0:
+        raise ValueError("strip_rows must be positive")
+    for start in range(0, image.shape[0], strip_rows):
+        yield image[start:start + strip_rows]
+
+def iter_ink_density(strips, backend=DensityBackend.GAUSSIAN):
+
+    # Rows are only emitted once THRESH_HALO rows below them have arrived, and
+    # each window keeps THRESH_HALO rows above, so every emitted row sees the
+    # same Gaussian neighbourhood it would in the full image.
+    buf = None
+    buf_start = 0
+    done = 0
+    width = None
+
+    for strip in strips:
+        if strip.shape[0] == 0:
+            continue
+        if buf is None:
+            buf = strip
+            width = strip.shape[1]
+        else:
+            buf = np.concatenate([buf, strip], axis=0)
+        buf_end = buf_start + buf.shape[0]
+
+        emit_end = buf_end - THRESH_HALO
+        if emit_end <= done:
+            continue
+
+        row_sums = _ink_row_sums(buf, backend)
+        yield _normalize_row_sums(row_sums[done - buf_start:emit_end - buf_start], width)
+
+        done = emit_end
+        keep_start = max(0, done - THRESH_HALO)
+        buf = buf[keep_start - buf_start:]
+        buf_start = keep_start
+
+    if buf is not None and buf_start + buf.shape[0] > done:
+        row_sums = _ink_row_sums(buf, backend)
+        yield _normalize_row_sums(row_sums[done - buf_start:], width)
+
+def _compute_ink_density(image, strip_rows, backend):
+
+    # The NumPy backends hold several float copies of whatever they are given,
+    # so they always run in strips.
+    if not strip_rows and backend in INTEGRAL_BACKENDS:
+        strip_rows = INTEGRAL_STRIP_ROWS
+    elif not strip_rows and _cv2() is None:
+        strip_rows = NUMPY_STRIP_ROWS
+
+    if strip_rows:
+        chunks = list(iter_ink_density(iter_image_strips(image, strip_rows), backend))
+        if not chunks:
+            return _normalize_row_sums(np.zeros(0, dtype=np.uint64), image.shape[1])
+        return np.concatenate(chunks)
+
+    return _normalize_row_sums(_ink_row_sums(image), image.shape[1])
+
+
+def _parallel_ink_density(image, strip_rows, backend, workers):
+
+    # Each strip is analysed with THRESH_HALO rows of context either side (as
+    # in iter_ink_density) and written straight into its slice of the
+    # profile. OpenCV and most of the NumPy work release the GIL.
+    from concurrent.futures import ThreadPoolExecutor
+
+    height, width = image.shape[0], image.shape[1]
+    if not strip_rows and backend in INTEGRAL_BACKENDS:
+        strip_rows = INTEGRAL_STRIP_ROWS
+    elif not strip_rows:
+        strip_rows = NUMPY_STRIP_ROWS if _cv2() is None else PARALLEL_STRIP_ROWS
+    profile = np.empty(height, dtype=np.float64)
+
+    def run(start):
+        end = min(start + strip_rows, height)
+        lo = max(0, start - THRESH_HALO)
+        hi = min(height, end + THRESH_HALO)
+        row_sums = _ink_row_sums(image[lo:hi], backend)
+        profile[start:end] = _normalize_row_sums(row_sums[start - lo:end - lo], width)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for _ in executor.map(run, range(0, height, strip_rows)):
+            pass
+    return profile
+
+def compute_ink_density(image, strip_rows=None, backend=DensityBackend.GAUSSIAN, stats=None, workers=1):
+
+    # workers > 1 analyses horizontal strips on that many threads; the
+    # profile is the same as the serial one, bit for bit.
+    with timed(stats, "density"):
+        if workers > 1 and image.shape[0] > 0:
+            profile = _parallel_ink_density(image, strip_rows, backend, workers)
+        else:
+            profile = _compute_ink_density(image, strip_rows, backend)
+    count(stats, "density_rows", image.shape[0])
+    count(stats, "density_pixels", image.shape[0] * image.shape[1])
+    return profile
@@ -1,15 +1,10 @@
 import asyncio
 from pyscript import window, document
 import io
-import cv2
 import numpy as np
 import base64
 from PIL import Image
-
-try:
-    from core import compute_ink_density, find_optimal_cuts_dp, CutMode
-except ImportError:
-    pass
+from cap.core import compute_ink_density, find_optimal_cuts_dp, CutMode
 
 PAPER_SIZES = {
     "A4": (210, 297),
@@ -35,11 +30,10 @@ def process_image(event):
             window.alert("No file uploaded!")
             return
 
-        array = np.asarray(uploaded_bytes.to_py())
-        img_array = cv2.imdecode(array, cv2.IMREAD_COLOR)
-
-        if img_array is None:
-            raise ValueError("Could not decode image")
+        try:
+            img_array = np.asarray(Image.open(io.BytesIO(bytes(uploaded_bytes.to_py()))).convert("RGB"))
+        except Exception as e:
+            raise ValueError("Could not decode image") from e
         
         format_val = document.getElementById("format-select").value
         cut_mode_val = document.getElementById("cut-mode-select").value
@@ -53,7 +47,8 @@ def process_image(event):
 
         target_height = get_target_height_px(format_val, dpi_val, custom_w, custom_h)
         
-        ink_profile = compute_ink_density(img_array)
+        # compute_ink_density takes OpenCV's BGR channel order.
+        ink_profile = compute_ink_density(img_array[..., ::-1])
         
         mode_enum = CutMode.WHITESPACE if cut_mode_val == "whitespace" else CutMode.FIXED_HEIGHT_SNAP
         
@@ -63,10 +58,7 @@ def process_image(event):
         for i in range(len(cuts) - 1):
             start = cuts[i]
             end = cuts[i+1]
-            crop_cv2 = img_array[start:end, :]
-            
-            crop_rgb = cv2.cvtColor(crop_cv2, cv2.COLOR_BGR2RGB)
-            crop_pil = Image.fromarray(crop_rgb)
+            crop_pil = Image.fromarray(img_array[start:end, :])
             crops.append(crop_pil)
 
         if crops:
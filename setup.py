@@ -18,6 +18,7 @@ setup(
     entry_points={
         "console_scripts": [
             "cap=cap.cli:main",
+            "cap-server=cap.server:main",
         ],
     },
 )
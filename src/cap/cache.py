@@ -0,0 +1,118 @@
+import glob
+import hashlib
+import json
+import os
+import tempfile
+import numpy as np
+from .density import THRESH_BLOCK_SIZE, THRESH_C, DensityBackend
+
+
+DEFAULT_CACHE_BYTES = 1024 * 1024 * 1024
+CACHE_FORMAT_VERSION = 2
+
+def file_digest(path, chunk_size=1 << 20):
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _profile_from_counts(counts, width):
+
+    max_val = width * 255.0
+    row_sums = counts.astype(np.uint64) * 255
+    return row_sums / max_val if max_val > 0 else row_sums
+
+class ProfileCache:
+
+    def __init__(self, cache_dir, max_bytes=DEFAULT_CACHE_BYTES):
+
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key_for(self, path, **params):
+
+        params = dict(params)
+        params.setdefault("block_size", THRESH_BLOCK_SIZE)
+        params.setdefault("c", THRESH_C)
+        params.setdefault("density_backend", DensityBackend.GAUSSIAN.value)
+        params["version"] = CACHE_FORMAT_VERSION
+        tag = hashlib.sha256(json.dumps(params, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+        return f"{file_digest(path)}-{tag}"
+
+    def _entry_path(self, key, width):
+        return os.path.join(self.cache_dir, f"{key}.w{width}.npy")
+
+    def _find(self, key):
+        matches = glob.glob(os.path.join(glob.escape(self.cache_dir), f"{key}.w*.npy"))
+        return matches[0] if matches else None
+
+    def get(self, key):
+
+        path = self._find(key)
+        if path is None:
+            return None
+        # Another process may evict the entry at any point; that is a miss.
+        try:
+            data = np.load(path, mmap_mode='r')
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        width = int(path[:-len(".npy")].rsplit(".w", 1)[1])
+
+        if data.dtype.kind == 'f':
+            return np.asarray(data, dtype=np.float64)
+        return _profile_from_counts(data, width)
+
+    def put(self, key, profile, width):
+
+        # Gaussian/box density profiles are (ink pixel count) / width, so they
+        # are stored as compact integer counts and rebuilt bit-for-bit; any
+        # profile that does not round-trip is stored as float64 instead.
+        profile = np.asarray(profile)
+        counts = np.rint(profile * width) if width > 0 else np.zeros(len(profile))
+        dtype = np.uint16 if len(counts) == 0 or counts.max() < 2 ** 16 else np.uint32
+        counts = counts.astype(dtype)
+        data = counts if np.array_equal(_profile_from_counts(counts, width), profile) else profile.astype(np.float64)
+
+        path = self._entry_path(key, width)
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.save(f, data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self.evict()
+        return path
+
+    def entries(self):
+
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".npy"):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return sorted(entries)
+
+    def evict(self):
+
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
@@ -1,23 +1,18 @@
 import click
+import glob
+import json
 import os
 import sys
-from .core import compute_ink_density, find_optimal_cuts_dp, CutMode
-from .io import load_image, save_pdf_from_crops, RenderMode
-from PIL import Image
-import numpy as np
+import time
+from .pipeline import PAPER_SIZES, collect_inputs, default_output_path, paginate_file, paginate_batch, paginate_stream
+from .profiling import PipelineStats, format_profile, merge_profiles
 
 
-PAPER_SIZES = {
-    "A4": (210, 297),
-    "A3": (297, 420),
-    "B5": (176, 250),
-}
-
 @click.command()
-@click.argument("input_path", type=click.Path(exists=True))
-@click.option("--output", "-o", default=None, help="Output path (PDF or directory for images)")
+@click.argument("input_path", type=click.Path())
+@click.option("--output", "-o", default=None, help="Output path (PDF or directory for images; output directory in batch mode)")
 @click.option("--output-format", default="pdf", type=click.Choice(["pdf", "images"]),
-              help="Output format: pdf (single file) or images (multiple PNG files)")
+              help="Output format: pdf (single file) or images (one file per page)")
 @click.option("--format", "-f", default="A4", type=click.Choice(list(PAPER_SIZES.keys()) + ["CUSTOM"]), help="Page format (A4, A3, B5)")
 @click.option("--dpi", "-d", default=300, help="DPI for physical size calculation")
 @click.option("--window-frac", default=0.04, help="Search window fraction of page height")
@@ -29,93 +24,161 @@ PAPER_SIZES = {
 @click.option("--snap-px", default=40, help="Snap neighborhood radius in pixels for fixed_height_snap mode")
 @click.option("--unsafe-window", default=2, help="Window radius for unsafe cut detection")
 @click.option("--unsafe-threshold", default=0.3, help="Ink threshold for unsafe cut detection")
-def main(input_path, output, output_format, format, dpi, window_frac, min_gap, cut_mode, render_mode, snap_px, unsafe_window, unsafe_threshold):
-
-    if output is None:
-        base, _ = os.path.splitext(input_path)
-        if output_format == "pdf":
-            output = f"{base}_paginated.pdf"
-        else:
-            output = f"{base}_pages"
-
-    click.echo(f"Processing {input_path}...")
-
+@click.option("--strip-rows", default=0, help="Compute ink density in horizontal strips of this many rows (0 = whole image)")
+@click.option("--density-backend", default="gaussian",
+              type=click.Choice(["gaussian", "integral", "integral_cap_c"]),
+              help="Adaptive threshold for ink density: gaussian (OpenCV), integral (box mean as in cap-c, "
+                   "faster) or integral_cap_c (the same with cap-c's own grayscale, bit for bit with cap-c)")
+@click.option("--coarse-factor", default=0, type=click.IntRange(min=0),
+              help="Solve on an image downscaled by this factor, then refine cuts at full resolution (0 = off)")
+@click.option("--mmap", is_flag=True,
+              help="Memory-map uncompressed inputs (NPY, binary PGM/PPM, uncompressed TIFF) instead of decoding them")
+@click.option("--image-format", default="png", type=click.Choice(["png", "jpeg", "webp"]),
+              help="Codec for --output-format images")
+@click.option("--compress-level", default=6, type=click.IntRange(0, 9),
+              help="PNG zlib compression level for --output-format images (0-9, lower is faster)")
+@click.option("--quality", default=90, type=click.IntRange(1, 100), help="JPEG/WebP quality for --output-format images")
+@click.option("--jobs", "-j", default=1, type=click.IntRange(min=1),
+              help="Threads used to compute ink density in horizontal strips and to compress pages while "
+                   "writing output")
+@click.option("--dp-workers", default=1, type=click.IntRange(min=1),
+              help="Processes for solving the cut DP; it is split where every page sequence must cut at the "
+                   "same row, and the cuts are the same as with one")
+@click.option("--cache-dir", default=None, envvar="CAP_CACHE_DIR", type=click.Path(file_okay=False),
+              help="Directory for cached ink profiles keyed by image content (env: CAP_CACHE_DIR)")
+@click.option("--cache-size-mb", default=1024, type=click.FloatRange(min=0),
+              help="Evict least recently used cached profiles beyond this size")
+@click.option("--incremental", is_flag=True,
+              help="Keep state next to the output and, on the next run, redo only what changed below the first "
+                   "modified row: density, the DP tail and the trailing pages")
+@click.option("--manifest", is_flag=True, help="Treat INPUT_PATH as a text file listing one image per line (batch mode)")
+@click.option("--workers", "-w", default=None, type=click.IntRange(min=1),
+              help="Worker processes for batch mode (default: CPU count)")
+@click.option("--stream-width", default=None, type=click.IntRange(min=1),
+              help="Read raw 8-bit rows of this width from INPUT_PATH ('-' for stdin) and write each page "
+                   "as soon as its cut is final, while the scroll is still arriving")
+@click.option("--stream-channels", default="3", type=click.Choice(["1", "3"]),
+              help="Bytes per pixel for --stream-width input: 1 (gray) or 3 (RGB)")
+@click.option("--lookahead-pages", default=8, type=click.IntRange(min=1),
+              help="With --stream-width, commit the best cut so far once this many pages are pending")
+@click.option("--profile", is_flag=True, help="Print time spent in each stage and work counters")
+@click.option("--profile-json", default=None, type=click.Path(dir_okay=False),
+              help="Write the per-stage profile to this JSON file (implies --profile)")
+def main(input_path, output, output_format, format, dpi, window_frac, min_gap, cut_mode, render_mode, snap_px,
+         unsafe_window, unsafe_threshold, strip_rows, density_backend, coarse_factor, mmap, image_format,
+         compress_level, quality, jobs, dp_workers, cache_dir, cache_size_mb, incremental, manifest, workers,
+         stream_width, stream_channels, lookahead_pages, profile, profile_json):
+
+    profile = profile or profile_json is not None
+    options = dict(output_format=output_format, format=format, dpi=dpi, window_frac=window_frac,
+                   min_gap=min_gap, cut_mode=cut_mode, render_mode=render_mode, snap_px=snap_px,
+                   unsafe_window=unsafe_window, unsafe_threshold=unsafe_threshold, strip_rows=strip_rows,
+                   density_backend=density_backend, coarse_factor=coarse_factor, mmap=mmap,
+                   image_format=image_format, compress_level=compress_level, quality=quality, jobs=jobs,
+                   dp_workers=dp_workers, cache_dir=cache_dir, cache_size_mb=cache_size_mb, incremental=incremental,
+                   profile=profile)
+
+    if stream_width:
+        _run_stream(input_path, output, stream_width, int(stream_channels), lookahead_pages, options, profile_json)
+        return
+
+    if not manifest and not os.path.exists(input_path) and not glob.has_magic(input_path):
+        raise click.BadParameter(f"Path '{input_path}' does not exist.", param_hint="'INPUT_PATH'")
+
+    if manifest or os.path.isdir(input_path) or not os.path.exists(input_path):
+        inputs = collect_inputs(input_path, manifest=manifest)
+        if not inputs:
+            click.echo(f"Error: no input images found for '{input_path}'", err=True)
+            sys.exit(1)
+        results = _run_batch(inputs, output, workers, options)
+        if profile:
+            _report_profile(results, profile_json)
+        if any("error" in result for result in results):
+            sys.exit(1)
+        return
 
     try:
-        img_array = load_image(input_path)
-    except Exception as e:
-        click.echo(f"Error loading image: {e}", err=True)
+        result = paginate_file(input_path, output, log=click.echo, **options)
+    except ValueError as e:
+        click.echo(str(e), err=True)
         sys.exit(1)
+    if profile:
+        _report_profile([result], profile_json)
 
-    height, width, _ = img_array.shape if len(img_array.shape) == 3 else (img_array.shape[0], img_array.shape[1], 1)
-
-
-    if format in PAPER_SIZES:
-        w_mm, h_mm = PAPER_SIZES[format]
-        target_height_px = int(h_mm / 25.4 * dpi)
-    else:
-
-        target_height_px = int(297 / 25.4 * dpi)
-
-    click.echo(f"Image Size: {width}x{height}")
-    click.echo(f"Target Page Height: {target_height_px} px (@ {dpi} DPI)")
-    click.echo("Analyzing ink density...")
-    ink_profile = compute_ink_density(img_array)
-
-
-    cut_mode_enum = CutMode.WHITESPACE if cut_mode == "whitespace" else CutMode.FIXED_HEIGHT_SNAP
-    render_mode_enum = RenderMode.VARIABLE_SIZE if render_mode == "variable_size" else RenderMode.FIXED_SIZE_WITH_PADDING
-
-    click.echo(f"Cut Mode: {cut_mode}, Render Mode: {render_mode}")
-    click.echo("Finding optimal cuts (DP)...")
-    cuts = find_optimal_cuts_dp(ink_profile, target_height_px,
-                                window_frac=window_frac,
-                                min_gap_rows=min_gap,
-                                cut_mode=cut_mode_enum,
-                                snap_px=snap_px,
-                                unsafe_window_radius=unsafe_window,
-                                unsafe_ink_threshold=unsafe_threshold)
-
-    click.echo(f"Found {len(cuts)-1} pages.")
-
-
-    crops = []
+def _run_stream(input_path, output, width, channels, lookahead_pages, options, profile_json):
 
-    for i in range(len(cuts) - 1):
-        start = cuts[i]
-        end = cuts[i+1]
-        page_crop = img_array[start:end, :]
-        crops.append(page_crop)
+    from .io import iter_raw_strips
 
-
-    if output_format == "pdf":
-        click.echo(f"Saving to {output}...")
-        save_pdf_from_crops(crops, output, dpi=dpi,
-                            render_mode=render_mode_enum,
-                            target_height_px=target_height_px)
-        click.echo("Done!")
-    else:
-
-        os.makedirs(output, exist_ok=True)
-        click.echo(f"Saving {len(crops)} images to {output}/...")
-
-        for i, crop in enumerate(crops):
-
-            if isinstance(crop, np.ndarray):
-                crop_img = Image.fromarray(crop)
-            else:
-                crop_img = crop
-
-
-            if render_mode_enum == RenderMode.FIXED_SIZE_WITH_PADDING and target_height_px is not None:
-                from .io import _pad_to_target_height
-                crop_img = _pad_to_target_height(crop_img, target_height_px)
-
-
-            output_path = os.path.join(output, f"page_{i+1:03d}.png")
-            crop_img.save(output_path, "PNG")
-
-        click.echo(f"Done! Saved {len(crops)} images to {output}/")
+    if output is None:
+        if input_path == "-":
+            raise click.BadParameter("is required when reading from stdin", param_hint="'--output'")
+        output = default_output_path(input_path, options["output_format"])
+    stream_options = {key: options[key] for key in ("output_format", "format", "dpi", "window_frac", "min_gap",
+                                                    "cut_mode", "render_mode", "snap_px", "unsafe_window",
+                                                    "unsafe_threshold", "density_backend", "image_format",
+                                                    "compress_level", "quality")}
+    stats = PipelineStats() if options["profile"] else None
+
+    f = sys.stdin.buffer if input_path == "-" else open(input_path, 'rb')
+    try:
+        strips = iter_raw_strips(f, width, channels, strip_rows=options["strip_rows"] or 256)
+        result = paginate_stream(strips, output, lookahead_pages=lookahead_pages, stats=stats, log=click.echo,
+                                 **stream_options)
+    except (OSError, ValueError) as e:
+        click.echo(str(e), err=True)
+        sys.exit(1)
+    finally:
+        if f is not sys.stdin.buffer:
+            f.close()
+    result["input"] = input_path
+    if stats is not None:
+        _report_profile([result], profile_json)
+
+def _report_profile(results, profile_json):
+
+    profiled = [result for result in results if "profile" in result]
+    total = merge_profiles(result["profile"] for result in profiled)
+    click.echo(format_profile(total, sum(result["seconds"] for result in profiled)))
+    if profile_json:
+        with open(profile_json, 'w') as f:
+            json.dump({
+                "inputs": [{key: result[key] for key in ("input", "output", "pages", "width", "height",
+                                                         "seconds", "profile")}
+                           for result in profiled],
+                "total": total,
+            }, f, indent=2)
+        click.echo(f"Profile written to {profile_json}")
+
+def _run_batch(inputs, output_dir, workers, options):
+
+    click.echo(f"Batch mode: {len(inputs)} images, {workers or os.cpu_count()} workers")
+    start_time = time.perf_counter()
+    try:
+        results = paginate_batch(inputs, output_dir=output_dir, workers=workers, **options)
+    except ValueError as e:
+        click.echo(str(e), err=True)
+        sys.exit(1)
+    elapsed = time.perf_counter() - start_time
+
+    failed = 0
+    total_pages = 0
+    total_pixels = 0
+    for result in results:
+        if "error" in result:
+            failed += 1
+            click.echo(f"  FAILED {result['input']}: {result['error']}")
+            continue
+        total_pages += result["pages"]
+        total_pixels += result["width"] * result["height"]
+        click.echo(f"  {result['input']} -> {result['output']}: "
+                   f"{result['pages']} pages in {result['seconds']:.2f}s")
+
+    succeeded = len(results) - failed
+    seconds = max(elapsed, 1e-9)
+    click.echo(f"Processed {succeeded}/{len(results)} images ({total_pages} pages) in {elapsed:.2f}s: "
+               f"{succeeded / seconds:.2f} images/s, {total_pages / seconds:.2f} pages/s, "
+               f"{total_pixels / 1e6 / seconds:.1f} MPix/s")
+    return results
 
 if __name__ == "__main__":
     main()
@@ -1,31 +1,27 @@
-import cv2
+import bisect
+import heapq
 import numpy as np
+from collections import deque, namedtuple
 from enum import Enum
+from .density import (DensityBackend, THRESH_BLOCK_SIZE, THRESH_C, THRESH_HALO,
+                      iter_image_strips, iter_ink_density, compute_ink_density)
+from .profiling import timed, count
 
 class CutMode(Enum):
 
     WHITESPACE = "whitespace"
     FIXED_HEIGHT_SNAP = "fixed_height_snap"
 
+class DPEngine(Enum):
+
+    REFERENCE = "reference"
+    WINDOWED = "windowed"
+
 class RenderMode(Enum):
 
     VARIABLE_SIZE = "variable_size"
     FIXED_SIZE_WITH_PADDING = "fixed_size_with_padding"
 
-def compute_ink_density(image):
-
-    if len(image.shape) == 3:
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    else:
-        gray = image
-    binarized = cv2.adaptiveThreshold(
-        gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
-        cv2.THRESH_BINARY_INV, 11, 2
-    )
-    row_sums = np.sum(binarized, axis=1)
-    max_val = image.shape[1] * 255.0
-    return row_sums / max_val if max_val > 0 else row_sums
-
 def is_unsafe_cut(ink_profile, cut_row, unsafe_window_radius=2, unsafe_ink_threshold=0.3):
 
     H = len(ink_profile)
@@ -42,129 +38,143 @@ def is_unsafe_cut(ink_profile, cut_row, unsafe_window_radius=2, unsafe_ink_thres
 
     return min_ink_in_window > unsafe_ink_threshold
 
-def find_optimal_cuts_dp(ink_profile, target_height,
-                         window_frac=0.04,
-                         min_gap_rows=12,
-                         w_ink=1.0,
-                         w_height=1.0,
-                         smoothing_radius=10,
-                         band_size=200,
-                         gap_cap=0.05,
-                         basin_tol_floor=0.02,
-                         basin_tol_scale=0.25,
-                         cut_mode=CutMode.WHITESPACE,
-                         snap_px=40,
-                         unsafe_window_radius=2,
-                         unsafe_ink_threshold=0.3,
-                         return_debug_info=False):
+def compute_unsafe_mask(ink_profile, unsafe_window_radius=2, unsafe_ink_threshold=0.3):
 
+    ink_profile = np.asarray(ink_profile)
     H = len(ink_profile)
-    max_window = int(target_height * window_frac)
+    unsafe = np.zeros(H + 1, dtype=bool)
+    if H < 2:
+        return unsafe
 
+    radius = max(0, unsafe_window_radius)
+    padded = np.pad(ink_profile, radius, mode='edge')
+    window_min = np.lib.stride_tricks.sliding_window_view(padded, 2 * radius + 1).min(axis=1)
+    unsafe[1:H] = window_min[1:H] > unsafe_ink_threshold
+    return unsafe
 
-    if smoothing_radius > 0:
-        try:
-            from scipy.ndimage import uniform_filter1d
-            smoothed_profile = uniform_filter1d(ink_profile, size=2*smoothing_radius+1, mode='nearest')
-        except ImportError:
-            kernel_size = 2 * smoothing_radius + 1
-            kernel = np.ones(kernel_size) / kernel_size
-            padded = np.pad(ink_profile, (smoothing_radius, smoothing_radius), mode='edge')
-            smoothed_profile = np.convolve(padded, kernel, mode='valid')
-    else:
-        smoothed_profile = ink_profile.copy()
+def _gap_run_midpoints(is_gap, min_gap_rows):
+
+    edges = np.flatnonzero(np.diff(np.concatenate(([False], is_gap, [False])).view(np.int8)))
+    starts = edges[0::2]
+    lengths = edges[1::2] - starts
+    keep = lengths >= min_gap_rows
+    return starts[keep] + lengths[keep] // 2
+
+def _band_basins(bands, basin_tol_floor, basin_tol_scale):
 
+    min_vals = np.min(bands, axis=1)
+    median_vals = np.percentile(bands, 50, axis=1)
+    tolerances = np.maximum(basin_tol_floor, basin_tol_scale * (median_vals - min_vals))
 
-    candidates = set([0, H])
+    in_basin = bands <= (min_vals + tolerances)[:, None]
+    counts = np.count_nonzero(in_basin, axis=1)
+    rank = np.cumsum(in_basin, axis=1)
+    mid_local = np.argmax(in_basin & (rank == (counts // 2 + 1)[:, None]), axis=1)
 
+    valid = counts > 0
+    return mid_local[valid], min_vals[valid], tolerances[valid], np.flatnonzero(valid)
+
+def _band_basin_candidates(smoothed_profile, band_size, basin_tol_floor, basin_tol_scale):
+
+    H = len(smoothed_profile)
+    n_full = H // band_size
+    cands, min_vals, tolerances = [], [], []
+
+    if n_full > 0:
+        bands = smoothed_profile[:n_full * band_size].reshape(n_full, band_size)
+        mid_local, mins, tols, band_idx = _band_basins(bands, basin_tol_floor, basin_tol_scale)
+        cands.append(band_idx * band_size + mid_local)
+        min_vals.append(mins)
+        tolerances.append(tols)
+
+    if n_full * band_size < H:
+        tail = smoothed_profile[n_full * band_size:][None, :]
+        mid_local, mins, tols, _ = _band_basins(tail, basin_tol_floor, basin_tol_scale)
+        cands.append(n_full * band_size + mid_local)
+        min_vals.append(mins)
+        tolerances.append(tols)
+
+    if not cands:
+        return np.zeros(0, dtype=np.int64), np.zeros(0), np.zeros(0)
+    return np.concatenate(cands), np.concatenate(min_vals), np.concatenate(tolerances)
+
+def _gap_threshold(ink_profile, gap_cap):
 
     pct5 = np.percentile(ink_profile, 5)
-    gap_thresh = max(min(pct5, gap_cap), 1e-4) if np.max(ink_profile) > 0 else 0.01
-    is_gap = ink_profile <= gap_thresh
-
-    i = 0
-    while i < H:
-        if is_gap[i]:
-            start = i
-            while i < H and is_gap[i]:
-                i += 1
-            length = i - start
-            if length >= min_gap_rows:
-                candidates.add(start + length // 2)
-        else:
-            i += 1
+    return max(min(pct5, gap_cap), 1e-4) if np.max(ink_profile) > 0 else 0.01
 
+def _iter_snap_rows(unsafe_mask, H, target_height, snap_px):
 
-    bridge_candidates_debug = []
-    for start_row in range(0, H, band_size):
-        end_row = min(start_row + band_size, H)
-        band_vals = smoothed_profile[start_row:end_row]
+    ideal_cut_row = target_height
+    while ideal_cut_row < H:
 
-        if len(band_vals) == 0: continue
+        snap_start = max(0, ideal_cut_row - snap_px)
+        snap_end = min(H, ideal_cut_row + snap_px + 1)
 
-        min_val = np.min(band_vals)
-        median_val = np.percentile(band_vals, 50)
-        tolerance = max(basin_tol_floor, basin_tol_scale * (median_val - min_val))
+        yield ideal_cut_row, (np.flatnonzero(~unsafe_mask[snap_start:snap_end]) + snap_start).tolist()
 
-        min_indices = np.where(band_vals <= min_val + tolerance)[0]
+        ideal_cut_row += target_height
 
-        if len(min_indices) > 0:
-            mid_idx_local = min_indices[len(min_indices) // 2]
-            cand = start_row + mid_idx_local
-            candidates.add(cand)
-            if return_debug_info:
-                bridge_candidates_debug.append((cand, min_val, tolerance))
+TIE_EPS = 1e-9
+LAST_PAGE_MIN_HEIGHT = 50
 
+def _prefix_sums(values):
 
-    snap_candidates_debug = []
-    if cut_mode == CutMode.FIXED_HEIGHT_SNAP:
+    # Any window sum is then one subtraction: sum(values[a:b]) = sums[b] - sums[a].
+    return np.concatenate(([0.0], np.cumsum(values, dtype=np.float64)))
 
-        ideal_cut_row = target_height
-        while ideal_cut_row < H:
+def _row_cut_costs(smoothed_profile, smoothing_radius):
 
-            snap_start = max(0, ideal_cut_row - snap_px)
-            snap_end = min(H, ideal_cut_row + snap_px + 1)
+    # Ink cost of cutting above each row 0..H (the final cut at H is free): the
+    # mean of the smoothed rows within +/-2, clipped at the ends.
+    smoothed_profile = np.asarray(smoothed_profile)
+    H = len(smoothed_profile)
+    costs = np.zeros(H + 1)
+    if smoothing_radius <= 0:
+        costs[:H] = smoothed_profile
+        return costs
 
+    sums = _prefix_sums(smoothed_profile)
+    rows = np.arange(H)
+    lo = np.maximum(rows - 2, 0)
+    hi = np.minimum(rows + 3, H)
+    costs[:H] = (sums[hi] - sums[lo]) / (hi - lo)
+    return costs
 
-            for row in range(snap_start, snap_end):
-                if not is_unsafe_cut(ink_profile, row, unsafe_window_radius, unsafe_ink_threshold):
-                    candidates.add(row)
-                    if return_debug_info:
-                        snap_candidates_debug.append((row, ideal_cut_row))
+def _candidate_ink_costs(smoothed_profile, candidate_list, smoothing_radius):
 
-            ideal_cut_row += target_height
+    return _row_cut_costs(smoothed_profile, smoothing_radius)[np.asarray(candidate_list, dtype=np.int64)]
 
-    candidate_list = sorted(list(candidates))
-    n_cand = len(candidate_list)
+def _resume_prefix(dp, parent, resume):
+
+    # resume = (dp, parent) already solved for the first candidates.
+    if resume is None:
+        return 1
+    prefix_dp, prefix_parent = resume
+    dp[:len(prefix_dp)] = prefix_dp
+    parent[:len(prefix_parent)] = prefix_parent
+    return max(1, len(prefix_dp))
 
+def _solve_dp_reference(candidate_list, H, ink_costs, active, target_height, max_window,
+                        w_ink, w_height, return_debug_info, stats=None, resume=None):
 
+    n_cand = len(candidate_list)
     dp = np.full(n_cand, np.inf)
     parent = np.full(n_cand, -1, dtype=int)
 
 
     debug_costs = {} if return_debug_info else None
+    transitions = 0
 
     dp[0] = 0
+    first = _resume_prefix(dp, parent, resume)
 
-    for i in range(1, n_cand):
-        cut_row_curr = candidate_list[i]
-
-
-        if cut_mode == CutMode.FIXED_HEIGHT_SNAP:
-            if is_unsafe_cut(ink_profile, cut_row_curr, unsafe_window_radius, unsafe_ink_threshold):
-                continue
-
-
-        if cut_row_curr < H:
-             if smoothing_radius > 0:
-                 start_local = max(0, cut_row_curr - 2)
-                 end_local = min(H, cut_row_curr + 3)
-                 curr_ink_cost = np.mean(smoothed_profile[start_local:end_local])
-             else:
-                 curr_ink_cost = smoothed_profile[cut_row_curr]
-        else:
-             curr_ink_cost = 0.0
+    for i in range(first, n_cand):
+        if not active[i]:
+            continue
 
+        cut_row_curr = candidate_list[i]
+        curr_ink_cost = ink_costs[i]
         is_last_page = (cut_row_curr == H)
 
         for j in range(i-1, -1, -1):
@@ -175,22 +185,23 @@ def find_optimal_cuts_dp(ink_profile, target_height,
                 break
 
             if is_last_page:
-                if height < 50: continue
+                if height < LAST_PAGE_MIN_HEIGHT: continue
                 height_cost = 0.0
             else:
                 if abs(height - target_height) > max_window:
                     continue
                 height_cost = abs(height - target_height) / target_height
 
+            transitions += 1
             trans_cost = (w_ink * curr_ink_cost) + (w_height * height_cost)
             total_cost = dp[j] + trans_cost
 
-            if total_cost < dp[i] - 1e-9:
+            if total_cost < dp[i] - TIE_EPS:
                 dp[i] = total_cost
                 parent[i] = j
                 if return_debug_info:
                     debug_costs[i] = {'ink': curr_ink_cost, 'height': height_cost, 'prev': j}
-            elif dp[i] != np.inf and abs(total_cost - dp[i]) < 1e-9:
+            elif dp[i] != np.inf and abs(total_cost - dp[i]) < TIE_EPS:
 
                 current_prev = parent[i]
                 if current_prev != -1:
@@ -202,68 +213,1265 @@ def find_optimal_cuts_dp(ink_profile, target_height,
                         if return_debug_info:
                             debug_costs[i] = {'ink': curr_ink_cost, 'height': height_cost, 'prev': j}
 
+    count(stats, "dp_transitions", transitions)
+    return dp, parent, debug_costs
+
+def _select_predecessor(totals, dists):
+
+    # totals/dists are in the reference scan order (nearest predecessor first).
+    # When the near-minimal totals form a cluster well separated from the rest,
+    # the sequential epsilon scan provably picks the first closest-to-target
+    # entry of that cluster; otherwise replay the scan exactly.
+    if len(totals) == 1:
+        return 0 if totals[0] != np.inf else -1
+    best = totals.min()
+    if best == np.inf:
+        return -1
+    gaps = totals - best
+    in_cluster = gaps <= 0.5 * TIE_EPS
+    if not ((gaps < 3 * TIE_EPS) & ~in_cluster).any():
+        cluster = in_cluster.nonzero()[0]
+        return cluster[dists[cluster].argmin()]
+
+    chosen = -1
+    best = np.inf
+    for k in range(len(totals)):
+        total = totals[k]
+        if total < best - TIE_EPS:
+            best = total
+            chosen = k
+        elif best != np.inf and abs(total - best) < TIE_EPS and dists[k] < dists[chosen]:
+            best = total
+            chosen = k
+    return chosen
+
+def _decision_margin(totals):
+
+    # How far any total may move before _select_predecessor could choose
+    # differently; 0 when it had to fall back to the sequential scan.
+    finite = totals[totals != np.inf]
+    if len(finite) <= 1:
+        return np.inf
+    gaps = finite - finite.min()
+    if ((gaps > 0.5 * TIE_EPS) & (gaps < 3 * TIE_EPS)).any():
+        return 0.0
+    return min(np.abs(gaps - 0.5 * TIE_EPS).min(), np.abs(gaps - 3 * TIE_EPS).min())
+
+def _predecessor_totals(cand, dp, i, lo, hi, is_last_page, ink_cost, target_height, w_ink, w_height):
+
+    # Totals, distances from target and height costs of candidate i's
+    # predecessors lo..hi-1, nearest first as the reference solver scans them.
+    heights = cand[i] - cand[hi - 1:lo - 1 if lo > 0 else None:-1]
+    dists = np.abs(heights - target_height)
+    if is_last_page:
+        height_costs = np.zeros(len(heights))
+    else:
+        height_costs = dists / target_height
+
+    trans_costs = (w_ink * ink_cost) + (w_height * height_costs)
+    totals = dp[hi - 1:lo - 1 if lo > 0 else None:-1] + trans_costs
+    return totals, dists, height_costs
+
+def _relax_candidate(cand, dp, i, lo, hi, is_last_page, ink_cost, target_height, w_ink, w_height):
+
+    # Best predecessor of candidate i among lo..hi-1: (total cost, predecessor,
+    # height cost), or None.
+    totals, dists, height_costs = _predecessor_totals(cand, dp, i, lo, hi, is_last_page, ink_cost,
+                                                      target_height, w_ink, w_height)
+    k = _select_predecessor(totals, dists)
+    if k == -1:
+        return None
+    return totals[k], hi - 1 - k, float(height_costs[k])
+
+def _predecessor_windows(cand, H, target_height, max_window):
+
+    # Candidate i's feasible predecessors are lo[i]..hi[i]-1.
+    idx = np.arange(len(cand))
+    lo = np.searchsorted(cand, cand - (target_height + max_window), side='left')
+    hi = np.searchsorted(cand, cand - (target_height - max_window), side='right')
+    hi_last = np.searchsorted(cand, H - LAST_PAGE_MIN_HEIGHT, side='right')
+    hi = np.where(cand == H, hi_last, hi)
+    return lo, np.minimum(hi, idx)
+
+def _dominated_candidates(cand, H, ink_costs, active, target_height, max_window, w_ink, w_height):
+
+    # Candidate c is dominated by an adjacent candidate d when d can follow
+    # and precede every candidate c can, and is cheaper by more than moving
+    # from c's row to d's can cost in height on the two pages around it. Any
+    # path through c is then beaten through d, by more than the tie-breaking
+    # in _select_predecessor can drift over a window (n * TIE_EPS), so c is
+    # never chosen and leaving it out changes no dp value or parent.
+    n_cand = len(cand)
+    dominated = np.zeros(n_cand, dtype=bool)
+    if n_cand < 3:
+        return dominated
+    idx = np.arange(n_cand)
+    lo, hi = _predecessor_windows(cand, H, target_height, max_window)
+    succ_lo = np.maximum(np.searchsorted(cand, cand + (target_height - max_window), side='left'), idx + 1)
+    succ_hi = np.maximum(np.minimum(np.searchsorted(cand, cand + (target_height + max_window), side='right'),
+                                    n_cand - 1), succ_lo)
+    precedes_last = (lo[-1] <= idx) & (idx < hi[-1])
+    margin = (2 * int(np.max(hi - lo)) + 5) * TIE_EPS
+    active = np.asarray(active, dtype=bool)
+    row_ink = w_ink * np.asarray(ink_costs, dtype=np.float64)
+
+    c = idx[1:-1]
+    for d in (c - 1, c + 1):
+        preds_covered = (hi[c] <= lo[c]) | ((lo[d] <= lo[c]) & (hi[c] <= hi[d]))
+        succs_covered = (succ_hi[c] <= succ_lo[c]) | ((succ_lo[d] <= succ_lo[c]) & (succ_hi[c] <= succ_hi[d]))
+        succs_covered &= ~precedes_last[c] | precedes_last[d]
+        slack = 2 * abs(w_height) * np.abs(cand[c] - cand[d]) / target_height
+        dominated[c] |= (active[c] & active[d] & preds_covered & succs_covered
+                         & (row_ink[c] - row_ink[d] - slack > margin))
+    return dominated
+
+def _solve_dp_windowed(candidate_list, H, ink_costs, active, target_height, max_window,
+                       w_ink, w_height, return_debug_info, stats=None, resume=None):
+
+    # Feasible predecessors of a candidate are exactly the candidates whose
+    # rows fall in [row - (T + W), row - (T - W)] (or up to H - 50 for the
+    # final page), i.e. one contiguous index window found by binary search.
+    n_cand = len(candidate_list)
+    cand = np.asarray(candidate_list, dtype=np.int64)
+    dp = np.full(n_cand, np.inf)
+    parent = np.full(n_cand, -1, dtype=int)
+    debug_costs = {} if return_debug_info else None
+    transitions = 0
+    dp[0] = 0
+    first = _resume_prefix(dp, parent, resume)
 
-    path = []
-    curr = n_cand - 1
+    lo_all, hi_all = _predecessor_windows(cand, H, target_height, max_window)
 
-    curr = n_cand - 1
+    for i in range(first, n_cand):
+        if not active[i]:
+            continue
 
-    if dp[curr] == np.inf:
+        is_last_page = (candidate_list[i] == H)
+        lo, hi = lo_all[i], hi_all[i]
+        if hi <= lo:
+            continue
+        transitions += hi - lo
 
-        cuts = [0]
-        curr_h = 0
-        while curr_h < H:
-            curr_h += target_height
-            if curr_h >= H:
-                cuts.append(H)
-                break
-            cuts.append(min(curr_h, H))
-        final_cuts = sorted(list(set(cuts)))
+        best = _relax_candidate(cand, dp, i, lo, hi, is_last_page, ink_costs[i], target_height, w_ink, w_height)
+        if best is None:
+            continue
+
+        dp[i], parent[i], height_cost = best
+        if return_debug_info:
+            debug_costs[i] = {'ink': ink_costs[i], 'height': height_cost, 'prev': int(parent[i])}
+
+    count(stats, "dp_transitions", int(transitions))
+    return dp, parent, debug_costs
+
+DP_SEGMENT_MIN_CANDIDATES = 256
+
+def _dp_separators(lo, hi, active):
+
+    # Reachable candidates that no edge from a reachable candidate jumps
+    # over: every path to a later candidate passes through them, so the DP
+    # after one depends on what came before only through its dp value.
+    n_cand = len(lo)
+    reach = np.zeros(n_cand, dtype=bool)
+    reached = np.zeros(n_cand + 1, dtype=np.int64)
+    if n_cand:
+        reach[0] = True
+        reached[1] = 1
+    for i in range(1, n_cand):
+        reach[i] = active[i] and hi[i] > lo[i] and reached[hi[i]] > reached[lo[i]]
+        reached[i + 1] = reached[i] + reach[i]
+    # Edges leave lo[i] at the earliest; candidate b is spanned by none when
+    # every reachable candidate after it starts its window at b or later.
+    first_pred = np.where(reach, lo, n_cand)
+    after_min = np.minimum.accumulate(first_pred[::-1])[::-1]
+    b = np.arange(1, n_cand - 1)
+    return b[reach[b] & (after_min[b + 1] >= b)]
+
+def _split_segments(separators, n_cand, n_parts):
+
+    # Boundaries 0 = s_0 < ... < s_k = n_cand - 1 at separators, into roughly
+    # n_parts runs of similar candidate counts.
+    bounds = [0]
+    step = max(DP_SEGMENT_MIN_CANDIDATES, n_cand // max(1, n_parts))
+    for b in separators:
+        if b - bounds[-1] >= step and n_cand - 1 - b >= DP_SEGMENT_MIN_CANDIDATES:
+            bounds.append(int(b))
+    bounds.append(n_cand - 1)
+    return bounds
+
+def _solve_dp_segment(args):
+
+    # Solves candidates[0..] of one segment from dp = 0 at its first one.
+    # Also returns the smallest decision margin and the longest path, which
+    # bound how much rounding an offset start could change.
+    cand, H, ink_costs, active, target_height, max_window, w_ink, w_height, return_debug_info = args
+    n_cand = len(cand)
+    dp = np.full(n_cand, np.inf)
+    parent = np.full(n_cand, -1, dtype=int)
+    depth = np.zeros(n_cand, dtype=np.int64)
+    debug_costs = {} if return_debug_info else None
+    margin = np.inf
+    dp[0] = 0
+    lo_all, hi_all = _predecessor_windows(cand, H, target_height, max_window)
 
+    for i in range(1, n_cand):
+        lo, hi = lo_all[i], hi_all[i]
+        if not active[i] or hi <= lo:
+            continue
+        is_last_page = (cand[i] == H)
+        totals, dists, height_costs = _predecessor_totals(cand, dp, i, lo, hi, is_last_page, ink_costs[i],
+                                                          target_height, w_ink, w_height)
+        k = _select_predecessor(totals, dists)
+        if k == -1:
+            continue
+        margin = min(margin, _decision_margin(totals))
+        dp[i], parent[i] = totals[k], hi - 1 - k
+        depth[i] = depth[parent[i]] + 1
         if return_debug_info:
+            debug_costs[i] = {'ink': ink_costs[i], 'height': float(height_costs[k]), 'prev': int(parent[i])}
+
+    return dp, parent, debug_costs, margin, int(depth.max()) if n_cand else 0
+
+def _replay_dp(dp, parent, cand, H, ink_costs, start, end, target_height, w_ink, w_height):
+
+    # Recomputes dp[start+1..end] from dp[start] along the chosen parents with
+    # the solvers' own arithmetic, so the values match a single pass exactly.
+    for i in range(start + 1, end + 1):
+        p = parent[i]
+        if p == -1:
+            dp[i] = np.inf
+            continue
+        if cand[i] == H:
+            height_cost = np.zeros(1)
+        else:
+            height_cost = np.abs(cand[i:i + 1] - cand[p] - target_height) / target_height
+        dp[i] = (dp[p] + ((w_ink * ink_costs[i]) + (w_height * height_cost)))[0]
+
+def _rounding_drift(start, seg_dp, depth):
+
+    # How far starting a segment from `start` instead of 0 can move any of
+    # its totals, for paths of at most `depth` pages.
+    finite = seg_dp[seg_dp != np.inf]
+    return 8 * (depth + 4) * np.finfo(np.float64).eps * (start + 2 * finite.max() + 1)
+
+def _solve_dp_segmented(candidate_list, H, ink_costs, active, target_height, max_window,
+                        w_ink, w_height, return_debug_info, stats=None, workers=2):
+
+    # Splits the windowed DP at separator candidates and solves the segments
+    # in worker processes. Each segment starts from 0 instead of its
+    # separator's dp value; that offset only changes rounding, so a segment's
+    # choices are kept when every decision had more margin than the rounding
+    # could take, and solved again from the exact value otherwise.
+    cand = np.asarray(candidate_list, dtype=np.int64)
+    n_cand = len(cand)
+    lo_all, hi_all = _predecessor_windows(cand, H, target_height, max_window)
+    bounds = _split_segments(_dp_separators(lo_all, hi_all, active), n_cand, 2 * workers)
+    if len(bounds) <= 2:
+        return _solve_dp_windowed(candidate_list, H, ink_costs, active, target_height, max_window,
+                                  w_ink, w_height, return_debug_info, stats)
+
+    from concurrent.futures import ProcessPoolExecutor
+    jobs = [(cand[a:b + 1], H, ink_costs[a:b + 1], active[a:b + 1], target_height, max_window,
+             w_ink, w_height, return_debug_info) for a, b in zip(bounds, bounds[1:])]
+    with ProcessPoolExecutor(max_workers=min(workers, len(jobs))) as executor:
+        segments = list(executor.map(_solve_dp_segment, jobs))
+
+    dp = np.full(n_cand, np.inf)
+    parent = np.full(n_cand, -1, dtype=int)
+    debug_costs = {} if return_debug_info else None
+    dp[0] = 0
+    resolved = 0
+    for (a, b), job, (seg_dp, seg_parent, seg_debug, margin, depth) in zip(zip(bounds, bounds[1:]), jobs, segments):
+        start = dp[a]
+        if not margin > _rounding_drift(start, seg_dp, depth):
+            seg_dp, seg_parent, seg_debug = _solve_dp_windowed(*job[:-1], return_debug_info, None, ([start], [-1]))
+            resolved += 1
+        parent[a + 1:b + 1] = np.where(seg_parent[1:] == -1, -1, seg_parent[1:] + a)
+        _replay_dp(dp, parent, cand, H, ink_costs, a, b, target_height, w_ink, w_height)
+        if return_debug_info:
+            for i, info in seg_debug.items():
+                debug_costs[i + a] = dict(info, prev=info['prev'] + a)
+
+    transitions = np.maximum(hi_all - lo_all, 0)[1:][np.asarray(active[1:], dtype=bool)].sum()
+    count(stats, "dp_transitions", int(transitions))
+    count(stats, "dp_segments", len(jobs))
+    count(stats, "dp_segments_resolved", resolved)
+    return dp, parent, debug_costs
+
+def _settled_rows(rows, gap_run_start, smoothing_radius, band_size, cut_mode, snap_px, unsafe_window_radius):
+
+    # Candidates, their costs and safety flags below the returned row depend
+    # only on profile rows < `rows`, whatever comes after them. gap_run_start
+    # is where the gap run reaching row rows-1 began, or None.
+    radius = max(0, smoothing_radius)
+    settled = min(rows - radius - 2, ((rows - radius) // band_size) * band_size)
+    if cut_mode == CutMode.FIXED_HEIGHT_SNAP:
+        settled = min(settled, rows - max(0, unsafe_window_radius), rows - snap_px)
+    if gap_run_start is not None:
+        settled = min(settled, gap_run_start + (rows - gap_run_start) // 2)
+    return max(0, settled)
+
+def _smooth_profile(ink_profile, smoothing_radius):
+
+    # Differs from a direct windowed mean by rounding only, but _band_basins
+    # compares these values exactly, so on profiles with many equal rows
+    # (quantized ink) a basin midpoint, and with it a cut, can shift.
+    if smoothing_radius <= 0:
+        return np.array(ink_profile, dtype=np.float64)
+    size = 2 * smoothing_radius + 1
+    padded = np.pad(np.asarray(ink_profile, dtype=np.float64), smoothing_radius, mode='edge')
+    sums = _prefix_sums(padded)
+    return (sums[size:] - sums[:-size]) / size
+
+def _fixed_height_cuts(H, target_height):
+
+    cuts = [0]
+    curr_h = 0
+    while curr_h < H:
+        curr_h += target_height
+        if curr_h >= H:
+            cuts.append(H)
+            break
+        cuts.append(min(curr_h, H))
+    return sorted(list(set(cuts)))
+
+DPSolution = namedtuple("DPSolution", ["candidates", "dp", "parent", "debug_costs", "snap_debug", "unsafe_mask",
+                                       "pruned"])
+
+class Paginator:
+
+    def __init__(self, ink_profile,
+                 min_gap_rows=12,
+                 smoothing_radius=10,
+                 band_size=200,
+                 gap_cap=0.05,
+                 basin_tol_floor=0.02,
+                 basin_tol_scale=0.25):
+
+        # Smoothing, gap runs, band basins and per-row cut costs depend only on
+        # the profile, so they are computed on the first query and reused by
+        # every later one, whatever its page height, weights or cut mode.
+        self.ink_profile = np.asarray(ink_profile)
+        self.H = len(self.ink_profile)
+        self.min_gap_rows = min_gap_rows
+        self.smoothing_radius = smoothing_radius
+        self.band_size = band_size
+        self.gap_cap = gap_cap
+        self.basin_tol_floor = basin_tol_floor
+        self.basin_tol_scale = basin_tol_scale
+        self._analyzed = False
+        self._unsafe_masks = {}
+
+    def _analyze(self):
+
+        if self._analyzed:
+            return
+        self.smoothed_profile = _smooth_profile(self.ink_profile, self.smoothing_radius)
+        self.row_costs = _row_cut_costs(self.smoothed_profile, self.smoothing_radius)
+        self.gap_thresh = _gap_threshold(self.ink_profile, self.gap_cap)
+        gap_mids = _gap_run_midpoints(self.ink_profile <= self.gap_thresh, self.min_gap_rows)
+        self.bridge_candidates = _band_basin_candidates(
+            self.smoothed_profile, self.band_size, self.basin_tol_floor, self.basin_tol_scale)
+        self.base_candidates = frozenset([0, self.H] + gap_mids.tolist() + self.bridge_candidates[0].tolist())
+        self._analyzed = True
+
+    def unsafe_mask(self, unsafe_window_radius=2, unsafe_ink_threshold=0.3):
+
+        key = (unsafe_window_radius, unsafe_ink_threshold)
+        if key not in self._unsafe_masks:
+            self._unsafe_masks[key] = compute_unsafe_mask(self.ink_profile, unsafe_window_radius, unsafe_ink_threshold)
+        return self._unsafe_masks[key]
+
+    def candidates(self, target_height,
+                   cut_mode=CutMode.WHITESPACE,
+                   snap_px=40,
+                   unsafe_window_radius=2,
+                   unsafe_ink_threshold=0.3,
+                   return_debug_info=False):
+
+        self._analyze()
+        snap_candidates_debug = []
+        if cut_mode != CutMode.FIXED_HEIGHT_SNAP:
+            return sorted(self.base_candidates), snap_candidates_debug
+
+        candidates = set(self.base_candidates)
+        unsafe_mask = self.unsafe_mask(unsafe_window_radius, unsafe_ink_threshold)
+        for ideal_cut_row, safe_rows in _iter_snap_rows(unsafe_mask, self.H, target_height, snap_px):
+            candidates.update(safe_rows)
+            if return_debug_info:
+                snap_candidates_debug.extend((row, ideal_cut_row) for row in safe_rows)
+        return sorted(candidates), snap_candidates_debug
+
+    def settled_rows(self, rows, cut_mode=CutMode.WHITESPACE, snap_px=40, unsafe_window_radius=2):
+
+        # Candidates and DP values below the returned row only depend on the
+        # first `rows` rows of the profile.
+        self._analyze()
+        is_gap = self.ink_profile[:rows] <= self.gap_thresh
+        gap_run_start = None
+        if rows > 0 and is_gap[-1]:
+            gap_run_start = rows - int(np.argmin(is_gap[::-1])) if not is_gap.all() else 0
+        return _settled_rows(rows, gap_run_start, self.smoothing_radius, self.band_size,
+                             cut_mode, snap_px, unsafe_window_radius)
+
+    def _resumable(self, candidate_list, pruned, resume, resume_rows, stats):
+
+        # The previous solution's dp/parent hold for every candidate below
+        # resume_rows, provided those candidates, and which of them were
+        # pruned, are unchanged.
+        k = bisect.bisect_left(candidate_list, resume_rows)
+        old = np.asarray(resume.candidates)
+        if np.searchsorted(old, resume_rows, side='left') != k or not np.array_equal(old[:k], candidate_list[:k]):
+            return None
+        if not np.array_equal(np.asarray(resume.pruned)[:k], pruned[:k]):
+            return None
+        count(stats, "dp_reused_candidates", k)
+        return np.asarray(resume.dp)[:k], np.asarray(resume.parent)[:k]
+
+    def solve(self, target_height,
+              window_frac=0.04,
+              w_ink=1.0,
+              w_height=1.0,
+              cut_mode=CutMode.WHITESPACE,
+              snap_px=40,
+              unsafe_window_radius=2,
+              unsafe_ink_threshold=0.3,
+              dp_engine=DPEngine.WINDOWED,
+              resume=None,
+              resume_rows=0,
+              workers=1,
+              prune=True,
+              return_debug_info=False,
+              stats=None):
+
+        # resume is an earlier DPSolution for a profile that matches this one
+        # on its first resume_rows rows; only the candidates past
+        # settled_rows(resume_rows) are solved again. prune skips candidates
+        # that a neighbour provably beats; the cuts are the same either way.
+        H = self.H
+        max_window = int(target_height * window_frac)
+
+        with timed(stats, "candidates"):
+            candidate_list, snap_candidates_debug = self.candidates(
+                target_height,
+                cut_mode=cut_mode,
+                snap_px=snap_px,
+                unsafe_window_radius=unsafe_window_radius,
+                unsafe_ink_threshold=unsafe_ink_threshold,
+                return_debug_info=return_debug_info)
+        n_cand = len(candidate_list)
+        count(stats, "candidates", n_cand)
+
+        unsafe_mask = None
+        if cut_mode == CutMode.FIXED_HEIGHT_SNAP:
+            unsafe_mask = self.unsafe_mask(unsafe_window_radius, unsafe_ink_threshold)
 
-            reason = "unknown"
-            if n_cand <= 2:
-                reason = "no_internal_candidates"
+        with timed(stats, "dp"):
+            ink_costs = self.row_costs[candidate_list]
+            if unsafe_mask is not None:
+                active = (~unsafe_mask[candidate_list]).tolist()
             else:
-                reason = "no_valid_path_to_end"
+                active = [True] * n_cand
+
+            pruned = np.zeros(n_cand, dtype=bool)
+            if prune:
+                pruned = _dominated_candidates(np.asarray(candidate_list, dtype=np.int64), H, ink_costs, active,
+                                               target_height, max_window, w_ink, w_height)
+                active = (np.asarray(active, dtype=bool) & ~pruned).tolist()
+            count(stats, "candidates_pruned", int(pruned.sum()))
+
+            prefix = None
+            if resume is not None:
+                settled = self.settled_rows(resume_rows, cut_mode, snap_px, unsafe_window_radius)
+                prefix = self._resumable(candidate_list, pruned, resume, settled, stats)
+
+            if workers > 1 and dp_engine == DPEngine.WINDOWED and prefix is None:
+                dp, parent, debug_costs = _solve_dp_segmented(candidate_list, H, ink_costs, active,
+                                                              target_height, max_window, w_ink, w_height,
+                                                              return_debug_info, stats, workers)
+            else:
+                solve = _solve_dp_reference if dp_engine == DPEngine.REFERENCE else _solve_dp_windowed
+                dp, parent, debug_costs = solve(candidate_list, H, ink_costs, active,
+                                                target_height, max_window, w_ink, w_height,
+                                                return_debug_info, stats, prefix)
+
+        return DPSolution(candidate_list, dp, parent, debug_costs, snap_candidates_debug, unsafe_mask, pruned)
+
+    def backtrack(self, solution, target_height, cut_mode=CutMode.WHITESPACE, return_debug_info=False):
+
+        H = self.H
+        candidate_list, dp, parent, debug_costs, snap_candidates_debug, unsafe_mask, pruned = solution
+        n_cand = len(candidate_list)
+        n_pruned = int(np.count_nonzero(pruned))
+
+        bridge_candidates_debug = []
+        if return_debug_info:
+            bridge_candidates_debug = list(zip(*(values.tolist() for values in self.bridge_candidates)))
+
+        curr = n_cand - 1
+
+        if dp[curr] == np.inf:
+
+            final_cuts = _fixed_height_cuts(H, target_height)
+
+            if return_debug_info:
+
+                reason = "unknown"
+                if n_cand <= 2:
+                    reason = "no_internal_candidates"
+                else:
+                    reason = "no_valid_path_to_end"
+
+                return final_cuts, {
+                    "candidates": candidate_list,
+                    "bridge_debug": bridge_candidates_debug,
+                    "snap_debug": snap_candidates_debug if cut_mode == CutMode.FIXED_HEIGHT_SNAP else [],
+                    "chosen_path_costs": [],
+                    "gap_thresh": self.gap_thresh,
+                    "unsafe_mask": unsafe_mask,
+                    "pruned_candidates": n_pruned,
+                    "pruning_ratio": n_pruned / max(1, n_cand),
+                    "fallback": True,
+                    "fallback_reason": reason,
+                    "debug_schema_version": 1
+                }
+            return final_cuts
+
+        path = []
+        path_nodes = []
+        while curr != -1:
+            path.append(candidate_list[curr])
+            path_nodes.append(curr)
+            curr = parent[curr]
+
+        final_cuts = list(reversed(path))
+
+        if return_debug_info:
 
+            chosen_details = []
+            path_nodes = list(reversed(path_nodes))
+            for idx in path_nodes:
+                if idx in debug_costs:
+                    chosen_details.append(debug_costs[idx])
             return final_cuts, {
                 "candidates": candidate_list,
                 "bridge_debug": bridge_candidates_debug,
                 "snap_debug": snap_candidates_debug if cut_mode == CutMode.FIXED_HEIGHT_SNAP else [],
-                "chosen_path_costs": [],
-                "gap_thresh": gap_thresh,
-                "fallback": True,
-                "fallback_reason": reason,
+                "chosen_path_costs": chosen_details,
+                "gap_thresh": self.gap_thresh,
+                "unsafe_mask": unsafe_mask,
+                "pruned_candidates": n_pruned,
+                "pruning_ratio": n_pruned / max(1, n_cand),
+                "fallback": False,
+                "fallback_reason": None,
                 "debug_schema_version": 1
             }
+
         return final_cuts
 
-    path_nodes = []
-    while curr != -1:
-        path.append(candidate_list[curr])
-        path_nodes.append(curr)
-        curr = parent[curr]
-
-    final_cuts = list(reversed(path))
-
-    if return_debug_info:
-
-        chosen_details = []
-        path_nodes = list(reversed(path_nodes))
-        for idx in path_nodes:
-            if idx in debug_costs:
-                chosen_details.append(debug_costs[idx])
-        return final_cuts, {
-            "candidates": candidate_list,
-            "bridge_debug": bridge_candidates_debug,
-            "snap_debug": snap_candidates_debug if cut_mode == CutMode.FIXED_HEIGHT_SNAP else [],
-            "chosen_path_costs": chosen_details,
-            "gap_thresh": gap_thresh,
-            "fallback": False,
-            "fallback_reason": None,
-            "debug_schema_version": 1
-        }
-
-    return final_cuts
+    def cuts(self, target_height,
+             window_frac=0.04,
+             w_ink=1.0,
+             w_height=1.0,
+             cut_mode=CutMode.WHITESPACE,
+             snap_px=40,
+             unsafe_window_radius=2,
+             unsafe_ink_threshold=0.3,
+             dp_engine=DPEngine.WINDOWED,
+             workers=1,
+             prune=True,
+             return_debug_info=False,
+             stats=None):
+
+        solution = self.solve(target_height,
+                              window_frac=window_frac,
+                              w_ink=w_ink,
+                              w_height=w_height,
+                              cut_mode=cut_mode,
+                              snap_px=snap_px,
+                              unsafe_window_radius=unsafe_window_radius,
+                              unsafe_ink_threshold=unsafe_ink_threshold,
+                              dp_engine=dp_engine,
+                              workers=workers,
+                              prune=prune,
+                              return_debug_info=return_debug_info,
+                              stats=stats)
+        return self.backtrack(solution, target_height, cut_mode=cut_mode, return_debug_info=return_debug_info)
+
+def find_optimal_cuts_dp(ink_profile, target_height,
+                         window_frac=0.04,
+                         min_gap_rows=12,
+                         w_ink=1.0,
+                         w_height=1.0,
+                         smoothing_radius=10,
+                         band_size=200,
+                         gap_cap=0.05,
+                         basin_tol_floor=0.02,
+                         basin_tol_scale=0.25,
+                         cut_mode=CutMode.WHITESPACE,
+                         snap_px=40,
+                         unsafe_window_radius=2,
+                         unsafe_ink_threshold=0.3,
+                         dp_engine=DPEngine.WINDOWED,
+                         workers=1,
+                         prune=True,
+                         return_debug_info=False,
+                         stats=None):
+
+    # workers > 1 solves independent stretches of the windowed DP in that many
+    # processes; the cuts are the same as with one.
+    paginator = Paginator(ink_profile,
+                          min_gap_rows=min_gap_rows,
+                          smoothing_radius=smoothing_radius,
+                          band_size=band_size,
+                          gap_cap=gap_cap,
+                          basin_tol_floor=basin_tol_floor,
+                          basin_tol_scale=basin_tol_scale)
+    return paginator.cuts(target_height,
+                          window_frac=window_frac,
+                          w_ink=w_ink,
+                          w_height=w_height,
+                          cut_mode=cut_mode,
+                          snap_px=snap_px,
+                          unsafe_window_radius=unsafe_window_radius,
+                          unsafe_ink_threshold=unsafe_ink_threshold,
+                          dp_engine=dp_engine,
+                          workers=workers,
+                          prune=prune,
+                          return_debug_info=return_debug_info,
+                          stats=stats)
+
+ONLINE_CALIBRATION_PAGES = 4
+ONLINE_LOOKAHEAD_PAGES = 8
+
+class _RowBuffer:
+
+    # The retained tail of a growing per-row array, indexed by absolute row.
+
+    def __init__(self, values=(), dtype=np.float64):
+
+        self.start = 0
+        self.data = np.asarray(values, dtype=dtype)
+
+    @property
+    def end(self):
+        return self.start + len(self.data)
+
+    def rows(self, lo, hi):
+        return self.data[lo - self.start:hi - self.start]
+
+    def extend(self, values):
+        self.data = np.concatenate((self.data, values))
+
+    def trim(self, lo):
+        if lo > self.start:
+            self.data = self.data[lo - self.start:]
+            self.start = lo
+
+def _extend_prefix_sums(sums, values):
+
+    # Continues the running sum from its last entry, so the result is bit for
+    # bit what _prefix_sums gives on the whole array at once.
+    sums.extend(np.cumsum(np.concatenate((sums.data[-1:], values)))[1:])
+
+class OnlinePaginator:
+
+    def __init__(self, target_height,
+                 window_frac=0.04,
+                 min_gap_rows=12,
+                 w_ink=1.0,
+                 w_height=1.0,
+                 smoothing_radius=10,
+                 band_size=200,
+                 gap_cap=0.05,
+                 basin_tol_floor=0.02,
+                 basin_tol_scale=0.25,
+                 cut_mode=CutMode.WHITESPACE,
+                 snap_px=40,
+                 unsafe_window_radius=2,
+                 unsafe_ink_threshold=0.3,
+                 gap_thresh=None,
+                 calibration_rows=None,
+                 max_lookahead_rows=None,
+                 stats=None):
+
+        # Profile rows arrive in chunks through feed(). Candidates and DP
+        # values are extended once no later row can change them, and a cut is
+        # committed as soon as every path a later page could extend runs
+        # through it. Committed cuts therefore match find_optimal_cuts_dp on
+        # the finished profile, given the same gap threshold: offline that is
+        # a percentile of the whole profile, here it is gap_thresh or taken
+        # from the first calibration_rows rows. When nothing coalesces within
+        # max_lookahead_rows of the last cut, the cheapest path's next cut is
+        # committed anyway and counted in forced_commits. Gap runs longer than
+        # a page plus the window are split into pieces of that length, each
+        # with its own midpoint, so a long blank stretch does not hold the
+        # frontier back; offline they give a single candidate. When no path
+        # reaches the frontier at all, fixed-height pages are cut from the last
+        # committed cut and the DP starts again from the last of them; those
+        # pages are counted in fallback_pages.
+        self.target_height = target_height
+        self.max_window = int(target_height * window_frac)
+        self.min_gap_rows = min_gap_rows
+        self.w_ink = w_ink
+        self.w_height = w_height
+        self.smoothing_radius = smoothing_radius
+        self.band_size = band_size
+        self.gap_cap = gap_cap
+        self.basin_tol_floor = basin_tol_floor
+        self.basin_tol_scale = basin_tol_scale
+        self.cut_mode = cut_mode
+        self.snap_px = snap_px
+        self.unsafe_window_radius = max(0, unsafe_window_radius)
+        self.unsafe_ink_threshold = unsafe_ink_threshold
+        self.gap_thresh = gap_thresh
+        self.calibration_rows = (ONLINE_CALIBRATION_PAGES * target_height
+                                 if calibration_rows is None else calibration_rows)
+        if max_lookahead_rows is None:
+            max_lookahead_rows = ONLINE_LOOKAHEAD_PAGES * target_height
+        # Forcing a cut closer than one page to the frontier could commit a
+        # candidate that later pages still need to choose between.
+        self.max_lookahead_rows = max(max_lookahead_rows, 2 * (target_height + self.max_window))
+        self.stats = stats
+
+        self.rows = 0
+        self.cuts = [0]
+        self.forced_commits = 0
+        self.fallback_pages = 0
+        self.finished = False
+        self.max_pending_rows = 0
+
+        self._calibration = []
+        self._profile = _RowBuffer()
+        self._padded_sums = _RowBuffer([0.0])
+        self._smoothed = _RowBuffer()
+        self._smoothed_sums = _RowBuffer([0.0])
+        self._row_costs = _RowBuffer()
+        self._gap_open = None
+        self._gap_mids = deque()
+        self._done = 0
+        self._cand = _RowBuffer(dtype=np.int64)
+        self._dp = _RowBuffer()
+        self._parent = _RowBuffer(dtype=np.int64)
+        self._committed = 0
+
+    @property
+    def pending_rows(self):
+        return self.rows - self.cuts[-1]
+
+    def feed(self, profile_chunk):
+
+        # Returns the cuts committed by this chunk.
+        if self.finished:
+            raise ValueError("feed() called after finish()")
+        values = np.asarray(profile_chunk, dtype=np.float64).ravel()
+        if len(values) == 0:
+            return []
+        if self.gap_thresh is None:
+            self._calibration.append(values)
+            if sum(len(chunk) for chunk in self._calibration) < self.calibration_rows:
+                return []
+            values = np.concatenate(self._calibration)
+            self._calibration = []
+            self.gap_thresh = _gap_threshold(values, self.gap_cap)
+        self._ingest(values)
+        new_cuts = self._advance(final=False)
+        self.max_pending_rows = max(self.max_pending_rows, self.pending_rows)
+        return new_cuts
+
+    def finish(self):
+
+        # Ends the stream and returns the remaining cuts, ending at the last row.
+        if self.finished:
+            return []
+        self.finished = True
+        if self.gap_thresh is None:
+            values = np.concatenate(self._calibration) if self._calibration else np.zeros(0)
+            self._calibration = []
+            self.gap_thresh = _gap_threshold(values, self.gap_cap) if len(values) else self.gap_cap
+            if len(values):
+                self._ingest(values)
+        if self.rows == 0:
+            return []
+        if self._gap_open is not None:
+            self._add_gap_run(self._gap_open, self.rows)
+            self._gap_open = None
+        return self._advance(final=True)
+
+    def _ingest(self, values):
+
+        radius = self.smoothing_radius
+        start = self.rows
+        if start == 0 and radius > 0:
+            _extend_prefix_sums(self._padded_sums, np.full(radius, values[0]))
+        _extend_prefix_sums(self._padded_sums, values)
+        self._profile.extend(values)
+        self.rows += len(values)
+        self._scan_gaps(values, start)
+
+    def _scan_gaps(self, values, start):
+
+        is_gap = values <= self.gap_thresh
+        edges = np.flatnonzero(np.diff(np.concatenate(([False], is_gap, [False])).view(np.int8)))
+        starts = (edges[0::2] + start).tolist()
+        ends = (edges[1::2] + start).tolist()
+        if self._gap_open is not None:
+            if starts and starts[0] == start:
+                starts[0] = self._gap_open
+            else:
+                starts.insert(0, self._gap_open)
+                ends.insert(0, start)
+        self._gap_open = None
+        if starts and ends[-1] == self.rows:
+            self._gap_open = starts.pop()
+            ends.pop()
+        for run_start, run_end in zip(starts, ends):
+            self._add_gap_run(run_start, run_end)
+        step = self.target_height + self.max_window
+        while self._gap_open is not None and self.rows - self._gap_open > step:
+            self._gap_mids.append(self._gap_open + step // 2)
+            self._gap_open += step
+
+    def _add_gap_run(self, run_start, run_end):
+
+        # Split the same way whether the run ended in one chunk or several.
+        step = self.target_height + self.max_window
+        while run_end - run_start > step:
+            self._gap_mids.append(run_start + step // 2)
+            run_start += step
+        if run_end - run_start >= self.min_gap_rows:
+            self._gap_mids.append(run_start + (run_end - run_start) // 2)
+
+    def _extend_costs(self, final):
+
+        H = self.rows
+        radius = self.smoothing_radius
+        if radius <= 0:
+            smoothed = self._profile.rows(self._smoothed.end, H)
+        else:
+            if final:
+                _extend_prefix_sums(self._padded_sums, np.full(radius, self._profile.rows(H - 1, H)[0]))
+            size = 2 * radius + 1
+            lo = self._smoothed.end
+            hi = max(lo, self._padded_sums.end - size)
+            smoothed = (self._padded_sums.rows(lo + size, hi + size) - self._padded_sums.rows(lo, hi)) / size
+        self._smoothed.extend(smoothed)
+
+        if radius <= 0:
+            costs = smoothed
+        else:
+            _extend_prefix_sums(self._smoothed_sums, smoothed)
+            rows = np.arange(self._row_costs.end, H if final else self._smoothed.end - 2)
+            lo = np.maximum(rows - 2, 0)
+            hi = np.minimum(rows + 3, H)
+            sums = self._smoothed_sums
+            costs = (sums.data[hi - sums.start] - sums.data[lo - sums.start]) / (hi - lo)
+        if final:
+            costs = np.concatenate((costs, [0.0]))
+        self._row_costs.extend(costs)
+
+    def _frontier(self):
+
+        return min(self._row_costs.end,
+                   _settled_rows(self.rows, self._gap_open, self.smoothing_radius, self.band_size,
+                                 self.cut_mode, self.snap_px, self.unsafe_window_radius))
+
+    def _unsafe_rows(self, lo, hi, final):
+
+        # compute_unsafe_mask on a slice wide enough that rows lo..hi-1 see the
+        # same window (and the same edge padding) as on the whole profile.
+        radius = self.unsafe_window_radius
+        start = max(0, lo - radius - 1)
+        end = self.rows if final else hi + radius
+        mask = compute_unsafe_mask(self._profile.rows(start, end), radius, self.unsafe_ink_threshold)
+        return mask[lo - start:hi - start]
+
+    def _new_candidates(self, lo, hi, final):
+
+        H = self.rows
+        found = [np.arange(1) if lo == 0 else np.zeros(0, dtype=np.int64)]
+
+        mids = []
+        while self._gap_mids and self._gap_mids[0] < hi:
+            mids.append(self._gap_mids.popleft())
+        found.append(np.asarray(mids, dtype=np.int64))
+
+        size = self.band_size
+        first, n_full = lo // size, min((hi - 1) // size + 1, self._smoothed.end // size)
+        if n_full > first:
+            bands = self._smoothed.rows(first * size, n_full * size).reshape(-1, size)
+            mid_local, _, _, band_idx = _band_basins(bands, self.basin_tol_floor, self.basin_tol_scale)
+            found.append((first + band_idx) * size + mid_local)
+        if final and n_full * size < H:
+            tail = self._smoothed.rows(n_full * size, H)[None, :]
+            mid_local, _, _, _ = _band_basins(tail, self.basin_tol_floor, self.basin_tol_scale)
+            found.append(n_full * size + mid_local)
+
+        unsafe = None
+        if self.cut_mode == CutMode.FIXED_HEIGHT_SNAP:
+            unsafe = self._unsafe_rows(lo, hi, final)
+            rows = np.arange(lo, hi)
+            ideal = (np.minimum(rows + self.snap_px, H - 1) if final else rows + self.snap_px)
+            ideal -= ideal % self.target_height
+            found.append(rows[(ideal >= self.target_height) & (ideal >= rows - self.snap_px) & ~unsafe])
+
+        cands = np.unique(np.concatenate(found).astype(np.int64))
+        cands = cands[(cands >= lo) & (cands < hi)]
+        active = ~unsafe[cands - lo] if unsafe is not None else np.ones(len(cands), dtype=bool)
+        if final:
+            cands = np.append(cands, H)
+            active = np.append(active, True)
+        return cands, active
+
+    def _extend_dp(self, cands, active, final):
+
+        H = self.rows
+        T, W = self.target_height, self.max_window
+        base = self._cand.start
+        first = self._cand.end
+        self._cand.extend(cands)
+        self._dp.extend(np.full(len(cands), np.inf))
+        self._parent.extend(np.full(len(cands), -1))
+        cand, dp, parent = self._cand.data, self._dp.data, self._parent.data
+        costs, costs_start = self._row_costs.data, self._row_costs.start
+
+        lo_all = np.searchsorted(cand, cands - (T + W), side='left')
+        hi_all = np.searchsorted(cand, cands - (T - W), side='right')
+        hi_last = np.searchsorted(cand, H - LAST_PAGE_MIN_HEIGHT, side='right')
+        transitions = 0
+        for k, row in enumerate(cands.tolist()):
+            i = first + k - base
+            if first + k == 0:
+                dp[0] = 0
+                continue
+            if not active[k]:
+                continue
+            is_last_page = final and row == H
+            lo = lo_all[k]
+            hi = min(hi_last if is_last_page else hi_all[k], i)
+            if hi <= lo:
+                continue
+            transitions += hi - lo
+            best = _relax_candidate(cand, dp, i, lo, hi, is_last_page, costs[row - costs_start],
+                                    T, self.w_ink, self.w_height)
+            if best is not None:
+                dp[i], parent_local, _ = best
+                parent[i] = parent_local + base
+        count(self.stats, "candidates", len(cands))
+        count(self.stats, "dp_transitions", int(transitions))
+
+    def _commit_path(self, node):
+
+        base = self._cand.start
+        path = []
+        while node != self._committed:
+            path.append(node)
+            node = self._parent.data[node - base]
+        new_cuts = [int(self._cand.data[node - base]) for node in reversed(path)]
+        if path:
+            self._committed = path[0]
+        self.cuts.extend(new_cuts)
+        return new_cuts
+
+    def _live(self, frontier):
+
+        # Candidates a page starting at or after the frontier could follow.
+        base = self._cand.start
+        lo = np.searchsorted(self._cand.data, frontier - (self.target_height + self.max_window), side='left')
+        return base + lo + np.flatnonzero(self._dp.data[lo:] < np.inf)
+
+    def _coalesce(self, live):
+
+        # Lowest common ancestor of the live candidates; parents always come
+        # before their children, so repeatedly replace the latest one.
+        base = self._cand.start
+        members = set(live.tolist())
+        heap = [-node for node in members]
+        heapq.heapify(heap)
+        while len(members) > 1:
+            node = -heapq.heappop(heap)
+            members.discard(node)
+            node = int(self._parent.data[node - base])
+            if node not in members:
+                members.add(node)
+                heapq.heappush(heap, -node)
+        return members.pop()
+
+    def _force_commit(self, live):
+
+        # Live candidates sit at different rows, so compare their cost per row.
+        base = self._cand.start
+        best = int(live[np.argmin(self._dp.data[live - base] / self._cand.data[live - base])])
+        node = best
+        while self._parent.data[node - base] != self._committed:
+            node = int(self._parent.data[node - base])
+        new_cuts = self._commit_path(node)
+
+        # Only paths through the forced cut may be extended from now on.
+        parent, dp = self._parent.data, self._dp.data
+        keep = np.zeros(len(dp), dtype=bool)
+        keep[node - base] = True
+        for i in range(node - base + 1, len(dp)):
+            keep[i] = parent[i] >= node and keep[parent[i] - base]
+        dp[:node - base] = np.inf
+        dp[~keep & (np.arange(len(dp)) > node - base)] = np.inf
+        self.forced_commits += 1
+        count(self.stats, "forced_commits")
+        return new_cuts
+
+    def _fixed_height_tail(self, end, final):
+
+        # Like _fixed_height_cuts, restarted from the last committed cut.
+        new_cuts = []
+        while self.cuts[-1] + self.target_height < end:
+            new_cuts.append(self.cuts[-1] + self.target_height)
+            self.cuts.append(new_cuts[-1])
+        if final:
+            new_cuts.append(self.rows)
+            self.cuts.append(self.rows)
+        self.fallback_pages += len(new_cuts)
+        count(self.stats, "fallback_pages", len(new_cuts))
+        return new_cuts
+
+    def _restart(self, frontier):
+
+        # The last cut is below the frontier, so every candidate found from
+        # now on comes after it and the buffers stay sorted.
+        new_cuts = self._fixed_height_tail(frontier, final=False)
+        node = self._cand.end
+        for buffer in (self._cand, self._dp, self._parent):
+            buffer.trim(node)
+        self._cand.extend([self.cuts[-1]])
+        self._dp.extend([0.0])
+        self._parent.extend([-1])
+        self._committed = node
+        return new_cuts
+
+    def _advance(self, final):
+
+        self._extend_costs(final)
+        frontier = self.rows if final else self._frontier()
+        if frontier <= self._done and not final:
+            return []
+        cands, active = self._new_candidates(self._done, frontier, final)
+        self._done = frontier
+        self._extend_dp(cands, active, final)
+
+        if final:
+            if self._dp.data[-1] == np.inf:
+                return self._fixed_height_tail(self.rows, final)
+            return self._commit_path(self._cand.end - 1)
+
+        live = self._live(frontier)
+        if len(live) == 0:
+            new_cuts = self._restart(frontier)
+            self._trim()
+            return new_cuts
+        new_cuts = self._commit_path(self._coalesce(live))
+        reach = 2 * (self.target_height + self.max_window)
+        if self.pending_rows > self.max_lookahead_rows and frontier - self.cuts[-1] > reach:
+            while self.pending_rows > self.max_lookahead_rows and frontier - self.cuts[-1] > reach:
+                new_cuts += self._force_commit(live)
+                live = self._live(frontier)
+            new_cuts += self._commit_path(self._coalesce(live))
+        self._trim()
+        return new_cuts
+
+    def _trim(self):
+
+        done = self._done
+        self._profile.trim(min(done - self.unsafe_window_radius - 1, self.rows - 1))
+        self._padded_sums.trim(self._smoothed.end)
+        self._smoothed.trim((done // self.band_size) * self.band_size)
+        self._smoothed_sums.trim(self._row_costs.end - 2)
+        self._row_costs.trim(done)
+        keep = self._committed
+        self._cand.trim(keep)
+        self._dp.trim(keep)
+        self._parent.trim(keep)
+
+COARSE_STRIP_ROWS = 256
+
+def downscale_image(image, factor, strip_rows=COARSE_STRIP_ROWS):
+
+    # Rows are pooled by keeping the brightest of every `factor` rows, so a
+    # single blank row between text lines survives as a blank coarse row;
+    # columns are plain area averages. Coarse row k covers rows [k*factor, (k+1)*factor).
+    import cv2
+    H, W = image.shape[:2]
+    if factor <= 1 or H == 0:
+        return image
+    out_width = max(1, int(round(W / factor)))
+    step = factor * strip_rows
+    chunks = []
+    for start in range(0, H, step):
+        strip = image[start:start + step]
+        pooled = strip[0::factor].copy()
+        for k in range(1, factor):
+            rows = strip[k::factor]
+            np.maximum(pooled[:len(rows)], rows, out=pooled[:len(rows)])
+        chunks.append(cv2.resize(pooled, (out_width, pooled.shape[0]), interpolation=cv2.INTER_AREA))
+    return np.concatenate(chunks, axis=0)
+
+def _band_ink_profile(image, start, end, backend):
+
+    lo = max(0, start - THRESH_HALO)
+    hi = min(image.shape[0], end + THRESH_HALO)
+    profile = compute_ink_density(image[lo:hi], backend=backend)
+    return profile[start - lo:end - lo]
+
+def _band_cut_costs(image, lo, hi, smoothing_radius, backend, unsafe_mask_args):
+
+    # Full-resolution rows are only read for [lo, hi] plus enough margin that
+    # the smoothed +/-2 row cost and unsafe window match the whole-image values.
+    H = image.shape[0]
+    margin = max(smoothing_radius, 0) + 2
+    if unsafe_mask_args is not None:
+        margin = max(margin, unsafe_mask_args[0])
+    start = max(0, lo - margin)
+    end = min(H, hi + 1 + margin)
+
+    profile = _band_ink_profile(image, start, end, backend)
+    smoothed = _smooth_profile(profile, smoothing_radius)
+    local_rows = list(range(lo - start, hi + 1 - start))
+    costs = _candidate_ink_costs(smoothed, local_rows, smoothing_radius)
+    if unsafe_mask_args is None:
+        safe = [True] * len(local_rows)
+    else:
+        safe = (~compute_unsafe_mask(profile, *unsafe_mask_args)[local_rows]).tolist()
+    return list(range(lo, hi + 1)), costs, safe
+
+def _merge_bands(bands, first_row, last_row):
+
+    merged = []
+    for lo, hi in sorted(bands):
+        lo, hi = max(lo, first_row), min(hi, last_row)
+        if lo > hi:
+            continue
+        if merged and lo <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], hi)
+        else:
+            merged.append([lo, hi])
+    return merged
+
+def find_optimal_cuts_coarse_to_fine(image, target_height, factor=8, refine_radius=None,
+                                     density_backend=DensityBackend.GAUSSIAN,
+                                     window_frac=0.04,
+                                     min_gap_rows=12,
+                                     w_ink=1.0,
+                                     w_height=1.0,
+                                     smoothing_radius=10,
+                                     band_size=200,
+                                     cut_mode=CutMode.WHITESPACE,
+                                     snap_px=40,
+                                     unsafe_window_radius=2,
+                                     unsafe_ink_threshold=0.3,
+                                     return_debug_info=False,
+                                     stats=None,
+                                     **dp_options):
+
+    H = image.shape[0]
+    max_window = int(target_height * window_frac)
+    if refine_radius is None:
+        refine_radius = max(4 * factor, max_window // 2)
+
+    with timed(stats, "downscale"):
+        coarse = downscale_image(image, factor)
+    coarse_height = coarse.shape[0]
+    scale = max(factor, 1)
+
+    def coarse_rows(rows):
+        return max(1, int(round(rows / scale)))
+
+    coarse_profile = compute_ink_density(coarse, backend=density_backend, stats=stats)
+    coarse_cuts, coarse_debug = find_optimal_cuts_dp(
+        coarse_profile, coarse_rows(target_height),
+        window_frac=window_frac,
+        min_gap_rows=coarse_rows(min_gap_rows),
+        w_ink=w_ink,
+        w_height=w_height,
+        smoothing_radius=int(round(smoothing_radius / scale)),
+        band_size=coarse_rows(band_size),
+        cut_mode=cut_mode,
+        snap_px=coarse_rows(snap_px),
+        unsafe_window_radius=int(round(unsafe_window_radius / scale)),
+        unsafe_ink_threshold=unsafe_ink_threshold,
+        return_debug_info=True,
+        stats=stats,
+        **dp_options)
+    estimates = [min(int(c) * scale, H) for c in coarse_cuts]
+
+    # The coarse path only fixes which band each cut lies in; the cut itself is
+    # chosen by the same DP objective over every full-resolution row of the bands.
+    unsafe_mask_args = None
+    if cut_mode == CutMode.FIXED_HEIGHT_SNAP:
+        unsafe_mask_args = (unsafe_window_radius, unsafe_ink_threshold)
+    bands = [(estimate - refine_radius, estimate + refine_radius) for estimate in estimates[1:-1]]
+    if cut_mode == CutMode.FIXED_HEIGHT_SNAP:
+        bands += [(row - snap_px, row + snap_px) for row in range(target_height, H, target_height)]
+
+    with timed(stats, "refine"):
+        band_costs = {0: (0.0, True), H: (0.0, True)}
+        for lo, hi in _merge_bands(bands, 1, H - 1):
+            for row, cost, safe in zip(*_band_cut_costs(image, lo, hi, smoothing_radius,
+                                                        density_backend, unsafe_mask_args)):
+                band_costs[row] = (cost, safe)
+
+        candidate_list = sorted(band_costs)
+        dp, parent, _ = _solve_dp_windowed(candidate_list, H,
+                                           [band_costs[row][0] for row in candidate_list],
+                                           [band_costs[row][1] for row in candidate_list],
+                                           target_height, max_window, w_ink, w_height, False, stats)
+    count(stats, "refine_rows", len(candidate_list) - 2)
+
+    refined = dp[-1] != np.inf
+    if refined:
+        path = []
+        curr = len(candidate_list) - 1
+        while curr != -1:
+            path.append(candidate_list[curr])
+            curr = parent[curr]
+        cuts = list(reversed(path))
+    else:
+        cuts = find_optimal_cuts_dp(compute_ink_density(image, backend=density_backend, stats=stats), target_height,
+                                    window_frac=window_frac,
+                                    min_gap_rows=min_gap_rows,
+                                    w_ink=w_ink,
+                                    w_height=w_height,
+                                    smoothing_radius=smoothing_radius,
+                                    band_size=band_size,
+                                    cut_mode=cut_mode,
+                                    snap_px=snap_px,
+                                    unsafe_window_radius=unsafe_window_radius,
+                                    unsafe_ink_threshold=unsafe_ink_threshold,
+                                    stats=stats,
+                                    **dp_options)
+
+    if not return_debug_info:
+        return cuts
+
+    # In snap mode a cut can come from a snap band with no coarse cut within
+    # refine_radius (the coarse path may even have none); those are listed
+    # apart instead of as moves.
+    moves = []
+    unmatched = []
+    if refined:
+        estimate_rows = np.asarray(estimates[1:-1])
+        for cut in cuts[1:-1]:
+            if len(estimate_rows):
+                nearest = estimate_rows[np.argmin(np.abs(estimate_rows - cut))]
+                if abs(cut - nearest) <= refine_radius:
+                    moves.append(int(cut - nearest))
+                    continue
+            unmatched.append(int(cut))
+    return cuts, {
+        "factor": factor,
+        "coarse_height": coarse_height,
+        "coarse_cuts": [int(c) for c in coarse_cuts],
+        "estimated_cuts": estimates,
+        "cut_moves": moves,
+        "unmatched_cuts": unmatched,
+        "max_cut_move": max((abs(m) for m in moves), default=0),
+        "mean_cut_move": float(np.mean(np.abs(moves))) if moves else 0.0,
+        "refined": refined,
+        "coarse_debug": coarse_debug,
+    }
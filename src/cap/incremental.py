@@ -0,0 +1,198 @@
+import hashlib
+import json
+import os
+import tempfile
+import numpy as np
+from .core import Paginator, DPSolution, CutMode, DensityBackend, THRESH_HALO, compute_ink_density
+from .io import save_pdf_streaming, save_page_images, iter_page_crops, PageImageWriter, PdfLayout, RenderMode
+from .profiling import timed, count
+
+
+STATE_FORMAT_VERSION = 3
+DIGEST_STRIP_ROWS = 1024
+
+def state_path(output):
+
+    return output.rstrip("/\\") + ".capstate.npz"
+
+def strip_digests(img_array, strip_rows=DIGEST_STRIP_ROWS):
+
+    digests = np.zeros((-(-img_array.shape[0] // strip_rows), 16), dtype=np.uint8)
+    for i, start in enumerate(range(0, img_array.shape[0], strip_rows)):
+        strip = np.ascontiguousarray(img_array[start:start + strip_rows])
+        digests[i] = np.frombuffer(hashlib.blake2b(memoryview(strip).cast('B'), digest_size=16).digest(), np.uint8)
+    return digests
+
+def _first_changed_row(old_digests, digests, old_height, height):
+
+    # Rows before the returned one are identical in both images.
+    n = min(len(old_digests), len(digests))
+    differs = np.flatnonzero((old_digests[:n] != digests[:n]).any(axis=1))
+    changed = int(differs[0]) * DIGEST_STRIP_ROWS if len(differs) else n * DIGEST_STRIP_ROWS
+    return min(changed, old_height, height)
+
+def load_state(path):
+
+    try:
+        with np.load(path, allow_pickle=False) as data:
+            state = {name: data[name] for name in data.files}
+    except (OSError, ValueError, KeyError):
+        return None
+    try:
+        state["meta"] = json.loads(str(state["meta"]))
+    except (KeyError, ValueError):
+        return None
+    if state["meta"].get("version") != STATE_FORMAT_VERSION:
+        return None
+    return state
+
+def save_state(path, meta, **arrays):
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, meta=np.array(json.dumps(dict(meta, version=STATE_FORMAT_VERSION), sort_keys=True)), **arrays)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def _reusable_profile(state, meta, img_array, changed_row, density_backend, strip_rows, jobs, stats):
+
+    # The density of a row depends on the THRESH_HALO rows either side of it
+    # (the bottom ones are reflected at the old image's end), so only rows
+    # from changed_row - THRESH_HALO onwards are analysed again.
+    backend = DensityBackend(density_backend)
+    keep = 0
+    if state is not None and state["meta"]["density"] == meta["density"]:
+        keep = max(0, changed_row - THRESH_HALO)
+    if keep == 0:
+        return compute_ink_density(img_array, strip_rows=strip_rows or None, backend=backend, stats=stats,
+                                   workers=jobs), 0
+
+    start = max(0, keep - THRESH_HALO)
+    tail = compute_ink_density(img_array[start:], strip_rows=strip_rows or None, backend=backend, stats=stats,
+                               workers=jobs)
+    count(stats, "density_rows_reused", keep)
+    return np.concatenate((state["profile"][:keep], tail[keep - start:])), keep
+
+def _reusable_pages(state, meta, cuts, changed_row, output, output_format):
+
+    # Page j is kept when every cut up to its end is unchanged and its rows
+    # were not touched.
+    if state is None or state["meta"]["output"] != meta["output"]:
+        return 0
+    old_cuts = state["cuts"]
+    n_pages = 0
+    for j in range(min(len(old_cuts), len(cuts)) - 1):
+        if old_cuts[j + 1] != cuts[j + 1] or cuts[j + 1] > changed_row:
+            break
+        n_pages = j + 1
+    if output_format == "pdf":
+        if not os.path.isfile(output) or os.path.getsize(output) != int(state["pdf_size"]):
+            return 0
+        return n_pages
+
+    writer = PageImageWriter(output, image_format=meta["output"]["image_format"])
+    for j in range(n_pages):
+        if not os.path.isfile(writer.page_path(j)):
+            return j
+    return n_pages
+
+def paginate_incremental(img_array, output, target_height_px, output_format="pdf", dpi=300,
+                         window_frac=0.04, min_gap=12, cut_mode="whitespace", render_mode="variable_size",
+                         snap_px=40, unsafe_window=2, unsafe_threshold=0.3, strip_rows=0,
+                         density_backend="gaussian", image_format="png", compress_level=6, quality=90, jobs=1,
+                         dp_workers=1, stats=None, log=None):
+
+    # Re-paginates an image that was paginated to `output` before, reusing the
+    # density rows, DP values and pages that lie above the first changed row.
+    # The output is the same as a full run's, byte for byte.
+    height, width = img_array.shape[0], img_array.shape[1]
+    cut_mode_enum = CutMode(cut_mode)
+    render_mode_enum = RenderMode(render_mode)
+    meta = {
+        "density": {"width": int(width), "backend": density_backend,
+                    "channels": int(img_array.shape[2]) if img_array.ndim == 3 else 1},
+        "dp": {"target_height": target_height_px, "window_frac": window_frac, "min_gap": min_gap,
+               "cut_mode": cut_mode, "snap_px": snap_px, "unsafe_window": unsafe_window,
+               "unsafe_threshold": unsafe_threshold},
+        "output": {"format": output_format, "dpi": dpi, "render_mode": render_mode,
+                   "image_format": image_format, "compress_level": compress_level, "quality": quality},
+    }
+
+    path = state_path(output)
+    state = load_state(path) if os.path.exists(path) else None
+    with timed(stats, "incremental"):
+        digests = strip_digests(img_array)
+    changed_row = 0
+    if state is not None:
+        changed_row = _first_changed_row(state["digests"], digests, len(state["profile"]), height)
+        if log is not None:
+            log(f"Previous run found; first changed row {changed_row} of {height}.")
+
+    ink_profile, profile_rows = _reusable_profile(state, meta, img_array, changed_row, density_backend,
+                                                  strip_rows, jobs, stats)
+
+    paginator = Paginator(ink_profile, min_gap_rows=min_gap)
+    resume = None
+    if profile_rows and state["meta"]["dp"] == meta["dp"]:
+        paginator._analyze()
+        if paginator.gap_thresh == float(state["gap_thresh"]):
+            resume = DPSolution(state["candidates"], state["dp"], state["parent"], {}, [], None, state["pruned"])
+    solution = paginator.solve(target_height_px, window_frac=window_frac, cut_mode=cut_mode_enum,
+                               snap_px=snap_px, unsafe_window_radius=unsafe_window,
+                               unsafe_ink_threshold=unsafe_threshold,
+                               resume=resume, resume_rows=profile_rows, workers=dp_workers, stats=stats)
+    cuts = [int(c) for c in paginator.backtrack(solution, target_height_px, cut_mode=cut_mode_enum)]
+
+    n_reused = _reusable_pages(state, meta, cuts, changed_row, output, output_format)
+    count(stats, "pages_reused", n_reused)
+    if log is not None:
+        log(f"Found {len(cuts) - 1} pages; keeping {n_reused}, writing {len(cuts) - 1 - n_reused}.")
+
+    pages = iter_page_crops(img_array, cuts[n_reused:])
+    arrays = {}
+    if output_format == "pdf":
+        old_layout = None
+        if n_reused:
+            old_layout = PdfLayout(state["pdf_offsets"], state["pdf_page_ends"])
+        layouts = []
+        save_pdf_streaming(pages, output, dpi=dpi, render_mode=render_mode_enum,
+                           target_height_px=target_height_px, jobs=jobs,
+                           resume=(old_layout, n_reused) if n_reused else None,
+                           on_layout=layouts.append, stats=stats)
+        arrays = dict(pdf_offsets=np.asarray(layouts[0].offsets, dtype=np.int64),
+                      pdf_page_ends=np.asarray(layouts[0].page_ends, dtype=np.int64),
+                      pdf_size=np.int64(os.path.getsize(output)))
+    else:
+        save_page_images(pages, output, render_mode=render_mode_enum, target_height_px=target_height_px,
+                         image_format=image_format, compress_level=compress_level, quality=quality,
+                         jobs=jobs, first_index=n_reused, stats=stats)
+        if state is not None and state["meta"]["output"]["format"] == "images":
+            # Drop the previous run's files that this one did not overwrite.
+            old_format = state["meta"]["output"]["image_format"]
+            writer = PageImageWriter(output, image_format=old_format)
+            first_stale = len(cuts) - 1 if old_format == image_format else 0
+            for j in range(first_stale, len(state["cuts"]) - 1):
+                if os.path.isfile(writer.page_path(j)):
+                    os.remove(writer.page_path(j))
+
+    with timed(stats, "incremental"):
+        save_state(path, meta, digests=digests, profile=np.asarray(ink_profile, dtype=np.float64),
+                   gap_thresh=np.float64(paginator.gap_thresh),
+                   candidates=np.asarray(solution.candidates, dtype=np.int64),
+                   dp=np.asarray(solution.dp, dtype=np.float64), parent=np.asarray(solution.parent, dtype=np.int64),
+                   pruned=np.asarray(solution.pruned, dtype=bool),
+                   cuts=np.asarray(cuts, dtype=np.int64), **arrays)
+
+    return {
+        "output": output,
+        "pages": len(cuts) - 1,
+        "width": width,
+        "height": height,
+        "cuts": cuts,
+        "pages_reused": n_reused,
+    }
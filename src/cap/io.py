@@ -1,29 +1,198 @@
-from PIL import Image
-from reportlab.pdfgen import canvas
 import os
-import cv2
+import queue
+import struct
+import threading
+import zlib
 import numpy as np
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
+from .profiling import timed, count
 
 class RenderMode(Enum):
 
     VARIABLE_SIZE = "variable_size"
     FIXED_SIZE_WITH_PADDING = "fixed_size_with_padding"
 
-def load_image(path):
+def _check_image_array(array, path):
 
-    pil_img = Image.open(path)
+    if array.dtype != np.uint8 or not (array.ndim == 2 or (array.ndim == 3 and array.shape[2] == 3)):
+        raise ValueError(f"{path}: expected a uint8 HxW or HxWx3 array, got {array.dtype} {array.shape}")
+    return array
+
+def _read_pnm_header(f):
+
+    # Binary PGM (P5) / PPM (P6) header: magic, width, height, maxval separated
+    # by whitespace or '#' comments, then a single whitespace byte before data.
+    magic = f.read(2)
+    if magic not in (b"P5", b"P6"):
+        return None
+    fields = []
+    token = b""
+    while len(fields) < 3:
+        ch = f.read(1)
+        if not ch:
+            return None
+        if ch == b"#" and not token:
+            f.readline()
+        elif ch.isspace():
+            if token:
+                fields.append(int(token))
+                token = b""
+        else:
+            token += ch
+    width, height, maxval = fields
+    # Other maxvals are scaled to 0..255 by the decoder, not stored that way.
+    if maxval != 255:
+        return None
+    channels = 3 if magic == b"P6" else 1
+    return width, height, channels, f.tell()
+
+def _memmap_pnm(path):
+
+    with open(path, 'rb') as f:
+        header = _read_pnm_header(f)
+    if header is None:
+        return None
+    width, height, channels, offset = header
+    shape = (height, width, 3) if channels == 3 else (height, width)
+    return np.memmap(path, dtype=np.uint8, mode='r', offset=offset, shape=shape)
+
+TIFF_TAG_TYPES = {3: ('H', 2), 4: ('I', 4)}
+
+def _read_tiff_tags(f):
+
+    order = f.read(2)
+    if order not in (b"II", b"MM"):
+        return None
+    endian = '<' if order == b"II" else '>'
+    magic, ifd_offset = struct.unpack(endian + 'HI', f.read(6))
+    if magic != 42:
+        return None
+
+    f.seek(ifd_offset)
+    (n_entries,) = struct.unpack(endian + 'H', f.read(2))
+    entries = [struct.unpack(endian + 'HHI4s', f.read(12)) for _ in range(n_entries)]
+
+    tags = {}
+    for tag, type_id, count, value in entries:
+        if type_id not in TIFF_TAG_TYPES:
+            continue
+        fmt, size = TIFF_TAG_TYPES[type_id]
+        if count * size <= 4:
+            raw = value[:count * size]
+        else:
+            pos = f.tell()
+            f.seek(struct.unpack(endian + 'I', value)[0])
+            raw = f.read(count * size)
+            f.seek(pos)
+        tags[tag] = struct.unpack(endian + fmt * count, raw)
+    return tags
+
+def _memmap_tiff(path):
+
+    with open(path, 'rb') as f:
+        tags = _read_tiff_tags(f)
+    if tags is None:
+        return None
+
+    def tag(number, default=None):
+        return tags.get(number, (default,))
+
+    width, height = tag(256)[0], tag(257)[0]
+    channels = tag(277, 1)[0]
+    # Only uncompressed, chunky, 8-bit gray/RGB images without tiles map
+    # directly; everything else goes through the decoder.
+    if (width is None or height is None or tag(259, 1)[0] != 1 or tag(284, 1)[0] != 1
+            or 322 in tags or channels not in (1, 3) or tag(262)[0] != (2 if channels == 3 else 1)
+            or any(bits != 8 for bits in tag(258, 8)) or any(fmt != 1 for fmt in tag(339, 1))):
+        return None
+
+    offsets, counts = tag(273), tag(279)
+    if offsets[0] is None or counts[0] is None or len(offsets) != len(counts):
+        return None
+    row_bytes = width * channels
+    expected = offsets[0]
+    for offset, count in zip(offsets, counts):
+        if offset != expected:
+            return None
+        expected += count
+    if expected - offsets[0] < row_bytes * height:
+        return None
+
+    shape = (height, width, 3) if channels == 3 else (height, width)
+    return np.memmap(path, dtype=np.uint8, mode='r', offset=offsets[0], shape=shape)
+
+def memmap_image(path):
+
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".npy":
+        return _check_image_array(np.load(path, mmap_mode='r'), path)
+    if ext in (".pgm", ".ppm", ".pnm"):
+        return _memmap_pnm(path)
+    if ext in (".tif", ".tiff"):
+        return _memmap_tiff(path)
+    return None
+
+def load_image(path, mmap=False):
+
+    if mmap:
+        image = memmap_image(path)
+        if image is not None:
+            return image
+
+    if os.path.splitext(path)[1].lower() == ".npy":
+        return _check_image_array(np.load(path), path)
+
+    from PIL import Image
+    return _pil_to_array(Image.open(path))
+
+def decode_image(data):
+
+    # Same decoding as load_image, for encoded image bytes already in memory.
+    import io
+    from PIL import Image
+    return _pil_to_array(Image.open(io.BytesIO(data)))
+
+def _pil_to_array(pil_img):
 
     if pil_img.mode not in ('RGB', 'L'):
         pil_img = pil_img.convert('RGB')
     return np.array(pil_img)
 
+def iter_raw_strips(f, width, channels=3, strip_rows=256):
+
+    # Raw 8-bit rows (no header) read from a binary stream such as a pipe,
+    # yielded as soon as each strip of rows is complete.
+    if channels not in (1, 3):
+        raise ValueError(f"Unsupported channel count {channels}; expected 1 or 3")
+    row_bytes = width * channels
+    shape = (width,) if channels == 1 else (width, channels)
+    while True:
+        data = f.read(row_bytes * strip_rows)
+        n_rows = len(data) // row_bytes
+        if n_rows:
+            yield np.frombuffer(data, dtype=np.uint8, count=n_rows * row_bytes).reshape((n_rows,) + shape)
+        if len(data) < row_bytes * strip_rows:
+            if len(data) % row_bytes:
+                raise ValueError(f"Input ended partway through a row ({len(data) % row_bytes} of {row_bytes} bytes)")
+            return
+
 def save_pdf_from_crops(crop_images, output_path, dpi=300, render_mode=RenderMode.VARIABLE_SIZE,
-                        target_height_px=None, padding_color=(255, 255, 255)):
+                        target_height_px=None, padding_color=(255, 255, 255), stats=None):
 
     if not crop_images:
         return
 
+    with timed(stats, "write"):
+        _save_pdf_from_crops(crop_images, output_path, dpi, render_mode, target_height_px, padding_color)
+    count(stats, "pages_written", len(crop_images))
+    count(stats, "bytes_written", os.path.getsize(output_path))
+
+def _save_pdf_from_crops(crop_images, output_path, dpi, render_mode, target_height_px, padding_color):
+
+    from PIL import Image
+    from reportlab.pdfgen import canvas
     c = canvas.Canvas(output_path)
 
     for img in crop_images:
@@ -42,19 +211,30 @@ def save_pdf_from_crops(crop_images, output_path, dpi=300, render_mode=RenderMod
         c.setPageSize((width_pt, height_pt))
 
 
-        temp_name = f"temp_page_{os.getpid()}_{id(img)}.png"
-        img.save(temp_name)
-
-        c.drawImage(temp_name, 0, 0, width=width_pt, height=height_pt)
+        _draw_page_image(c, img, width_pt, height_pt)
         c.showPage()
 
-        try:
-            os.remove(temp_name)
-        except OSError:
-            pass
-
     c.save()
 
+_USE_A85_LOCK = threading.Lock()
+
+def _draw_page_image(c, img, width_pt, height_pt):
+
+    # reportlab ASCII85-wraps image streams by default, which is pure Python
+    # without rl_accel and inflates the data by 25%; page images are embedded
+    # as binary Flate streams instead. The setting is a process-wide global
+    # (read when drawImage encodes the image), so threads take turns with it.
+    from reportlab import rl_config
+    from reportlab.lib.utils import ImageReader
+    reader = ImageReader(img)
+    with _USE_A85_LOCK:
+        use_a85 = rl_config.useA85
+        rl_config.useA85 = 0
+        try:
+            c.drawImage(reader, 0, 0, width=width_pt, height=height_pt)
+        finally:
+            rl_config.useA85 = use_a85
+
 def _pad_to_target_height(img, target_height_px, padding_color=(255, 255, 255)):
 
     width, height = img.size
@@ -64,9 +244,357 @@ def _pad_to_target_height(img, target_height_px, padding_color=(255, 255, 255)):
         return img
 
 
+    from PIL import Image
     padded = Image.new(img.mode, (width, target_height_px), padding_color)
 
 
     padded.paste(img, (0, 0))
 
     return padded
+
+def iter_page_crops(image, cuts):
+
+    for i in range(len(cuts) - 1):
+        yield image[cuts[i]:cuts[i+1]]
+
+def _ordered_map(fn, items, jobs):
+
+    if jobs <= 1:
+        for item in items:
+            yield fn(item)
+        return
+
+    # At most 2 * jobs pages are in flight, so memory stays bounded while
+    # results are still handed back in input order.
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        pending = deque()
+        for item in items:
+            pending.append(executor.submit(fn, item))
+            if len(pending) >= 2 * jobs:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def _as_page_array(page):
+
+    if not isinstance(page, np.ndarray):
+        if page.mode not in ('RGB', 'L'):
+            page = page.convert('RGB')
+    return np.asarray(page)
+
+def _pdf_number(value):
+
+    text = f"{value:.4f}".rstrip('0').rstrip('.')
+    return text if text not in ("", "-0") else "0"
+
+EncodedPage = namedtuple("EncodedPage", ["width_px", "height_px", "color_space", "data"])
+PdfLayout = namedtuple("PdfLayout", ["offsets", "page_ends"])
+
+class StreamingPdfWriter:
+
+    CHUNK_ROWS = 256
+
+    def __init__(self, output_path, dpi=300, compress_level=6):
+
+        # output_path may also be a binary file object; it is written to but
+        # left open, and only needs write() since offsets are counted here.
+        self.output_path = output_path
+        self._owns_file = not hasattr(output_path, "write")
+        self.dpi = dpi
+        self.compress_level = compress_level
+        self._file = None
+        self._offsets = {}
+        self._page_ids = []
+        self._next_id = 3
+        self.bytes_written = 0
+        self.page_ends = []
+        self.pages_reused = 0
+        self.bytes_reused = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        elif self._file is not None and self._owns_file:
+            self._file.close()
+
+    @property
+    def page_count(self):
+        return len(self._page_ids)
+
+    @property
+    def layout(self):
+
+        # Offsets of the page objects (ids 3 onwards, four per page) and the
+        # file size after each page: enough to resume() this file later.
+        return PdfLayout([self._offsets[obj_id] for obj_id in range(3, 3 + 4 * self.page_count)],
+                         list(self.page_ends))
+
+    def resume(self, layout, n_pages):
+
+        # Keeps the first n_pages pages of the file this writer's path already
+        # holds, as written by a writer whose layout was `layout`, and
+        # continues after them. The file must not have been modified since.
+        if not self._owns_file:
+            raise ValueError("Only a PDF written to a path can be resumed")
+        if n_pages <= 0:
+            return
+        end = layout.page_ends[n_pages - 1]
+        self._file = open(self.output_path, 'r+b')
+        self._file.truncate(end)
+        self._file.seek(end)
+        self._offsets = {obj_id: int(layout.offsets[obj_id - 3]) for obj_id in range(3, 3 + 4 * n_pages)}
+        self._page_ids = [6 + 4 * page for page in range(n_pages)]
+        self._next_id = 3 + 4 * n_pages
+        self.page_ends = [int(e) for e in layout.page_ends[:n_pages]]
+        self.bytes_written = self.bytes_reused = end
+        self.pages_reused = n_pages
+
+    def _write(self, data):
+        self._file.write(data)
+        self.bytes_written += len(data)
+
+    def _alloc_id(self):
+        obj_id = self._next_id
+        self._next_id += 1
+        return obj_id
+
+    def _begin_obj(self, obj_id):
+        self._offsets[obj_id] = self.bytes_written
+        self._write(f"{obj_id} 0 obj\n".encode('ascii'))
+
+    def _write_obj(self, obj_id, body):
+        self._begin_obj(obj_id)
+        self._write(body.encode('ascii') + b"\nendobj\n")
+
+    def _page_stream(self, page, target_height_px, padding_color):
+
+        page = _as_page_array(page)
+        if isinstance(padding_color, int):
+            padding_color = (padding_color,) * 3
+        if page.ndim == 2:
+            color_space = "/DeviceGray"
+            pad_pixel = bytes(padding_color[:1])
+        elif page.ndim == 3 and page.shape[2] == 3:
+            color_space = "/DeviceRGB"
+            pad_pixel = bytes(padding_color)
+        else:
+            raise ValueError(f"Unsupported page shape {page.shape}; expected HxW or HxWx3")
+
+        height_px, width_px = page.shape[0], page.shape[1]
+        pad_rows = 0
+        if target_height_px is not None and height_px < target_height_px:
+            pad_rows = target_height_px - height_px
+
+        def chunks():
+            compressor = zlib.compressobj(self.compress_level)
+            for start in range(0, height_px, self.CHUNK_ROWS):
+                rows = np.ascontiguousarray(page[start:start + self.CHUNK_ROWS], dtype=np.uint8)
+                yield compressor.compress(memoryview(rows.reshape(-1)))
+            if pad_rows:
+                pad_chunk = pad_pixel * (width_px * min(pad_rows, self.CHUNK_ROWS))
+                for start in range(0, pad_rows, self.CHUNK_ROWS):
+                    n_rows = min(self.CHUNK_ROWS, pad_rows - start)
+                    yield compressor.compress(pad_chunk[:len(pad_pixel) * width_px * n_rows])
+            yield compressor.flush()
+
+        return width_px, height_px + pad_rows, color_space, chunks()
+
+    def _write_page(self, width_px, height_px, color_space, chunks):
+
+        if self._file is None:
+            self._file = open(self.output_path, 'wb') if self._owns_file else self.output_path
+            self._write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+        image_id, length_id, content_id, page_id = (self._alloc_id() for _ in range(4))
+
+        self._begin_obj(image_id)
+        self._write((f"<< /Type /XObject /Subtype /Image /Width {width_px} /Height {height_px} "
+                     f"/ColorSpace {color_space} /BitsPerComponent 8 /Filter /FlateDecode "
+                     f"/Length {length_id} 0 R >>\nstream\n").encode('ascii'))
+        length = 0
+        for data in chunks:
+            self._write(data)
+            length += len(data)
+        self._write(b"\nendstream\nendobj\n")
+        self._write_obj(length_id, str(length))
+
+        width_pt = _pdf_number(width_px * 72 / self.dpi)
+        height_pt = _pdf_number(height_px * 72 / self.dpi)
+        content = f"q {width_pt} 0 0 {height_pt} 0 0 cm /Im0 Do Q"
+        self._write_obj(content_id, f"<< /Length {len(content)} >>\nstream\n{content}\nendstream")
+        self._write_obj(page_id, (f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {width_pt} {height_pt}] "
+                                  f"/Resources << /XObject << /Im0 {image_id} 0 R >> >> "
+                                  f"/Contents {content_id} 0 R >>"))
+        self._page_ids.append(page_id)
+        self.page_ends.append(self.bytes_written)
+
+    def add_page(self, page, target_height_px=None, padding_color=(255, 255, 255)):
+
+        self._write_page(*self._page_stream(page, target_height_px, padding_color))
+
+    def encode_page(self, page, target_height_px=None, padding_color=(255, 255, 255)):
+
+        width_px, height_px, color_space, chunks = self._page_stream(page, target_height_px, padding_color)
+        return EncodedPage(width_px, height_px, color_space, b"".join(chunks))
+
+    def add_encoded_page(self, encoded):
+
+        self._write_page(encoded.width_px, encoded.height_px, encoded.color_space, [encoded.data])
+
+    def close(self):
+
+        if self._file is None:
+            return
+
+        kids = " ".join(f"{page_id} 0 R" for page_id in self._page_ids)
+        self._write_obj(2, f"<< /Type /Pages /Kids [{kids}] /Count {len(self._page_ids)} >>")
+        self._write_obj(1, "<< /Type /Catalog /Pages 2 0 R >>")
+
+        xref_offset = self.bytes_written
+        size = self._next_id
+        self._write(f"xref\n0 {size}\n0000000000 65535 f \n".encode('ascii'))
+        for obj_id in range(1, size):
+            self._write(f"{self._offsets[obj_id]:010d} 00000 n \n".encode('ascii'))
+        self._write((f"trailer\n<< /Size {size} /Root 1 0 R >>\n"
+                     f"startxref\n{xref_offset}\n%%EOF\n").encode('ascii'))
+        if self._owns_file:
+            self._file.close()
+        self._file = None
+
+def save_pdf_streaming(pages, output_path, dpi=300, render_mode=RenderMode.VARIABLE_SIZE,
+                       target_height_px=None, padding_color=(255, 255, 255), jobs=1, resume=None,
+                       on_layout=None, stats=None):
+
+    # resume=(layout, n_pages) keeps the first n_pages pages already in
+    # output_path (see StreamingPdfWriter.resume); `pages` are the ones after.
+
+    pad_height = None
+    if render_mode == RenderMode.FIXED_SIZE_WITH_PADDING:
+        pad_height = target_height_px
+
+    with timed(stats, "write"), StreamingPdfWriter(output_path, dpi=dpi) as writer:
+        if resume is not None:
+            writer.resume(*resume)
+        if jobs <= 1:
+            for page in pages:
+                writer.add_page(page, target_height_px=pad_height, padding_color=padding_color)
+        else:
+            encode = lambda page: writer.encode_page(page, target_height_px=pad_height, padding_color=padding_color)
+            for encoded in _ordered_map(encode, pages, jobs):
+                writer.add_encoded_page(encoded)
+    count(stats, "pages_written", writer.page_count - writer.pages_reused)
+    count(stats, "bytes_written", writer.bytes_written - writer.bytes_reused)
+    if on_layout is not None:
+        on_layout(writer.layout)
+    return writer.page_count
+
+IMAGE_FORMATS = {
+    "png": ("PNG", "png"),
+    "jpeg": ("JPEG", "jpg"),
+    "webp": ("WEBP", "webp"),
+}
+
+class _PaddingBuffer:
+
+    def __init__(self):
+        self.array = None
+        self.dirty_rows = 0
+
+    def pad(self, page, target_height_px, padding_color):
+
+        # The buffer is reused for every short page; only the rows the
+        # previous page dirtied need resetting to the padding colour.
+        fill = padding_color if page.ndim == 3 else padding_color[0]
+        height = page.shape[0]
+        if self.array is None or self.array.shape[1:] != page.shape[1:]:
+            self.array = np.empty((target_height_px,) + page.shape[1:], dtype=np.uint8)
+            self.array[:] = fill
+            self.dirty_rows = 0
+        if self.dirty_rows > height:
+            self.array[height:self.dirty_rows] = fill
+        self.array[:height] = page
+        self.dirty_rows = height
+        return self.array
+
+class PageImageWriter:
+
+    def __init__(self, output_dir, image_format="png", compress_level=6, quality=90,
+                 target_height_px=None, padding_color=(255, 255, 255), jobs=1, first_index=0):
+
+        if image_format not in IMAGE_FORMATS:
+            raise ValueError(f"Unsupported image format '{image_format}'; expected one of {sorted(IMAGE_FORMATS)}")
+        self.output_dir = output_dir
+        self.image_format = image_format
+        self.compress_level = compress_level
+        self.quality = quality
+        self.target_height_px = target_height_px
+        self.padding_color = padding_color
+        self.jobs = jobs
+        self.first_index = first_index
+        self.page_count = first_index
+        # One padding buffer per page that can be in flight at once.
+        self._buffers = queue.LifoQueue()
+        for _ in range(2 * jobs if jobs > 1 else 1):
+            self._buffers.put(_PaddingBuffer())
+
+    def _save_options(self):
+
+        if self.image_format == "png":
+            return {"compress_level": self.compress_level}
+        return {"quality": self.quality}
+
+    def page_path(self, index):
+
+        return os.path.join(self.output_dir, f"page_{index + 1:03d}.{IMAGE_FORMATS[self.image_format][1]}")
+
+    def _save(self, page, path):
+
+        from PIL import Image
+        page = _as_page_array(page)
+        buffer = self._buffers.get()
+        try:
+            if self.target_height_px is not None and page.shape[0] < self.target_height_px:
+                page = buffer.pad(page, self.target_height_px, self.padding_color)
+            Image.fromarray(page).save(path, IMAGE_FORMATS[self.image_format][0], **self._save_options())
+        finally:
+            self._buffers.put(buffer)
+        return path
+
+    def add_page(self, page):
+
+        path = self.page_path(self.page_count)
+        self.page_count += 1
+        return self._save(page, path)
+
+    def add_pages(self, pages):
+
+        def numbered():
+            for page in pages:
+                path = self.page_path(self.page_count)
+                self.page_count += 1
+                yield page, path
+
+        return list(_ordered_map(lambda item: self._save(*item), numbered(), self.jobs))
+
+def save_page_images(pages, output_dir, render_mode=RenderMode.VARIABLE_SIZE, target_height_px=None,
+                     padding_color=(255, 255, 255), image_format="png", compress_level=6, quality=90, jobs=1,
+                     first_index=0, stats=None):
+
+    # Pages are numbered from first_index, so a run can keep the files of
+    # earlier pages from a previous one.
+    pad_height = None
+    if render_mode == RenderMode.FIXED_SIZE_WITH_PADDING:
+        pad_height = target_height_px
+
+    os.makedirs(output_dir, exist_ok=True)
+    writer = PageImageWriter(output_dir, image_format=image_format, compress_level=compress_level,
+                             quality=quality, target_height_px=pad_height, padding_color=padding_color,
+                             jobs=jobs, first_index=first_index)
+    with timed(stats, "write"):
+        paths = writer.add_pages(pages)
+    count(stats, "pages_written", writer.page_count - first_index)
+    count(stats, "bytes_written", sum(os.path.getsize(path) for path in paths))
+    return writer.page_count
@@ -0,0 +1,383 @@
+import glob
+import os
+import time
+from collections import deque
+from .profiling import PipelineStats, timed, count
+
+
+MMAP_STRIP_ROWS = 4096
+
+PAPER_SIZES = {
+    "A4": (210, 297),
+    "A3": (297, 420),
+    "B5": (176, 250),
+}
+
+def target_height_for_format(format, dpi):
+
+    if format in PAPER_SIZES:
+        _, h_mm = PAPER_SIZES[format]
+    else:
+        _, h_mm = PAPER_SIZES["A4"]
+    return int(h_mm / 25.4 * dpi)
+
+def default_output_path(input_path, output_format):
+
+    base, _ = os.path.splitext(input_path)
+    if output_format == "pdf":
+        return f"{base}_paginated.pdf"
+    return f"{base}_pages"
+
+def _log(log, msg):
+
+    if log is not None:
+        log(msg)
+
+def paginate_file(input_path, output=None, output_format="pdf", format="A4", dpi=300,
+                  window_frac=0.04, min_gap=12, cut_mode="whitespace", render_mode="variable_size",
+                  snap_px=40, unsafe_window=2, unsafe_threshold=0.3, strip_rows=0, density_backend="gaussian",
+                  coarse_factor=0, mmap=False,
+                  image_format="png", compress_level=6, quality=90, jobs=1, dp_workers=1,
+                  cache_dir=None, cache_size_mb=1024, incremental=False, profile=False, stats=None, log=None):
+
+    # numpy/OpenCV/PIL are only imported once there is an image to paginate,
+    # so the CLI can parse arguments and print help without loading them.
+    import numpy as np
+    from .io import load_image
+
+    if incremental and coarse_factor > 1:
+        raise ValueError("Incremental mode cannot be combined with a coarse factor")
+
+    start_time = time.perf_counter()
+    if output is None:
+        output = default_output_path(input_path, output_format)
+    if stats is None and profile:
+        stats = PipelineStats()
+
+    _log(log, f"Processing {input_path}...")
+
+    try:
+        with timed(stats, "load"):
+            img_array = load_image(input_path, mmap=mmap)
+    except Exception as e:
+        raise ValueError(f"Error loading image: {e}") from e
+
+    if isinstance(img_array, np.memmap):
+        _log(log, "Memory-mapped input; reading rows on demand.")
+        strip_rows = strip_rows or MMAP_STRIP_ROWS
+
+    if incremental:
+        from .incremental import paginate_incremental
+        result = paginate_incremental(img_array, output, target_height_for_format(format, dpi),
+                                      output_format=output_format, dpi=dpi, window_frac=window_frac,
+                                      min_gap=min_gap, cut_mode=cut_mode, render_mode=render_mode,
+                                      snap_px=snap_px, unsafe_window=unsafe_window,
+                                      unsafe_threshold=unsafe_threshold, strip_rows=strip_rows,
+                                      density_backend=density_backend, image_format=image_format,
+                                      compress_level=compress_level, quality=quality, jobs=jobs,
+                                      dp_workers=dp_workers, stats=stats, log=log)
+        return _finish(input_path, result, start_time, stats)
+
+    cache = None
+    if cache_dir:
+        from .cache import ProfileCache
+        cache = ProfileCache(cache_dir, max_bytes=int(cache_size_mb * 1024 * 1024))
+
+    result = paginate_image(img_array, output, output_format=output_format, format=format, dpi=dpi,
+                            window_frac=window_frac, min_gap=min_gap, cut_mode=cut_mode,
+                            render_mode=render_mode, snap_px=snap_px, unsafe_window=unsafe_window,
+                            unsafe_threshold=unsafe_threshold, strip_rows=strip_rows,
+                            density_backend=density_backend, coarse_factor=coarse_factor,
+                            image_format=image_format, compress_level=compress_level, quality=quality,
+                            jobs=jobs, dp_workers=dp_workers, cache=cache, cache_source=input_path,
+                            stats=stats, log=log)
+    return _finish(input_path, result, start_time, stats)
+
+def _finish(input_path, result, start_time, stats):
+
+    result = dict(input=input_path, **result)
+    result["seconds"] = time.perf_counter() - start_time
+    if stats is not None:
+        result["profile"] = stats.as_dict()
+    return result
+
+def paginate_image(img_array, output, output_format="pdf", format="A4", dpi=300,
+                   window_frac=0.04, min_gap=12, cut_mode="whitespace", render_mode="variable_size",
+                   snap_px=40, unsafe_window=2, unsafe_threshold=0.3, strip_rows=0, density_backend="gaussian",
+                   coarse_factor=0, image_format="png", compress_level=6, quality=90, jobs=1, dp_workers=1,
+                   cache=None, cache_source=None, stats=None, on_cuts=None, log=None):
+
+    # `output` is a path, or for PDFs any binary file object with write/tell.
+    # on_cuts(cuts) runs once the cuts are known, before any page is written.
+    from .core import compute_ink_density, find_optimal_cuts_dp, find_optimal_cuts_coarse_to_fine, CutMode, DensityBackend
+    from .io import save_pdf_streaming, save_page_images, iter_page_crops, RenderMode
+
+    height, width = img_array.shape[0], img_array.shape[1]
+    target_height_px = target_height_for_format(format, dpi)
+
+    _log(log, f"Image Size: {width}x{height}")
+    _log(log, f"Target Page Height: {target_height_px} px (@ {dpi} DPI)")
+
+    cut_mode_enum = CutMode.WHITESPACE if cut_mode == "whitespace" else CutMode.FIXED_HEIGHT_SNAP
+    render_mode_enum = RenderMode.VARIABLE_SIZE if render_mode == "variable_size" else RenderMode.FIXED_SIZE_WITH_PADDING
+
+    _log(log, f"Cut Mode: {cut_mode}, Render Mode: {render_mode}")
+    if coarse_factor > 1:
+        _log(log, f"Finding cuts at 1/{coarse_factor} scale, refining at full resolution ({density_backend})...")
+        cuts, coarse_info = find_optimal_cuts_coarse_to_fine(img_array, target_height_px,
+                                                             factor=coarse_factor,
+                                                             density_backend=DensityBackend(density_backend),
+                                                             window_frac=window_frac,
+                                                             min_gap_rows=min_gap,
+                                                             cut_mode=cut_mode_enum,
+                                                             snap_px=snap_px,
+                                                             unsafe_window_radius=unsafe_window,
+                                                             unsafe_ink_threshold=unsafe_threshold,
+                                                             return_debug_info=True,
+                                                             stats=stats)
+        if coarse_info["refined"]:
+            _log(log, f"Refined {len(coarse_info['cut_moves'])} cuts: max move {coarse_info['max_cut_move']} px, "
+                      f"mean {coarse_info['mean_cut_move']:.1f} px")
+            if coarse_info["unmatched_cuts"]:
+                _log(log, f"{len(coarse_info['unmatched_cuts'])} cuts have no coarse counterpart.")
+        else:
+            _log(log, "Coarse cuts could not be refined; solved at full resolution instead.")
+    else:
+        ink_profile = None
+        if cache is not None:
+            with timed(stats, "cache"):
+                cache_key = cache.key_for(cache_source, density_backend=density_backend)
+                ink_profile = cache.get(cache_key)
+            if ink_profile is not None and len(ink_profile) != height:
+                ink_profile = None
+            if ink_profile is not None:
+                _log(log, "Loaded ink density from cache.")
+            count(stats, "cache_hits" if ink_profile is not None else "cache_misses")
+
+        if ink_profile is None:
+            _log(log, f"Analyzing ink density ({density_backend})...")
+            ink_profile = compute_ink_density(img_array, strip_rows=strip_rows or None,
+                                              backend=DensityBackend(density_backend), stats=stats, workers=jobs)
+            if cache is not None:
+                cache.put(cache_key, ink_profile, width)
+
+
+        _log(log, "Finding optimal cuts (DP)...")
+        cuts = find_optimal_cuts_dp(ink_profile, target_height_px,
+                                    window_frac=window_frac,
+                                    min_gap_rows=min_gap,
+                                    cut_mode=cut_mode_enum,
+                                    snap_px=snap_px,
+                                    unsafe_window_radius=unsafe_window,
+                                    unsafe_ink_threshold=unsafe_threshold,
+                                    workers=dp_workers,
+                                    stats=stats)
+
+    _log(log, f"Found {len(cuts)-1} pages.")
+    if on_cuts is not None:
+        on_cuts(cuts)
+
+
+    if output_format == "pdf":
+        _log(log, f"Saving to {output}...")
+        save_pdf_streaming(iter_page_crops(img_array, cuts), output, dpi=dpi,
+                           render_mode=render_mode_enum,
+                           target_height_px=target_height_px,
+                           jobs=jobs,
+                           stats=stats)
+        _log(log, "Done!")
+    else:
+
+        _log(log, f"Saving {len(cuts) - 1} images to {output}/...")
+        save_page_images(iter_page_crops(img_array, cuts), output,
+                         render_mode=render_mode_enum,
+                         target_height_px=target_height_px,
+                         image_format=image_format,
+                         compress_level=compress_level,
+                         quality=quality,
+                         jobs=jobs,
+                         stats=stats)
+        _log(log, f"Done! Saved {len(cuts) - 1} images to {output}/")
+
+    return {
+        "output": output,
+        "pages": len(cuts) - 1,
+        "width": width,
+        "height": height,
+        "cuts": [int(c) for c in cuts],
+    }
+
+class _HeldRows:
+
+    # Image strips received but not yet written out as pages.
+
+    def __init__(self):
+
+        self.strips = deque()
+        self.start = 0
+        self.width = None
+        self.pages = 0
+
+    def add(self, strip):
+
+        if self.width is None:
+            self.width = strip.shape[1]
+        elif strip.shape[1] != self.width:
+            raise ValueError(f"Strip width {strip.shape[1]} does not match the first strip's {self.width}")
+        self.strips.append(strip)
+        return strip
+
+    def take(self, end):
+
+        import numpy as np
+        parts = []
+        while self.start < end:
+            strip = self.strips[0]
+            n_rows = min(strip.shape[0], end - self.start)
+            parts.append(strip[:n_rows])
+            if n_rows == strip.shape[0]:
+                self.strips.popleft()
+            else:
+                self.strips[0] = strip[n_rows:]
+            self.start += n_rows
+        self.pages += 1
+        return parts[0] if len(parts) == 1 else np.concatenate(parts)
+
+def paginate_stream(strips, output, output_format="pdf", format="A4", dpi=300,
+                    window_frac=0.04, min_gap=12, cut_mode="whitespace", render_mode="variable_size",
+                    snap_px=40, unsafe_window=2, unsafe_threshold=0.3, density_backend="gaussian",
+                    lookahead_pages=8, image_format="png", compress_level=6, quality=90,
+                    stats=None, log=None):
+
+    # Paginates an image that arrives as row strips, e.g. from a pipe. Each
+    # page is written as soon as its cut is committed, so only the rows since
+    # the last cut are held, however long the scroll grows.
+    from .core import OnlinePaginator, iter_ink_density, CutMode, DensityBackend
+    from .io import save_pdf_streaming, save_page_images, RenderMode
+
+    start_time = time.perf_counter()
+    target_height_px = target_height_for_format(format, dpi)
+    cut_mode_enum = CutMode.WHITESPACE if cut_mode == "whitespace" else CutMode.FIXED_HEIGHT_SNAP
+    render_mode_enum = RenderMode.VARIABLE_SIZE if render_mode == "variable_size" else RenderMode.FIXED_SIZE_WITH_PADDING
+    paginator = OnlinePaginator(target_height_px,
+                                window_frac=window_frac,
+                                min_gap_rows=min_gap,
+                                cut_mode=cut_mode_enum,
+                                snap_px=snap_px,
+                                unsafe_window_radius=unsafe_window,
+                                unsafe_ink_threshold=unsafe_threshold,
+                                max_lookahead_rows=lookahead_pages * target_height_px,
+                                stats=stats)
+    held = _HeldRows()
+
+    _log(log, f"Target Page Height: {target_height_px} px (@ {dpi} DPI), lookahead {lookahead_pages} pages")
+    _log(log, f"Cut Mode: {cut_mode}, Render Mode: {render_mode}")
+
+    def committed_pages(cuts):
+        for cut in cuts:
+            _log(log, f"Page {held.pages + 1}: rows {held.start}-{cut} ({paginator.rows - cut} rows pending)")
+            yield held.take(cut)
+
+    def pages():
+        for profile in iter_ink_density((held.add(strip) for strip in strips), DensityBackend(density_backend)):
+            yield from committed_pages(paginator.feed(profile))
+        yield from committed_pages(paginator.finish())
+
+    if output_format == "pdf":
+        _log(log, f"Streaming pages to {output}...")
+        save_pdf_streaming(pages(), output, dpi=dpi,
+                           render_mode=render_mode_enum,
+                           target_height_px=target_height_px,
+                           stats=stats)
+    else:
+        _log(log, f"Streaming page images to {output}/...")
+        save_page_images(pages(), output,
+                         render_mode=render_mode_enum,
+                         target_height_px=target_height_px,
+                         image_format=image_format,
+                         compress_level=compress_level,
+                         quality=quality,
+                         stats=stats)
+    if paginator.rows == 0:
+        raise ValueError("No image rows received")
+
+    _log(log, f"Done! {len(paginator.cuts) - 1} pages from {paginator.rows} rows"
+              f" ({paginator.forced_commits} cuts committed at the lookahead limit)")
+    result = {
+        "output": output,
+        "pages": len(paginator.cuts) - 1,
+        "width": held.width,
+        "height": paginator.rows,
+        "cuts": [int(c) for c in paginator.cuts],
+        "forced_commits": paginator.forced_commits,
+        "max_pending_rows": paginator.max_pending_rows,
+        "seconds": time.perf_counter() - start_time,
+    }
+    if stats is not None:
+        result["profile"] = stats.as_dict()
+    return result
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".tif", ".tiff", ".bmp", ".webp", ".pgm", ".ppm", ".pnm", ".npy")
+
+def collect_inputs(input_path, manifest=False):
+
+    if manifest:
+        base_dir = os.path.dirname(os.path.abspath(input_path))
+        with open(input_path, 'r') as f:
+            lines = [line.strip() for line in f]
+        return [line if os.path.isabs(line) else os.path.join(base_dir, line)
+                for line in lines if line and not line.startswith("#")]
+
+    if os.path.isdir(input_path):
+        return sorted(os.path.join(input_path, name) for name in os.listdir(input_path)
+                      if name.lower().endswith(IMAGE_EXTENSIONS))
+
+    if glob.has_magic(input_path):
+        return sorted(path for path in glob.glob(input_path) if os.path.isfile(path))
+
+    return [input_path]
+
+def _batch_output_paths(inputs, output_dir, output_format):
+
+    # Outputs keep the inputs' paths below the deepest directory they share,
+    # so a/x.png and b/x.png do not both become x_paginated.pdf.
+    outputs = [default_output_path(path, output_format) for path in inputs]
+    if output_dir is not None and outputs:
+        root = os.path.commonpath([os.path.dirname(os.path.abspath(path)) for path in inputs])
+        outputs = [os.path.join(output_dir, os.path.relpath(os.path.abspath(output), root)) for output in outputs]
+    seen = {}
+    for path, output in zip(inputs, outputs):
+        key = os.path.normcase(os.path.abspath(output))
+        if key in seen:
+            raise ValueError(f"{seen[key]} and {path} would both be written to {output}")
+        seen[key] = path
+    return outputs
+
+def _paginate_batch_item(input_path, output, options):
+
+    start_time = time.perf_counter()
+    try:
+        return paginate_file(input_path, output, **options)
+    except Exception as e:
+        return {
+            "input": input_path,
+            "output": output,
+            "error": str(e),
+            "seconds": time.perf_counter() - start_time,
+        }
+
+def paginate_batch(inputs, output_dir=None, workers=None, **options):
+
+    output_format = options.get("output_format", "pdf")
+    jobs = list(zip(inputs, _batch_output_paths(inputs, output_dir, output_format)))
+    if output_dir is not None:
+        for directory in sorted({os.path.dirname(output) for _, output in jobs} | {output_dir}):
+            os.makedirs(directory, exist_ok=True)
+
+    if workers == 1 or len(jobs) <= 1:
+        return [_paginate_batch_item(path, output, options) for path, output in jobs]
+
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_paginate_batch_item, path, output, options) for path, output in jobs]
+        return [future.result() for future in futures]
@@ -0,0 +1,66 @@
+import time
+from contextlib import contextmanager, nullcontext
+
+
+class PipelineStats:
+
+    def __init__(self, callback=None):
+
+        # callback(stage, seconds, stats) runs as each timed stage finishes.
+        self.timings = {}
+        self.counters = {}
+        self.callback = callback
+
+    @contextmanager
+    def stage(self, name):
+
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            seconds = time.perf_counter() - start
+            self.timings[name] = self.timings.get(name, 0.0) + seconds
+            if self.callback is not None:
+                self.callback(name, seconds, self)
+
+    def count(self, name, n=1):
+
+        self.counters[name] = self.counters.get(name, 0) + int(n)
+
+    def as_dict(self):
+
+        return {
+            "timings": dict(self.timings),
+            "counters": dict(self.counters),
+        }
+
+def timed(stats, name):
+
+    return nullcontext() if stats is None else stats.stage(name)
+
+def count(stats, name, n=1):
+
+    if stats is not None:
+        stats.count(name, n)
+
+def merge_profiles(profiles):
+
+    merged = {"timings": {}, "counters": {}}
+    for profile in profiles:
+        for section in merged:
+            for name, value in profile[section].items():
+                merged[section][name] = merged[section].get(name, 0) + value
+    return merged
+
+def format_profile(profile, total_seconds=None):
+
+    timings = profile["timings"]
+    total = total_seconds if total_seconds else sum(timings.values())
+    width = max(len(name) for name in list(timings) + ["total"])
+    lines = ["Profile:"]
+    for name, seconds in timings.items():
+        lines.append(f"  {name:<{width}}  {seconds:8.3f}s  {100 * seconds / max(total, 1e-9):5.1f}%")
+    lines.append(f"  {'total':<{width}}  {total:8.3f}s")
+    if profile["counters"]:
+        lines.append("  " + ", ".join(f"{name}={value}" for name, value in profile["counters"].items()))
+    return "\n".join(lines)
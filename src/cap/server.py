@@ -0,0 +1,392 @@
+import asyncio
+import click
+import json
+import os
+import sys
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, parse_qsl
+from .pipeline import PAPER_SIZES, paginate_image
+
+
+STREAM_CHUNK_BYTES = 64 * 1024
+# Encoded chunks buffered per response before the encoding thread blocks.
+STREAM_QUEUE_CHUNKS = 16
+MAX_HEAD_BYTES = 64 * 1024
+
+REASONS = {
+    100: "Continue",
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    411: "Length Required",
+    413: "Payload Too Large",
+    500: "Internal Server Error",
+    503: "Service Unavailable",
+}
+
+# Query parameters accepted by POST /paginate, parsed as (type, allowed values).
+PAGINATE_OPTIONS = {
+    "format": (str, tuple(PAPER_SIZES) + ("CUSTOM",)),
+    "dpi": (int, None),
+    "window_frac": (float, None),
+    "min_gap": (int, None),
+    "cut_mode": (str, ("whitespace", "fixed_height_snap")),
+    "render_mode": (str, ("variable_size", "fixed_size_with_padding")),
+    "snap_px": (int, None),
+    "unsafe_window": (int, None),
+    "unsafe_threshold": (float, None),
+    "strip_rows": (int, None),
+    "density_backend": (str, ("gaussian", "integral", "integral_cap_c")),
+    "coarse_factor": (int, None),
+}
+
+Request = namedtuple("Request", ["method", "path", "query", "version", "headers"])
+
+class HttpError(Exception):
+
+    def __init__(self, status, message):
+
+        super().__init__(message)
+        self.status = status
+
+def parse_paginate_options(query):
+
+    options = {}
+    for name, value in parse_qsl(query, keep_blank_values=True):
+        if name not in PAGINATE_OPTIONS:
+            raise HttpError(400, f"Unknown option '{name}'")
+        kind, choices = PAGINATE_OPTIONS[name]
+        try:
+            options[name] = kind(value)
+        except ValueError:
+            raise HttpError(400, f"Invalid value for '{name}': {value!r}") from None
+        if choices is not None and options[name] not in choices:
+            raise HttpError(400, f"'{name}' must be one of {', '.join(choices)}")
+    if options.get("dpi", 1) <= 0:
+        raise HttpError(400, "'dpi' must be positive")
+    return options
+
+async def _read_request(reader):
+
+    try:
+        head = await reader.readuntil(b"\r\n\r\n")
+    except asyncio.IncompleteReadError as e:
+        if not e.partial.strip():
+            return None
+        raise HttpError(400, "Incomplete request head") from None
+    except asyncio.LimitOverrunError:
+        raise HttpError(400, "Request head too large") from None
+
+    lines = head.decode('latin-1').split("\r\n")
+    try:
+        method, target, version = lines[0].split(" ")
+    except ValueError:
+        raise HttpError(400, "Malformed request line") from None
+    headers = {}
+    for line in lines[1:]:
+        if not line:
+            continue
+        name, sep, value = line.partition(":")
+        if not sep:
+            raise HttpError(400, "Malformed header line")
+        headers[name.strip().lower()] = value.strip()
+    url = urlsplit(target)
+    return Request(method, url.path, url.query, version, headers)
+
+def _wants_keep_alive(request):
+
+    connection = request.headers.get("connection", "").lower()
+    if request.version == "HTTP/1.0":
+        return connection == "keep-alive"
+    return connection != "close"
+
+def _response_head(status, headers, keep_alive):
+
+    lines = [f"HTTP/1.1 {status} {REASONS[status]}"]
+    lines += [f"{name}: {value}" for name, value in headers]
+    lines.append("Connection: " + ("keep-alive" if keep_alive else "close"))
+    return ("\r\n".join(lines) + "\r\n\r\n").encode('latin-1')
+
+async def _send_json(writer, status, body, keep_alive, headers=()):
+
+    data = json.dumps(body).encode('utf-8')
+    headers = [("Content-Type", "application/json"), ("Content-Length", len(data))] + list(headers)
+    writer.write(_response_head(status, headers, keep_alive) + data)
+    await writer.drain()
+
+class _StreamSink:
+
+    # File object handed to the PDF writer on a worker thread. Output is
+    # buffered into chunks and queued for the event loop; put() blocks while
+    # the queue is full, so a slow client throttles encoding instead of the
+    # finished PDF piling up in memory.
+
+    def __init__(self, loop, queue):
+
+        self._loop = loop
+        self._queue = queue
+        self._buffer = bytearray()
+        self.cancelled = False
+
+    def put(self, kind, value=None):
+
+        asyncio.run_coroutine_threadsafe(self._queue.put((kind, value)), self._loop).result()
+
+    def write(self, data):
+
+        if self.cancelled:
+            raise ConnectionAbortedError("client disconnected")
+        self._buffer += data
+        if len(self._buffer) >= STREAM_CHUNK_BYTES:
+            self.flush()
+        return len(data)
+
+    def flush(self):
+
+        if self._buffer:
+            self.put("data", bytes(self._buffer))
+            self._buffer.clear()
+
+def _paginate_job(data, options, sink):
+
+    from .io import decode_image
+
+    try:
+        try:
+            img_array = decode_image(data)
+        except Exception as e:
+            raise ValueError(f"Error loading image: {e}") from e
+        del data
+        paginate_image(img_array, sink, output_format="pdf",
+                       on_cuts=lambda cuts: sink.put("cuts", [int(c) for c in cuts]), **options)
+        sink.flush()
+        sink.put("end")
+    except Exception as e:
+        sink.put("error", e)
+
+def warm_up():
+
+    # Imports numpy/OpenCV/PIL and paginates a tiny image once, so the first
+    # request does not pay for module loading and lazy initialisation.
+    import io
+    import numpy as np
+    from PIL import Image
+
+    Image.init()
+    img_array = np.full((256, 64, 3), 255, dtype=np.uint8)
+    img_array[100:120, 8:56] = 0
+    paginate_image(img_array, io.BytesIO(), dpi=20)
+
+class PaginationServer:
+
+    def __init__(self, max_in_flight=2, max_queue=None, workers=None, max_body_bytes=512 * 1024 * 1024, log=None):
+
+        # At most max_in_flight requests are decoded and paginated at once;
+        # further requests wait, unread, until a slot frees up. With max_queue
+        # set, requests beyond that many waiting are refused with a 503.
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.max_body_bytes = max_body_bytes
+        self.log = log
+        self.in_flight = 0
+        self.waiting = 0
+        self.served = 0
+        self._executor = ThreadPoolExecutor(max_workers=workers or max_in_flight, thread_name_prefix="cap-server")
+        self._slots = None
+        self._server = None
+
+    async def start(self, host="127.0.0.1", port=8000, unix_socket=None):
+
+        self._slots = asyncio.Semaphore(self.max_in_flight)
+        if unix_socket:
+            self._server = await asyncio.start_unix_server(self._handle, path=unix_socket, limit=MAX_HEAD_BYTES)
+        else:
+            self._server = await asyncio.start_server(self._handle, host, port, limit=MAX_HEAD_BYTES)
+        return self._server
+
+    async def close(self):
+
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        self._executor.shutdown(wait=True)
+
+    def _log(self, msg):
+
+        if self.log is not None:
+            self.log(msg)
+
+    async def _handle(self, reader, writer):
+
+        try:
+            keep_alive = True
+            while keep_alive:
+                try:
+                    request = await _read_request(reader)
+                except HttpError as e:
+                    await _send_json(writer, e.status, {"error": str(e)}, keep_alive=False)
+                    break
+                if request is None:
+                    break
+                keep_alive = await self._dispatch(request, reader, writer)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def _dispatch(self, request, reader, writer):
+
+        keep_alive = _wants_keep_alive(request)
+        has_body = request.headers.get("content-length", "0") != "0" or "transfer-encoding" in request.headers
+        try:
+            if request.path == "/health":
+                if request.method != "GET":
+                    raise HttpError(405, "Use GET for /health")
+                await _send_json(writer, 200, self.health(), keep_alive and not has_body)
+                return keep_alive and not has_body
+            if request.path == "/paginate":
+                if request.method != "POST":
+                    raise HttpError(405, "Use POST for /paginate")
+                return await self._paginate(request, reader, writer, keep_alive)
+            raise HttpError(404, f"No route for {request.path}")
+        except HttpError as e:
+            # Any request body is still unread, so the connection cannot be reused.
+            headers = [("Retry-After", 1)] if e.status == 503 else []
+            await _send_json(writer, e.status, {"error": str(e)}, keep_alive and not has_body, headers)
+            return keep_alive and not has_body
+
+    def health(self):
+
+        return {
+            "status": "ok",
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "served": self.served,
+            "max_in_flight": self.max_in_flight,
+            "max_queue": self.max_queue,
+        }
+
+    async def _paginate(self, request, reader, writer, keep_alive):
+
+        if "transfer-encoding" in request.headers or "content-length" not in request.headers:
+            raise HttpError(411, "POST /paginate needs a Content-Length")
+        try:
+            length = int(request.headers["content-length"])
+        except ValueError:
+            raise HttpError(400, "Invalid Content-Length") from None
+        if length > self.max_body_bytes:
+            raise HttpError(413, f"Image is larger than {self.max_body_bytes} bytes")
+        options = parse_paginate_options(request.query)
+
+        if self.max_queue is not None and self._slots.locked() and self.waiting >= self.max_queue:
+            raise HttpError(503, "Too many requests in flight")
+
+        # The body is only read once a slot is free, so waiting clients are
+        # held back by TCP flow control rather than buffered here.
+        self.waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        try:
+            if request.headers.get("expect", "").lower() == "100-continue":
+                writer.write(b"HTTP/1.1 100 Continue\r\n\r\n")
+                await writer.drain()
+            data = await reader.readexactly(length)
+            return await self._stream_pdf(data, options, writer, keep_alive)
+        finally:
+            self.in_flight -= 1
+            self._slots.release()
+
+    async def _stream_pdf(self, data, options, writer, keep_alive):
+
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(STREAM_QUEUE_CHUNKS)
+        sink = _StreamSink(loop, queue)
+        job = loop.run_in_executor(self._executor, _paginate_job, data, options, sink)
+        del data
+
+        kind, value = await queue.get()
+        if kind == "error":
+            await job
+            status = 400 if isinstance(value, ValueError) else 500
+            self._log(f"Request failed: {value}")
+            await _send_json(writer, status, {"error": str(value)}, keep_alive)
+            return keep_alive
+
+        cuts = value
+        writer.write(_response_head(200, [("Content-Type", "application/pdf"),
+                                          ("Transfer-Encoding", "chunked"),
+                                          ("X-Cap-Pages", len(cuts) - 1),
+                                          ("X-Cap-Cuts", ",".join(map(str, cuts)))], keep_alive))
+        try:
+            while True:
+                kind, value = await queue.get()
+                if kind == "data":
+                    writer.write(b"%x\r\n%s\r\n" % (len(value), value))
+                    await writer.drain()
+                elif kind == "end":
+                    writer.write(b"0\r\n\r\n")
+                    await writer.drain()
+                    break
+                else:
+                    # Headers are already sent; dropping the connection before
+                    # the last chunk is the only way left to signal failure.
+                    self._log(f"Request failed while streaming: {value}")
+                    await job
+                    return False
+        except ConnectionError:
+            sink.cancelled = True
+            while kind not in ("end", "error"):
+                kind, value = await queue.get()
+            await job
+            raise
+        await job
+        self.served += 1
+        self._log(f"Served {len(cuts) - 1} pages")
+        return keep_alive
+
+async def serve(host="127.0.0.1", port=8000, unix_socket=None, log=None, **options):
+
+    server = PaginationServer(log=log, **options)
+    await asyncio.get_running_loop().run_in_executor(server._executor, warm_up)
+    listener = await server.start(host, port, unix_socket)
+    where = unix_socket or ", ".join(f"http://{s.getsockname()[0]}:{s.getsockname()[1]}" for s in listener.sockets)
+    if log is not None:
+        log(f"Listening on {where} (max {server.max_in_flight} in flight)")
+    try:
+        await listener.serve_forever()
+    finally:
+        await server.close()
+        if unix_socket and os.path.exists(unix_socket):
+            os.unlink(unix_socket)
+
+@click.command()
+@click.option("--host", default="127.0.0.1", help="Address to listen on")
+@click.option("--port", "-p", default=8000, type=click.IntRange(0, 65535), help="TCP port to listen on")
+@click.option("--unix-socket", default=None, type=click.Path(dir_okay=False),
+              help="Listen on this Unix domain socket instead of TCP")
+@click.option("--max-in-flight", default=2, type=click.IntRange(min=1),
+              help="Requests decoded and paginated concurrently; others wait unread")
+@click.option("--max-queue", default=None, type=click.IntRange(min=0),
+              help="Refuse requests with 503 once this many are waiting (default: no limit)")
+@click.option("--workers", "-w", default=None, type=click.IntRange(min=1),
+              help="Threads in the executor pool (default: --max-in-flight)")
+@click.option("--max-body-mb", default=512, type=click.FloatRange(min=0), help="Largest accepted image upload")
+def main(host, port, unix_socket, max_in_flight, max_queue, workers, max_body_mb):
+
+    try:
+        asyncio.run(serve(host, port, unix_socket, log=click.echo, max_in_flight=max_in_flight,
+                          max_queue=max_queue, workers=workers, max_body_bytes=int(max_body_mb * 1024 * 1024)))
+    except KeyboardInterrupt:
+        sys.exit(0)
+
+if __name__ == "__main__":
+    main()
@@ -2,6 +2,7 @@
 import numpy as np
 import sys
 import os
+import subprocess
 import time
 
 script_dir = os.path.dirname(os.path.abspath(__file__))
@@ -118,6 +119,55 @@ def test_stress_benchmark():
 
     print(f"PASS ({duration:.2f}s)")
 
+def test_stress_benchmark_1m_rows():
+
+    print("Running stress benchmark (H=1000000)...", end=" ")
+
+    rng = np.random.default_rng(0)
+    H = 1_000_000
+    target = 3507
+    ink = rng.uniform(0.1, 0.6, H)
+    for start in range(0, H, 45):
+        ink[start:start + 12] = 0.0
+
+    start_time = time.time()
+    cuts = find_optimal_cuts_dp(ink, target)
+    duration = time.time() - start_time
+
+    assert cuts[0] == 0 and cuts[-1] == H, "Invalid bounds"
+
+    if duration > 2.0:
+        print(f"FAIL (took {duration:.2f}s, expected <2s)")
+        raise AssertionError(f"Stress test too slow: {duration:.2f}s")
+
+    print(f"PASS ({duration:.2f}s)")
+
+
+
+
+
+IMPORT_BUDGET_MS = 150
+
+def _import_time_ms(module):
+
+    code = ("import time; t = time.perf_counter(); import " + module +
+            "; print((time.perf_counter() - t) * 1000)")
+    env = dict(os.environ, PYTHONPATH=os.path.abspath(src_dir))
+    result = subprocess.run([sys.executable, "-c", code], env=env, capture_output=True, text=True, check=True)
+    return float(result.stdout.strip())
+
+def test_stress_import_time_budget():
+
+    print(f"Running import-time benchmark (cap.cli < {IMPORT_BUDGET_MS}ms)...", end=" ")
+
+    duration = min(_import_time_ms("cap.cli") for _ in range(3))
+
+    if duration > IMPORT_BUDGET_MS:
+        print(f"FAIL (took {duration:.0f}ms, expected <{IMPORT_BUDGET_MS}ms)")
+        raise AssertionError(f"cap.cli import too slow: {duration:.0f}ms")
+
+    print(f"PASS ({duration:.0f}ms)")
+
 
 
 
@@ -132,6 +182,8 @@ def run_stress_tests():
         test_boundary_cases,
         test_fuzz_random_profiles,
         test_stress_benchmark,
+        test_stress_benchmark_1m_rows,
+        test_stress_import_time_budget,
     ]
 
     passed = 0
@@ -5,14 +5,21 @@ import os
 from PIL import Image
 import json
 import hashlib
+import tempfile
 
 
 script_dir = os.path.dirname(os.path.abspath(__file__))
 src_dir = os.path.join(script_dir, "..", "src")
 sys.path.append(src_dir)
 
-from cap.core import find_optimal_cuts_dp, compute_ink_density, CutMode
-from cap.io import save_pdf_from_crops, RenderMode
+from cap.core import (find_optimal_cuts_dp, find_optimal_cuts_coarse_to_fine, compute_ink_density,
+                      iter_ink_density, iter_image_strips,
+                      compute_unsafe_mask, is_unsafe_cut,
+                      CutMode, DPEngine, DensityBackend, Paginator, OnlinePaginator)
+from cap.cache import ProfileCache
+from cap.pipeline import paginate_file
+from cap.io import (load_image, save_pdf_from_crops, save_pdf_streaming, save_page_images, iter_page_crops,
+                    PageImageWriter, RenderMode)
 
 
 try:
@@ -270,6 +277,487 @@ def test_whitespace_vs_fixed_height_snap_modes():
 
     print("PASS")
 
+def _page_image_arrays(pdf_path):
+
+    reader = PdfReader(pdf_path)
+    arrays = []
+    for page in reader.pages:
+        for xobj in page['/Resources']['/XObject'].values():
+            xobj = xobj.get_object()
+            channels = 3 if xobj['/ColorSpace'] == '/DeviceRGB' else 1
+            data = np.frombuffer(xobj.get_data(), dtype=np.uint8)
+            arrays.append(data.reshape(xobj['/Height'], xobj['/Width'], channels).squeeze())
+    return arrays
+
+def test_pdf_pages_written_in_memory():
+
+    if not HAS_PYPDF2:
+        print("  test_pdf_pages_written_in_memory... SKIP (PyPDF2 not installed)")
+        return
+
+    print("  test_pdf_pages_written_in_memory...", end=" ")
+
+    rng = np.random.default_rng(3)
+    img_array = rng.integers(0, 256, (900, 120, 3), dtype=np.uint8)
+    crops = [img_array[0:400], img_array[400:900]]
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as work_dir, tempfile.TemporaryDirectory() as out_dir:
+        os.chdir(work_dir)
+        try:
+            output_path = os.path.join(out_dir, "pages.pdf")
+            save_pdf_from_crops(crops, output_path, dpi=150)
+            assert os.listdir(work_dir) == [], f"unexpected files: {os.listdir(work_dir)}"
+        finally:
+            os.chdir(cwd)
+
+        pages = _page_image_arrays(output_path)
+        assert len(pages) == 2
+        for page, crop in zip(pages, crops):
+            assert np.array_equal(page, crop), "page pixels must round-trip exactly"
+
+        # Several threads writing at once still embed binary image streams and
+        # leave reportlab's global setting as they found it.
+        from concurrent.futures import ThreadPoolExecutor
+        from reportlab import rl_config
+        use_a85 = rl_config.useA85
+        paths = [os.path.join(out_dir, f"pages_{k}.pdf") for k in range(8)]
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            list(executor.map(lambda path: save_pdf_from_crops(crops, path, dpi=150), paths))
+        assert rl_config.useA85 == use_a85
+        for path in paths:
+            with open(path, 'rb') as f:
+                images = [obj for obj in f.read().split(b"endobj") if b"/Subtype /Image" in obj]
+            assert len(images) == len(crops)
+            assert not any(b"ASCII85Decode" in obj for obj in images)
+
+    print("PASS")
+
+def test_streaming_pdf_writer_bounded_memory():
+
+    if not HAS_PYPDF2:
+        print("  test_streaming_pdf_writer_bounded_memory... SKIP (PyPDF2 not installed)")
+        return
+
+    print("  test_streaming_pdf_writer_bounded_memory...", end=" ")
+
+    import tracemalloc
+
+    rng = np.random.default_rng(4)
+    page_shape = (400, 300, 3)
+    page_bytes = int(np.prod(page_shape))
+    n_pages = 40
+
+    def pages():
+        for k in range(n_pages):
+            yield np.random.default_rng(k).integers(0, 256, page_shape, dtype=np.uint8)
+
+    with tempfile.TemporaryDirectory() as out_dir:
+        output_path = os.path.join(out_dir, "stream.pdf")
+        tracemalloc.start()
+        count = save_pdf_streaming(pages(), output_path, dpi=100)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        assert count == n_pages
+        assert peak < 4 * page_bytes, f"peak {peak} bytes for {page_bytes}-byte pages"
+        written = _page_image_arrays(output_path)
+        assert len(written) == n_pages
+        for k, expected in enumerate(pages()):
+            assert np.array_equal(written[k], expected)
+
+        threaded_path = os.path.join(out_dir, "threaded.pdf")
+        assert save_pdf_streaming(pages(), threaded_path, dpi=100, jobs=4) == n_pages
+        with open(threaded_path, "rb") as a, open(os.path.join(out_dir, "stream.pdf"), "rb") as b:
+            assert a.read() == b.read(), "threaded encoding must produce an identical file"
+
+        gray = rng.integers(0, 256, (700, 90), dtype=np.uint8)
+        output_path = os.path.join(out_dir, "padded.pdf")
+        save_pdf_streaming(iter_page_crops(gray, [0, 250, 700]), output_path, dpi=300,
+                           render_mode=RenderMode.FIXED_SIZE_WITH_PADDING, target_height_px=400)
+        reader = PdfReader(output_path, strict=True)
+        heights = [float(page.mediabox.height) for page in reader.pages]
+        assert abs(heights[0] - 400 * 72 / 300) < 0.01
+        assert abs(heights[1] - 450 * 72 / 300) < 0.01
+        written = _page_image_arrays(output_path)
+        assert np.array_equal(written[0][:250], gray[:250]) and (written[0][250:] == 255).all()
+        assert np.array_equal(written[1], gray[250:])
+
+        output_path = os.path.join(out_dir, "empty.pdf")
+        assert save_pdf_streaming(iter([]), output_path) == 0
+        assert not os.path.exists(output_path)
+
+    print("PASS")
+
+def test_page_image_writer_reuses_padding_buffer():
+
+    print("  test_page_image_writer_reuses_padding_buffer...", end=" ")
+
+    rng = np.random.default_rng(8)
+    img_array = rng.integers(0, 200, (1000, 64, 3), dtype=np.uint8)
+    cuts = [0, 280, 400, 650, 1000]
+
+    with tempfile.TemporaryDirectory() as out_dir:
+        writer = PageImageWriter(out_dir, compress_level=1, target_height_px=300)
+        paths = [writer.add_page(crop) for crop in iter_page_crops(img_array, cuts)]
+
+        for path, start, end in zip(paths, cuts[:-1], cuts[1:]):
+            written = np.array(Image.open(path))
+            height = end - start
+            if height < 300:
+                assert written.shape == (300, 64, 3), written.shape
+                assert np.array_equal(written[:height], img_array[start:end])
+                assert (written[height:] == 255).all(), f"stale rows left in padding of {path}"
+            else:
+                assert np.array_equal(written, img_array[start:end])
+        assert writer._buffers.qsize() == 1, "serial writer should own a single padding buffer"
+
+        threaded_dir = os.path.join(out_dir, "threaded")
+        count = save_page_images(iter_page_crops(img_array, cuts), threaded_dir, compress_level=1,
+                                 render_mode=RenderMode.FIXED_SIZE_WITH_PADDING, target_height_px=300, jobs=3)
+        assert count == 4
+        for path in paths:
+            threaded = os.path.join(threaded_dir, os.path.basename(path))
+            assert np.array_equal(np.array(Image.open(threaded)), np.array(Image.open(path)))
+
+        for image_format, ext in (("jpeg", "jpg"), ("webp", "webp")):
+            fmt_dir = os.path.join(out_dir, image_format)
+            count = save_page_images(iter_page_crops(img_array, cuts), fmt_dir, image_format=image_format,
+                                     quality=80, render_mode=RenderMode.FIXED_SIZE_WITH_PADDING,
+                                     target_height_px=300)
+            assert count == 4
+            assert sorted(os.listdir(fmt_dir)) == [f"page_{k:03d}.{ext}" for k in range(1, 5)]
+            assert Image.open(os.path.join(fmt_dir, f"page_002.{ext}")).size == (64, 300)
+
+    print("PASS")
+
+def _reference_candidates(ink_profile, smoothed_profile, min_gap_rows, band_size,
+                          gap_cap=0.05, basin_tol_floor=0.02, basin_tol_scale=0.25):
+
+    H = len(ink_profile)
+    candidates = set([0, H])
+
+    pct5 = np.percentile(ink_profile, 5)
+    gap_thresh = max(min(pct5, gap_cap), 1e-4) if np.max(ink_profile) > 0 else 0.01
+    is_gap = ink_profile <= gap_thresh
+
+    i = 0
+    while i < H:
+        if is_gap[i]:
+            start = i
+            while i < H and is_gap[i]:
+                i += 1
+            if i - start >= min_gap_rows:
+                candidates.add(start + (i - start) // 2)
+        else:
+            i += 1
+
+    bridge_debug = []
+    for start_row in range(0, H, band_size):
+        band_vals = smoothed_profile[start_row:min(start_row + band_size, H)]
+        min_val = np.min(band_vals)
+        median_val = np.percentile(band_vals, 50)
+        tolerance = max(basin_tol_floor, basin_tol_scale * (median_val - min_val))
+        min_indices = np.where(band_vals <= min_val + tolerance)[0]
+        if len(min_indices) > 0:
+            cand = start_row + min_indices[len(min_indices) // 2]
+            candidates.add(cand)
+            bridge_debug.append((cand, min_val, tolerance))
+
+    return sorted(candidates), gap_thresh, bridge_debug
+
+def test_vectorized_candidates_match_reference():
+
+    print("  test_vectorized_candidates_match_reference...", end=" ")
+
+    rng = np.random.default_rng(2024)
+    for trial in range(40):
+        H = int(rng.integers(1, 6000))
+        ink = rng.uniform(0.0, 1.0, H)
+        if trial % 3 == 0:
+            ink = np.round(ink, 1)
+        for _ in range(int(rng.integers(0, 30))):
+            a = int(rng.integers(0, H))
+            ink[a:a + int(rng.integers(1, 80))] = rng.choice([0.0, 0.01, 0.04])
+        min_gap_rows = int(rng.integers(1, 20))
+        band_size = int(rng.choice([1, 7, 50, 200, 10000]))
+
+        paginator = Paginator(ink, min_gap_rows=min_gap_rows, smoothing_radius=3, band_size=band_size)
+        cands, snap_debug = paginator.candidates(1000, return_debug_info=True)
+        expected = _reference_candidates(ink, paginator.smoothed_profile, min_gap_rows, band_size)
+        bridge_debug = list(zip(*(values.tolist() for values in paginator.bridge_candidates)))
+
+        assert cands == expected[0], f"trial {trial}: candidate sets differ"
+        assert paginator.gap_thresh == expected[1]
+        assert bridge_debug == expected[2], f"trial {trial}: bridge debug differs"
+        assert snap_debug == []
+
+    print("PASS")
+
+def test_windowed_engine_matches_reference():
+
+    print("  test_windowed_engine_matches_reference (120 trials)...", end=" ")
+
+    rng = np.random.default_rng(99)
+    pruned = 0
+    for trial in range(120):
+        H = int(rng.integers(50, 6000))
+        target_height = int(rng.integers(100, 1500))
+
+        if trial % 4 == 0:
+            ink = np.full(H, float(rng.choice([0.0, 0.5, 1.0])))
+        elif trial % 4 == 1:
+            ink = np.round(rng.uniform(0.0, 1.0, H), 1)
+        else:
+            ink = rng.uniform(0.0, 1.0, H)
+        for _ in range(int(rng.integers(0, 10))):
+            a = int(rng.integers(0, H))
+            ink[a:a + int(rng.integers(1, 60))] = 0.0
+
+        kwargs = dict(
+            window_frac=float(rng.uniform(0.01, 0.3)),
+            smoothing_radius=int(rng.choice([0, 2, 10])),
+            band_size=int(rng.choice([20, 50, 200])),
+            cut_mode=CutMode.FIXED_HEIGHT_SNAP if trial % 2 else CutMode.WHITESPACE,
+            snap_px=int(rng.integers(5, 50)),
+            return_debug_info=True,
+        )
+        ref_cuts, ref_debug = find_optimal_cuts_dp(ink, target_height, dp_engine=DPEngine.REFERENCE, **kwargs)
+        win_cuts, win_debug = find_optimal_cuts_dp(ink, target_height, dp_engine=DPEngine.WINDOWED, **kwargs)
+
+        assert win_cuts == ref_cuts, f"trial {trial}: {win_cuts} != {ref_cuts}"
+        ref_mask = ref_debug.pop("unsafe_mask")
+        win_mask = win_debug.pop("unsafe_mask")
+        assert (ref_mask is None and win_mask is None) or np.array_equal(ref_mask, win_mask)
+        assert win_debug == ref_debug, f"trial {trial}: debug info differs"
+
+        # Dominated candidates are skipped without changing the answer.
+        full_cuts, full_debug = find_optimal_cuts_dp(ink, target_height, prune=False, **kwargs)
+        assert full_cuts == win_cuts, f"trial {trial}: pruning changed the cuts"
+        assert full_debug["pruned_candidates"] == 0
+        assert full_debug["chosen_path_costs"] == win_debug["chosen_path_costs"]
+        assert 0.0 <= win_debug["pruning_ratio"] < 1.0
+        pruned += win_debug["pruned_candidates"]
+    assert pruned > 0
+
+    print("PASS")
+
+def test_unsafe_mask_matches_is_unsafe_cut():
+
+    print("  test_unsafe_mask_matches_is_unsafe_cut...", end=" ")
+
+    rng = np.random.default_rng(11)
+    for H in (0, 1, 2, 5, 300, 2500):
+        ink = rng.uniform(0.0, 0.6, H)
+        for radius in (0, 1, 2, 7):
+            for threshold in (0.1, 0.3):
+                mask = compute_unsafe_mask(ink, radius, threshold)
+                assert mask.shape == (H + 1,)
+                expected = [is_unsafe_cut(ink, row, radius, threshold) for row in range(H + 1)]
+                assert mask.tolist() == expected, f"H={H} radius={radius} threshold={threshold}"
+
+    ink = rng.uniform(0.0, 0.6, 3000)
+    cuts, debug = find_optimal_cuts_dp(ink, 1000, cut_mode=CutMode.FIXED_HEIGHT_SNAP, return_debug_info=True)
+    assert np.array_equal(debug["unsafe_mask"], compute_unsafe_mask(ink))
+    assert not any(debug["unsafe_mask"][row] for row, _ in debug["snap_debug"])
+    assert not any(debug["unsafe_mask"][cut] for cut in cuts) or debug["fallback"]
+
+    print("PASS")
+
+def test_quantized_profile_cuts_are_pinned():
+
+    print("  test_quantized_profile_cuts_are_pinned...", end=" ")
+
+    # Quantized profiles have runs of exactly equal smoothed values, so the
+    # basins (and the cuts) depend on the exact rounding of the prefix-sum
+    # smoothing. These cuts moved by a few rows when it replaced np.convolve.
+    expected = {
+        28: (14327, 2674, [0, 2706, 5343, 7934, 10668, 13406, 14327]),
+        55: (19381, 2630, [0, 2528, 5250, 7920, 10538, 13201, 15872, 18483, 19381]),
+    }
+    for seed, (height, target_height, cuts) in expected.items():
+        rng = np.random.default_rng(seed)
+        H = int(rng.integers(3000, 20000))
+        ink = np.round(rng.random(H) * 4) / 4
+        T = int(rng.integers(800, 3000))
+        assert (H, T) == (height, target_height)
+        assert find_optimal_cuts_dp(ink, T) == cuts, seed
+        assert Paginator(ink).cuts(T) == cuts, seed
+
+    print("PASS")
+
+def test_paginator_reuses_profile_state():
+
+    print("  test_paginator_reuses_profile_state...", end=" ")
+
+    rng = np.random.default_rng(18)
+    ink = rng.uniform(0.05, 0.6, 12000)
+    for start in range(0, len(ink), 170):
+        ink[start:start + int(rng.integers(4, 20))] = 0.0
+
+    paginator = Paginator(ink)
+    queries = [dict(target_height=t, cut_mode=mode, w_height=w)
+               for t in (700, 1000, 1413) for mode in CutMode for w in (1.0, 3.0)]
+    queries += queries[::-1]
+    smoothed = None
+    for query in queries:
+        cuts, debug = paginator.cuts(return_debug_info=True, **query)
+        expected, expected_debug = find_optimal_cuts_dp(ink, return_debug_info=True, **query)
+        assert cuts == expected, query
+        assert debug["candidates"] == expected_debug["candidates"]
+        assert debug["chosen_path_costs"] == expected_debug["chosen_path_costs"]
+        assert smoothed is None or paginator.smoothed_profile is smoothed, "profile analysis should run once"
+        smoothed = paginator.smoothed_profile
+
+    print("PASS")
+
+def test_online_paginator_matches_offline():
+
+    print("  test_online_paginator_matches_offline...", end=" ")
+
+    rng = np.random.default_rng(21)
+    ink = np.zeros(40000)
+    row = 0
+    while row < len(ink):
+        line = int(rng.integers(15, 40))
+        ink[row:row + line] = rng.uniform(0.1, 0.5, len(ink[row:row + line]))
+        row += line + int(rng.integers(3, 30))
+    ink += rng.uniform(0, 0.01, len(ink))
+
+    for target_height, cut_mode, chunk in [(900, CutMode.WHITESPACE, 53), (2339, CutMode.WHITESPACE, 4096),
+                                           (900, CutMode.FIXED_HEIGHT_SNAP, 1000),
+                                           (2339, CutMode.FIXED_HEIGHT_SNAP, 317)]:
+        expected, debug = find_optimal_cuts_dp(ink, target_height, cut_mode=cut_mode, return_debug_info=True)
+        reference = Paginator(ink)
+        reference.candidates(target_height)
+
+        # Given the offline gap threshold and room to wait, committed cuts
+        # are exactly the offline ones, whatever the chunking. Where no path
+        # reaches the end, offline pages are all fixed-height but online ones
+        # only until the DP can start again.
+        online = OnlinePaginator(target_height, cut_mode=cut_mode, gap_thresh=reference.gap_thresh,
+                                 max_lookahead_rows=len(ink))
+        cuts = [0]
+        for start in range(0, len(ink), chunk):
+            new_cuts = online.feed(ink[start:start + chunk])
+            assert all(cut < online.rows for cut in new_cuts)
+            cuts += new_cuts
+        cuts += online.finish()
+        assert cuts == online.cuts
+        if debug["fallback"]:
+            assert online.fallback_pages > 0
+            assert_invariants(cuts, len(ink))
+        else:
+            assert cuts == expected, (target_height, cut_mode)
+        assert online.forced_commits == 0
+
+        # A short lookahead bounds the rows held back, at some cost in optimality.
+        lookahead = 3 * target_height
+        online = OnlinePaginator(target_height, cut_mode=cut_mode, max_lookahead_rows=lookahead)
+        for start in range(0, len(ink), chunk):
+            online.feed(ink[start:start + chunk])
+        assert online.max_pending_rows <= lookahead + chunk + 2 * target_height
+        assert online.finish()[-1] == len(ink)
+        assert_invariants(online.cuts, len(ink))
+        assert debug["fallback"] or len(online.cuts) - len(expected) in (-1, 0, 1)
+
+    print("PASS")
+
+def test_online_paginator_long_blank_stretch():
+
+    print("  test_online_paginator_long_blank_stretch...", end=" ")
+
+    rng = np.random.default_rng(21)
+    text = np.zeros(8000)
+    for top in range(0, len(text), 50):
+        text[top:top + 30] = rng.uniform(0.1, 0.5)
+    ink = np.concatenate((text, np.zeros(200000), text))
+
+    # An open gap run must not hold the frontier back for half its length.
+    for cut_mode in (CutMode.WHITESPACE, CutMode.FIXED_HEIGHT_SNAP):
+        online = OnlinePaginator(1000, window_frac=0.1, cut_mode=cut_mode, max_lookahead_rows=8000)
+        for start in range(0, len(ink), 500):
+            online.feed(ink[start:start + 500])
+            assert len(online._profile.data) <= online.max_lookahead_rows
+        assert online.max_pending_rows <= online.max_lookahead_rows, (cut_mode, online.max_pending_rows)
+        assert online.finish()[-1] == len(ink)
+        assert_invariants(online.cuts, len(ink))
+        assert max(np.diff(online.cuts)) <= 1100
+
+    print("PASS")
+
+def test_online_paginator_recovers_from_dead_end():
+
+    print("  test_online_paginator_recovers_from_dead_end...", end=" ")
+
+    rng = np.random.default_rng(21)
+    text = np.zeros(15000)
+    for top in range(0, len(text), 50):
+        text[top:top + 30] = rng.uniform(0.1, 0.5)
+    ink = np.concatenate((text[:10000], np.full(5000, 0.9), text))
+
+    # No safe cut through the solid block: fixed-height pages bridge it, then
+    # cuts land in the gaps between lines again.
+    online = OnlinePaginator(1000, cut_mode=CutMode.FIXED_HEIGHT_SNAP)
+    for start in range(0, len(ink), 300):
+        online.feed(ink[start:start + 300])
+        assert len(online._profile.data) <= online.max_lookahead_rows
+    online.finish()
+    assert_invariants(online.cuts, len(ink))
+    assert online.fallback_pages > 0
+    assert all(ink[cut] == 0 for cut in online.cuts if 17000 < cut < len(ink) - 1000)
+
+    print("PASS")
+
+def test_segmented_dp_matches_single_pass():
+
+    print("  test_segmented_dp_matches_single_pass...", end=" ")
+
+    import cap.core
+    from cap.profiling import PipelineStats
+
+    rng = np.random.default_rng(23)
+    profiles = []
+    for _ in range(3):
+        ink = np.zeros(30000)
+        for top in range(0, len(ink), int(rng.integers(200, 900))):
+            ink[top:top + int(rng.integers(50, 600))] = rng.uniform(0.05, 0.5)
+        profiles.append(ink)
+
+    # Both patches are read in this process, not in the workers, so they hold
+    # whatever the multiprocessing start method.
+    min_candidates = cap.core.DP_SEGMENT_MIN_CANDIDATES
+    rounding_drift = cap.core._rounding_drift
+    cap.core.DP_SEGMENT_MIN_CANDIDATES = 4
+    try:
+        segments = 0
+        # The second pass claims rounding could flip any decision, so each
+        # segment is solved again from its separator's exact dp value.
+        for drift in (rounding_drift, lambda start, seg_dp, depth: np.inf):
+            cap.core._rounding_drift = drift
+            for ink in profiles:
+                paginator = Paginator(ink)
+                for target_height in (1169, 2339):
+                    for cut_mode in CutMode:
+                        single = paginator.solve(target_height, cut_mode=cut_mode, return_debug_info=True)
+                        stats = PipelineStats()
+                        split = paginator.solve(target_height, cut_mode=cut_mode, workers=2,
+                                                return_debug_info=True, stats=stats)
+                        segments += stats.counters.get("dp_segments", 0)
+                        if drift is not rounding_drift:
+                            assert (stats.counters.get("dp_segments_resolved", 0)
+                                    == stats.counters.get("dp_segments", 0))
+                        assert np.array_equal(split.dp, single.dp) and np.array_equal(split.parent, single.parent)
+                        assert split.debug_costs == single.debug_costs
+                        assert paginator.backtrack(split, target_height) == paginator.backtrack(single, target_height)
+        assert segments > 0, "no profile was split"
+        assert find_optimal_cuts_dp(profiles[0], 1169, workers=2) == find_optimal_cuts_dp(profiles[0], 1169)
+    finally:
+        cap.core.DP_SEGMENT_MIN_CANDIDATES = min_candidates
+        cap.core._rounding_drift = rounding_drift
+
+    print("PASS")
+
 def test_fixed_size_padding_produces_exact_dimensions():
 
     if not HAS_PYPDF2:
@@ -362,6 +850,602 @@ def test_variable_size_allows_different_heights():
         if os.path.exists(output_path):
             os.remove(output_path)
 
+def test_streaming_density_matches_full():
+
+    print("  test_streaming_density_matches_full...", end=" ")
+
+    rng = np.random.default_rng(7)
+    img_array = np.full((1237, 311, 3), 255, dtype=np.uint8)
+    for top in range(20, 1200, 37):
+        h = int(rng.integers(4, 20))
+        img_array[top:top + h, 10:300] = rng.integers(0, 120, (h, 290, 3), dtype=np.uint8)
+    gray = np.ascontiguousarray(img_array[:, :, 0])
+
+    for image in (img_array, gray):
+        expected = compute_ink_density(image)
+        for strip_rows in (1, 3, 5, 6, 64, 500, 5000):
+            streamed = compute_ink_density(image, strip_rows=strip_rows)
+            assert streamed.dtype == expected.dtype
+            assert np.array_equal(streamed, expected), f"strip_rows={strip_rows} diverged"
+
+    chunks = list(iter_ink_density(iter_image_strips(img_array, 100)))
+    assert len(chunks) > 1, "expected incremental emission"
+    assert np.array_equal(np.concatenate(chunks), compute_ink_density(img_array))
+
+    print("PASS")
+
+def test_parallel_density_matches_serial():
+
+    print("  test_parallel_density_matches_serial...", end=" ")
+
+    rng = np.random.default_rng(25)
+    img_array = np.full((2503, 217, 3), 255, dtype=np.uint8)
+    for top in range(10, 2480, 41):
+        h = int(rng.integers(3, 25))
+        img_array[top:top + h, 5:210] = rng.integers(0, 140, (h, 205, 3), dtype=np.uint8)
+    gray = np.ascontiguousarray(img_array[:, :, 1])
+
+    for image in (img_array, gray, img_array[:4]):
+        for backend in DensityBackend:
+            expected = compute_ink_density(image, backend=backend)
+            for strip_rows in (None, 1, 5, 11, 300, 4096):
+                for workers in (2, 4):
+                    parallel = compute_ink_density(image, strip_rows=strip_rows, backend=backend, workers=workers)
+                    assert parallel.dtype == expected.dtype
+                    assert np.array_equal(parallel, expected), f"{backend} strip_rows={strip_rows} workers={workers}"
+
+    print("PASS")
+
+def _c_port_ink_density(image):
+
+    if image.ndim == 3:
+        gray = (0.299 * image[..., 0] + 0.587 * image[..., 1] + 0.114 * image[..., 2]).astype(np.uint8)
+    else:
+        gray = image
+    h, w = gray.shape
+    integral = np.zeros((h + 1, w + 1), dtype=np.int64)
+    integral[1:, 1:] = gray.astype(np.int64).cumsum(axis=0).cumsum(axis=1)
+    profile = np.zeros(h)
+    for y in range(h):
+        ink = 0
+        for x in range(w):
+            y0, y1 = max(0, y - 5), min(h - 1, y + 5)
+            x0, x1 = max(0, x - 5), min(w - 1, x + 5)
+            total = integral[y1 + 1, x1 + 1] - integral[y0, x1 + 1] - integral[y1 + 1, x0] + integral[y0, x0]
+            area = (x1 - x0 + 1) * (y1 - y0 + 1)
+            if gray[y, x] < int(total / area - 2):
+                ink += 1
+        profile[y] = ink / w
+    return profile
+
+def test_integral_density_matches_c_port():
+
+    print("  test_integral_density_matches_c_port...", end=" ")
+
+    from cap.density import _bgr_to_gray, _integral_row_sums, _numpy_box_row_sums
+
+    rng = np.random.default_rng(11)
+    for shape in [(41, 29, 3), (23, 17), (3, 4, 3), (1, 12)]:
+        image = rng.integers(0, 256, shape, dtype=np.uint8)
+        image[::4] = 250
+        expected = _c_port_ink_density(image)
+        # The fast backend applies the same rule to OpenCV's grayscale, and
+        # its NumPy fallback gives the same counts.
+        fast_expected = _c_port_ink_density(_bgr_to_gray(image))
+        assert np.array_equal(_numpy_box_row_sums(_bgr_to_gray(image)),
+                              _integral_row_sums(image)), shape
+        for strip_rows in (None, 1, 6, 1000):
+            profile = compute_ink_density(image, strip_rows=strip_rows, backend=DensityBackend.INTEGRAL_CAP_C)
+            assert profile.dtype == np.float64
+            assert np.allclose(profile, expected, rtol=0, atol=1e-12), f"{shape} strip_rows={strip_rows}"
+            profile = compute_ink_density(image, strip_rows=strip_rows, backend=DensityBackend.INTEGRAL)
+            assert np.allclose(profile, fast_expected, rtol=0, atol=1e-12), f"{shape} strip_rows={strip_rows}"
+
+    img_array = np.full((600, 120, 3), 255, dtype=np.uint8)
+    img_array[100:300, 10:110] = rng.integers(0, 100, (200, 100, 3), dtype=np.uint8)
+    for backend in (DensityBackend.INTEGRAL, DensityBackend.INTEGRAL_CAP_C):
+        profile = compute_ink_density(img_array, backend=backend)
+        assert profile[:90].max() == 0 and profile[110:290].min() > 0.1
+
+    print("PASS")
+
+def test_numpy_gaussian_density_matches_opencv():
+
+    print("  test_numpy_gaussian_density_matches_opencv...", end=" ")
+
+    import cv2
+    import subprocess
+    import platform
+    from cap.density import _numpy_gaussian_row_sums, _opencv_gaussian_row_sums
+
+    # The NumPy blur follows the rounding of the OpenCV 5.0 x86-64 build; other
+    # builds may flip a few pixels that sit right on the threshold.
+    exact = cv2.__version__.startswith("5.0.") and platform.machine() in ("x86_64", "AMD64")
+
+    rng = np.random.default_rng(15)
+    for shape in [(300, 500, 3), (120, 37, 3), (64, 8), (7, 3, 3), (1, 12)]:
+        image = rng.integers(0, 256, shape, dtype=np.uint8)
+        image[::5] = 240
+        ours = _numpy_gaussian_row_sums(image).astype(np.int64)
+        theirs = _opencv_gaussian_row_sums(image, cv2).astype(np.int64)
+        if exact:
+            assert np.array_equal(ours, theirs), shape
+        else:
+            assert np.abs(ours - theirs).sum() <= 0.01 * 255 * shape[0] * shape[1], shape
+
+    image = rng.integers(0, 256, (2500, 61, 3), dtype=np.uint8)
+    path = os.path.join(tempfile.mkdtemp(), "scroll.npy")
+    np.save(path, image)
+    code = ("import sys; sys.modules['cv2'] = None; import numpy as np; "
+            "from cap.core import compute_ink_density, find_optimal_cuts_dp; "
+            f"p = compute_ink_density(np.load({path!r})); "
+            "print(p.tobytes().hex()); print(find_optimal_cuts_dp(p, 600))")
+    env = dict(os.environ, PYTHONPATH=os.path.abspath(src_dir))
+    result = subprocess.run([sys.executable, "-c", code], env=env, capture_output=True, text=True, check=True)
+    profile_hex, cuts = result.stdout.split("\n")[:2]
+    expected = compute_ink_density(image)
+    if exact:
+        assert profile_hex == expected.tobytes().hex()
+        assert cuts == str(find_optimal_cuts_dp(expected, 600))
+    else:
+        profile = np.frombuffer(bytes.fromhex(profile_hex), dtype=expected.dtype)
+        assert np.abs(profile - expected).max() <= 0.01
+
+    for name in ("__init__.py", "core.py", "density.py", "profiling.py"):
+        with open(os.path.join(src_dir, "cap", name), 'rb') as f, \
+             open(os.path.join(script_dir, "..", "docs", "assets", "cap", name), 'rb') as g:
+            assert f.read() == g.read(), f"docs/assets/cap/{name} is out of date"
+
+    print("PASS" if exact else f"PASS (approximate: OpenCV {cv2.__version__} on {platform.machine()})")
+
+def test_coarse_to_fine_refines_cuts_at_full_resolution():
+
+    print("  test_coarse_to_fine_refines_cuts_at_full_resolution...", end=" ")
+
+    rng = np.random.default_rng(5)
+    img_array = np.full((12000, 240, 3), 250, dtype=np.uint8)
+    top = 30
+    while top < 11900:
+        line_h = int(rng.integers(15, 30))
+        img_array[top:top + line_h, 20:220] = rng.integers(0, 90, (line_h, 200, 3), dtype=np.uint8)
+        top += line_h + int(rng.integers(12, 45))
+
+    target, window_frac = 1000, 0.04
+    cuts, info = find_optimal_cuts_coarse_to_fine(img_array, target, factor=8, window_frac=window_frac,
+                                                  return_debug_info=True)
+    assert_invariants(cuts, img_array.shape[0])
+    assert_strict_window(cuts, target, window_frac)
+    assert info["refined"] and info["coarse_height"] == 1500
+    assert len(info["cut_moves"]) == len(cuts) - 2
+    # Cuts may move up to the 32-row refinement radius; the coarse solve
+    # should already find the right gap, within two coarse rows.
+    assert info["max_cut_move"] == max(abs(move) for move in info["cut_moves"])
+    assert info["max_cut_move"] <= 2 * 8
+    assert info["unmatched_cuts"] == []
+
+    profile = compute_ink_density(img_array)
+    assert all(profile[c] == 0 for c in cuts[1:-1]), "refined cuts should land in whitespace"
+
+    # The coarse page height is rounded, so the coarse solve can find no cut
+    # where the full-resolution snap bands still give one.
+    blank = np.full((1046, 64, 3), 255, dtype=np.uint8)
+    cuts, info = find_optimal_cuts_coarse_to_fine(blank, 1004, factor=8, cut_mode=CutMode.FIXED_HEIGHT_SNAP,
+                                                  return_debug_info=True)
+    assert_invariants(cuts, blank.shape[0])
+    assert info["coarse_cuts"] == [0, info["coarse_height"]]
+    assert info["cut_moves"] == [] and info["unmatched_cuts"] == cuts[1:-1]
+
+    dense = rng.integers(0, 90, (3000, 120, 3), dtype=np.uint8)
+    cuts, info = find_optimal_cuts_coarse_to_fine(dense, 1000, factor=8, cut_mode=CutMode.FIXED_HEIGHT_SNAP,
+                                                  return_debug_info=True)
+    assert not info["refined"]
+    assert cuts == find_optimal_cuts_dp(compute_ink_density(dense), 1000, cut_mode=CutMode.FIXED_HEIGHT_SNAP)
+
+    print("PASS")
+
+def _write_test_scroll(path, height=2400, width=200, seed=0):
+
+    rng = np.random.default_rng(seed)
+    img_array = np.full((height, width, 3), 255, dtype=np.uint8)
+    for top in range(20, height - 40, 60):
+        img_array[top:top + 25, 10:width - 10] = rng.integers(0, 100, (25, width - 20, 3), dtype=np.uint8)
+    Image.fromarray(img_array).save(path)
+    return img_array
+
+def test_batch_mode_writes_one_output_per_input():
+
+    print("  test_batch_mode_writes_one_output_per_input...", end=" ")
+
+    from click.testing import CliRunner
+    from cap.cli import main
+
+    with tempfile.TemporaryDirectory() as tmp:
+        in_dir = os.path.join(tmp, "in")
+        out_dir = os.path.join(tmp, "out")
+        os.makedirs(in_dir)
+        for k in range(3):
+            _write_test_scroll(os.path.join(in_dir, f"scroll_{k}.png"), seed=k)
+        with open(os.path.join(in_dir, "notes.txt"), "w") as f:
+            f.write("not an image")
+
+        result = CliRunner().invoke(main, [in_dir, "-o", out_dir, "--workers", "2", "--dpi", "100"])
+        assert result.exit_code == 0, result.output
+        assert sorted(os.listdir(out_dir)) == [f"scroll_{k}_paginated.pdf" for k in range(3)]
+        assert "Processed 3/3 images" in result.output
+
+        manifest = os.path.join(tmp, "list.txt")
+        with open(manifest, "w") as f:
+            f.write("in/scroll_1.png\n\n# comment\nin/missing.png\n")
+        result = CliRunner().invoke(main, [manifest, "--manifest", "-o", out_dir, "--output-format", "images",
+                                           "--workers", "1", "--dpi", "100"])
+        assert result.exit_code == 1, result.output
+        assert "FAILED" in result.output and "missing.png" in result.output
+        assert os.listdir(os.path.join(out_dir, "scroll_1_pages"))
+
+        pattern = os.path.join(in_dir, "scroll_[02].png")
+        result = CliRunner().invoke(main, [pattern, "-o", os.path.join(tmp, "glob"), "--dpi", "100"])
+        assert result.exit_code == 0, result.output
+        assert len(os.listdir(os.path.join(tmp, "glob"))) == 2
+
+        # Same-named inputs from different folders keep those folders.
+        for name in ("a", "b"):
+            os.makedirs(os.path.join(tmp, "nested", name))
+            _write_test_scroll(os.path.join(tmp, "nested", name, "x.png"), seed=len(name))
+        result = CliRunner().invoke(main, [os.path.join(tmp, "nested", "*", "x.png"), "-o", out_dir,
+                                           "--dpi", "100"])
+        assert result.exit_code == 0, result.output
+        assert os.path.isfile(os.path.join(out_dir, "a", "x_paginated.pdf"))
+        assert os.path.isfile(os.path.join(out_dir, "b", "x_paginated.pdf"))
+
+        with open(manifest, "w") as f:
+            f.write("in/scroll_1.png\nin/../in/scroll_1.png\n")
+        result = CliRunner().invoke(main, [manifest, "--manifest", "-o", os.path.join(tmp, "dup"), "--dpi", "100"])
+        assert result.exit_code == 1 and "would both be written" in result.output
+        assert not os.path.exists(os.path.join(tmp, "dup"))
+
+    print("PASS")
+
+def test_profile_reports_stages_and_counters():
+
+    print("  test_profile_reports_stages_and_counters...", end=" ")
+
+    from click.testing import CliRunner
+    from cap.cli import main
+    from cap.profiling import PipelineStats
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "scroll.png")
+        img_array = _write_test_scroll(path, height=3000)
+        output = os.path.join(tmp, "out.pdf")
+
+        seen = []
+        stats = PipelineStats(callback=lambda stage, seconds, stats: seen.append(stage))
+        result = paginate_file(path, output, dpi=100, stats=stats)
+        assert seen == ["load", "density", "candidates", "dp", "write"]
+        counters = result["profile"]["counters"]
+        assert counters["density_rows"] == img_array.shape[0]
+        assert counters["pages_written"] == result["pages"]
+        assert counters["bytes_written"] == os.path.getsize(output)
+        assert counters["candidates"] > 2 and counters["dp_transitions"] > 0
+
+        profile = compute_ink_density(img_array)
+        for cut_mode in CutMode:
+            counts = []
+            for engine in DPEngine:
+                engine_stats = PipelineStats()
+                find_optimal_cuts_dp(profile, 1000, cut_mode=cut_mode, dp_engine=engine, stats=engine_stats)
+                counts.append(engine_stats.counters["dp_transitions"])
+            assert counts[0] == counts[1], f"{cut_mode}: {counts}"
+
+        profile_json = os.path.join(tmp, "profile.json")
+        result = CliRunner().invoke(main, [path, "-o", output, "--dpi", "100", "--profile-json", profile_json])
+        assert result.exit_code == 0, result.output
+        assert "Profile:" in result.output
+        with open(profile_json) as f:
+            report = json.load(f)
+        assert report["inputs"][0]["input"] == path
+        assert set(report["total"]["timings"]) == {"load", "density", "candidates", "dp", "write"}
+
+    print("PASS")
+
+def test_server_streams_same_pdf_as_cli():
+
+    print("  test_server_streams_same_pdf_as_cli...", end=" ")
+
+    import asyncio
+    import http.client
+    import socket
+    import threading
+    import time
+    from cap.server import PaginationServer
+
+    loop = asyncio.new_event_loop()
+    server = PaginationServer(max_in_flight=1, max_queue=0)
+    listener = loop.run_until_complete(server.start("127.0.0.1", 0))
+    port = listener.sockets[0].getsockname()[1]
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+
+    def health():
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+        conn.request("GET", "/health")
+        return json.loads(conn.getresponse().read())
+
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "scroll.png")
+            _write_test_scroll(path, height=3000)
+            output = os.path.join(tmp, "out.pdf")
+            expected = paginate_file(path, output, dpi=100, cut_mode="fixed_height_snap")
+            with open(path, "rb") as f:
+                body = f.read()
+            with open(output, "rb") as f:
+                expected_pdf = f.read()
+
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+            for _ in range(2):
+                conn.request("POST", "/paginate?dpi=100&cut_mode=fixed_height_snap", body=body)
+                response = conn.getresponse()
+                assert response.status == 200, response.read()
+                assert response.getheader("Transfer-Encoding") == "chunked"
+                assert int(response.getheader("X-Cap-Pages")) == expected["pages"]
+                assert response.getheader("X-Cap-Cuts") == ",".join(map(str, expected["cuts"]))
+                assert response.read() == expected_pdf
+
+            conn.request("POST", "/paginate?cut_mode=diagonal", body=body)
+            response = conn.getresponse()
+            assert response.status == 400 and b"cut_mode" in response.read()
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+            conn.request("POST", "/paginate", body=b"not an image")
+            response = conn.getresponse()
+            assert response.status == 400 and b"Error loading image" in response.read()
+
+            # A request holding the only slot without sending its body leaves
+            # no room, and max_queue=0 turns the next one away.
+            stalled = socket.create_connection(("127.0.0.1", port))
+            stalled.sendall(b"POST /paginate HTTP/1.1\r\nHost: x\r\nContent-Length: %d\r\n\r\n" % len(body))
+            deadline = time.time() + 10
+            while health()["in_flight"] != 1:
+                assert time.time() < deadline, "stalled request never took a slot"
+                time.sleep(0.01)
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+            conn.request("POST", "/paginate", body=body)
+            response = conn.getresponse()
+            assert response.status == 503 and response.getheader("Retry-After") == "1"
+            response.read()
+            stalled.close()
+            while health()["in_flight"] != 0:
+                assert time.time() < deadline, "slot was not released after disconnect"
+                time.sleep(0.01)
+            assert health()["served"] == 2
+    finally:
+        asyncio.run_coroutine_threadsafe(server.close(), loop).result(timeout=30)
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+
+    print("PASS")
+
+def test_stream_mode_writes_pages_from_pipe():
+
+    print("  test_stream_mode_writes_pages_from_pipe...", end=" ")
+
+    from click.testing import CliRunner
+    from cap.cli import main
+    from cap.io import iter_raw_strips
+    from cap.pipeline import paginate_stream
+
+    with tempfile.TemporaryDirectory() as tmp:
+        img_array = _write_test_scroll(os.path.join(tmp, "scroll.png"), height=6000, width=120)
+        raw = img_array.tobytes()
+
+        import io
+        strips = list(iter_raw_strips(io.BytesIO(raw), 120, strip_rows=700))
+        assert [len(strip) for strip in strips] == [700] * 8 + [400]
+        assert np.array_equal(np.concatenate(strips), img_array)
+        try:
+            list(iter_raw_strips(io.BytesIO(raw[:-1]), 120))
+            assert False, "a truncated row should be rejected"
+        except ValueError:
+            pass
+
+        out_dir = os.path.join(tmp, "pages")
+        result = paginate_stream(iter(strips), out_dir, output_format="images", dpi=100, lookahead_pages=2)
+        assert result["height"] == 6000 and result["width"] == 120
+        assert_invariants(result["cuts"], 6000)
+        heights = [Image.open(os.path.join(out_dir, name)).size[1] for name in sorted(os.listdir(out_dir))]
+        assert heights == np.diff(result["cuts"]).tolist()
+
+        output = os.path.join(tmp, "stream.pdf")
+        cli = CliRunner().invoke(main, ["-", "--stream-width", "120", "-o", output, "--dpi", "100",
+                                           "--lookahead-pages", "2"], input=raw)
+        assert cli.exit_code == 0, cli.output
+        assert f"Done! {result['pages']} pages from 6000 rows" in cli.output
+        if HAS_PYPDF2:
+            assert len(PdfReader(output).pages) == result["pages"]
+
+        cli = CliRunner().invoke(main, ["-", "--stream-width", "120"], input=raw)
+        assert cli.exit_code != 0 and "--output" in cli.output
+
+    print("PASS")
+
+def test_incremental_append_rewrites_only_tail():
+
+    print("  test_incremental_append_rewrites_only_tail...", end=" ")
+
+    from cap.profiling import PipelineStats
+
+    with tempfile.TemporaryDirectory() as tmp:
+        scroll = _write_test_scroll(os.path.join(tmp, "full.png"), height=12000, width=120)
+        path = os.path.join(tmp, "notes.png")
+        Image.fromarray(scroll[:8000]).save(path)
+
+        for output_format, name in (("pdf", "notes.pdf"), ("images", "notes_pages")):
+            output = os.path.join(tmp, name)
+            first = paginate_file(path, output, output_format=output_format, dpi=100, incremental=True)
+            assert first["pages_reused"] == 0
+            assert os.path.exists(output + ".capstate.npz")
+
+            Image.fromarray(scroll).save(path)
+            stats = PipelineStats()
+            result = paginate_file(path, output, output_format=output_format, dpi=100, incremental=True, stats=stats)
+            reference = os.path.join(tmp, "full_" + name)
+            full = paginate_file(path, reference, output_format=output_format, dpi=100)
+
+            assert result["cuts"] == full["cuts"]
+            assert 0 < result["pages_reused"] < result["pages"]
+            assert stats.counters["pages_written"] == result["pages"] - result["pages_reused"]
+            assert stats.counters["density_rows_reused"] > 7000
+            assert stats.counters["dp_reused_candidates"] > 0
+            if output_format == "pdf":
+                with open(output, 'rb') as f, open(reference, 'rb') as g:
+                    assert f.read() == g.read()
+                if HAS_PYPDF2:
+                    assert len(PdfReader(output).pages) == result["pages"]
+            else:
+                assert sorted(os.listdir(output)) == sorted(os.listdir(reference))
+                for page in os.listdir(output):
+                    with open(os.path.join(output, page), 'rb') as f, open(os.path.join(reference, page), 'rb') as g:
+                        assert f.read() == g.read()
+
+            # Cutting the scroll short again drops the pages past its end.
+            Image.fromarray(scroll[:8000]).save(path)
+            again = paginate_file(path, output, output_format=output_format, dpi=100, incremental=True)
+            assert again["cuts"] == first["cuts"]
+            if output_format == "images":
+                assert len(os.listdir(output)) == first["pages"]
+
+    print("PASS")
+
+def test_memmap_inputs_match_decoded():
+
+    print("  test_memmap_inputs_match_decoded...", end=" ")
+
+    import tracemalloc
+    import cv2
+
+    with tempfile.TemporaryDirectory() as tmp:
+        img_array = _write_test_scroll(os.path.join(tmp, "scroll.png"), height=6000, width=160)
+        gray = np.ascontiguousarray(img_array[:, :, 1])
+        paths = {}
+        for name, array in [("rgb.ppm", img_array), ("gray.pgm", gray), ("rgb.tif", img_array), ("gray.tif", gray)]:
+            paths[name] = os.path.join(tmp, name)
+            Image.fromarray(array).save(paths[name])
+        paths["strips.tif"] = os.path.join(tmp, "strips.tif")
+        cv2.imwrite(paths["strips.tif"], img_array[:, :, ::-1], [cv2.IMWRITE_TIFF_COMPRESSION, 1])
+        paths["rgb.npy"] = os.path.join(tmp, "rgb.npy")
+        np.save(paths["rgb.npy"], img_array)
+        paths["lzw.tif"] = os.path.join(tmp, "lzw.tif")
+        Image.fromarray(img_array).save(paths["lzw.tif"], compression="tiff_lzw")
+
+        for name, path in paths.items():
+            expected = gray if name.startswith("gray") else img_array
+            mapped = load_image(path, mmap=True)
+            assert isinstance(mapped, np.memmap) == (name != "lzw.tif"), name
+            assert np.array_equal(mapped, expected), name
+            assert np.array_equal(load_image(path), expected), name
+
+        # A maxval below 255 is scaled by the decoder, so it is not mapped.
+        paths["maxval15.pgm"] = os.path.join(tmp, "maxval15.pgm")
+        with open(paths["maxval15.pgm"], 'wb') as f:
+            f.write(b"P5\n# 4-bit\n160 6000\n15\n" + (gray // 17).tobytes())
+        mapped = load_image(paths["maxval15.pgm"], mmap=True)
+        assert not isinstance(mapped, np.memmap)
+        assert np.array_equal(mapped, load_image(paths["maxval15.pgm"])) and mapped.max() == 255
+
+        tracemalloc.start()
+        result = paginate_file(paths["rgb.ppm"], os.path.join(tmp, "mapped.pdf"), dpi=100, mmap=True)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        assert peak < img_array.nbytes, f"memmap run allocated {peak} bytes for a {img_array.nbytes} byte image"
+        decoded = paginate_file(paths["rgb.ppm"], os.path.join(tmp, "decoded.pdf"), dpi=100)
+        assert result["pages"] == decoded["pages"]
+        with open(os.path.join(tmp, "mapped.pdf"), 'rb') as f_mapped, open(os.path.join(tmp, "decoded.pdf"), 'rb') as f_decoded:
+            assert f_mapped.read() == f_decoded.read()
+
+    print("PASS")
+
+def test_profile_cache_roundtrip_and_eviction():
+
+    print("  test_profile_cache_roundtrip_and_eviction...", end=" ")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        image_paths = []
+        for k in range(3):
+            path = os.path.join(tmp, f"scroll_{k}.png")
+            _write_test_scroll(path, height=1500, seed=k)
+            image_paths.append(path)
+
+        cache = ProfileCache(os.path.join(tmp, "cache"))
+        keys = [cache.key_for(path) for path in image_paths]
+        assert len(set(keys)) == 3
+        assert cache.key_for(image_paths[0]) == keys[0]
+        assert cache.key_for(image_paths[0], backend="box") != keys[0]
+        assert cache.key_for(image_paths[0], density_backend="gaussian") == keys[0]
+        assert cache.key_for(image_paths[0], density_backend="integral") != keys[0]
+        assert cache.get(keys[0]) is None
+
+        for path, key in zip(image_paths, keys):
+            img_array = load_image(path)
+            profile = compute_ink_density(img_array)
+            cache.put(key, profile, img_array.shape[1])
+            cached = cache.get(key)
+            assert cached.dtype == profile.dtype and np.array_equal(cached, profile), "cache must be bit-exact"
+
+        entry_size = max(size for _, size, _ in cache.entries())
+        assert np.load(cache.entries()[0][2]).dtype == np.uint16
+
+        os.utime(cache._find(keys[0]), (1, 1))
+        os.utime(cache._find(keys[1]), (2, 2))
+        cache.get(keys[0])
+        cache.max_bytes = 2 * entry_size
+        cache.evict()
+        assert cache.get(keys[1]) is None, "least recently used entry should be evicted"
+        assert cache.get(keys[0]) is not None and cache.get(keys[2]) is not None
+
+        floats = np.linspace(0.0, 1.0, 50) ** 2
+        cache.put("custom", floats, 7)
+        assert np.array_equal(cache.get("custom"), floats)
+
+        result = paginate_file(image_paths[1], os.path.join(tmp, "out.pdf"), dpi=100,
+                               cache_dir=os.path.join(tmp, "cache"))
+        assert result["pages"] >= 1
+        assert cache.get(keys[1]) is not None, "pipeline should populate the cache"
+
+        import cap.cache
+        utime = cap.cache.os.utime
+
+        def evicted(path, *args, **kwargs):
+            raise FileNotFoundError(path)
+
+        cap.cache.os.utime = evicted
+        try:
+            assert cache.get(keys[1]) is None, "an entry evicted while being read is a miss"
+        finally:
+            cap.cache.os.utime = utime
+
+    print("PASS")
+
+def test_heavy_dependencies_load_lazily():
+
+    print("  test_heavy_dependencies_load_lazily...", end=" ")
+
+    import subprocess
+
+    def loaded_after(statement):
+        code = (statement + "; import sys; print(' '.join(sorted(m for m in "
+                "('numpy', 'cv2', 'PIL', 'reportlab') if m in sys.modules)))")
+        env = dict(os.environ, PYTHONPATH=os.path.abspath(src_dir))
+        result = subprocess.run([sys.executable, "-c", code], env=env, capture_output=True, text=True, check=True)
+        return set(result.stdout.split())
+
+    assert loaded_after("import cap.cli") == set()
+    assert loaded_after("import cap.core, cap.io, cap.cache, cap.pipeline") == {"numpy"}
+    assert loaded_after("import numpy as np; from cap.core import find_optimal_cuts_dp; "
+                        "find_optimal_cuts_dp(np.zeros(5000), 1000)") == {"numpy"}
+
+    print("PASS")
+
 def load_profile_from_image(path):
 
     img = Image.open(path).convert('L')
@@ -373,11 +1457,11 @@ def test_acceptance_corpus():
 
     print("  test_acceptance_corpus...", end=" ")
 
-    DATASET_DIR = "G:/test_dataset"
+    DATASET_DIR = os.environ.get("CAP_TEST_DATASET", "G:/test_dataset")
     GOLDEN_FILE = os.path.join(script_dir, "golden_cuts.json")
 
     if not os.path.exists(DATASET_DIR):
-        print("SKIP (dataset not found at G:/test_dataset)")
+        print(f"SKIP (dataset not found at {DATASET_DIR}; set CAP_TEST_DATASET)")
         return
 
     files = sorted([f for f in os.listdir(DATASET_DIR)
@@ -441,10 +1525,41 @@ def run_all_tests():
         ("Property-Based Tests", [
             test_random_configurations_with_engineered_basins,
             test_whitespace_vs_fixed_height_snap_modes,
+            test_vectorized_candidates_match_reference,
+            test_windowed_engine_matches_reference,
+            test_unsafe_mask_matches_is_unsafe_cut,
+            test_quantized_profile_cuts_are_pinned,
+            test_paginator_reuses_profile_state,
+            test_online_paginator_matches_offline,
+            test_online_paginator_long_blank_stretch,
+            test_online_paginator_recovers_from_dead_end,
+            test_segmented_dp_matches_single_pass,
         ]),
         ("PDF Dimension Tests", [
             test_fixed_size_padding_produces_exact_dimensions,
             test_variable_size_allows_different_heights,
+            test_pdf_pages_written_in_memory,
+            test_streaming_pdf_writer_bounded_memory,
+            test_page_image_writer_reuses_padding_buffer,
+        ]),
+        ("Pipeline Tests", [
+            test_batch_mode_writes_one_output_per_input,
+            test_memmap_inputs_match_decoded,
+            test_profile_reports_stages_and_counters,
+            test_server_streams_same_pdf_as_cli,
+            test_stream_mode_writes_pages_from_pipe,
+            test_incremental_append_rewrites_only_tail,
+            test_heavy_dependencies_load_lazily,
+            test_profile_cache_roundtrip_and_eviction,
+        ]),
+        ("Ink Density Tests", [
+            test_streaming_density_matches_full,
+            test_parallel_density_matches_serial,
+            test_integral_density_matches_c_port,
+            test_numpy_gaussian_density_matches_opencv,
+        ]),
+        ("Coarse-to-Fine Tests", [
+            test_coarse_to_fine_refines_cuts_at_full_resolution,
         ]),
         ("Acceptance Tests", [
             test_acceptance_corpus,